@@ -71,14 +71,23 @@ optional arguments:
 
 """
 
+import os
 import sys
 import requests
 import argparse
-import operator
 import datetime
 import unicodedata
+from plexapi.exceptions import NotFound
 from plexapi.server import PlexServer, CONFIG
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+from jbops.choices import CachedChoices
+from jbops.cache import cache_path
+from jbops.fanout import fan_out
+from jbops.plexusers import UserTokens
+from jbops.snapshot import SectionSnapshot
+
 ### EDIT SETTINGS ###
 
 PLEX_URL = ''
@@ -100,6 +109,15 @@ if not TAUTULLI_APIKEY:
 # Defaults
 DAYS = 30
 TOP = 5
+# Users whose playlists are created or deleted at the same time.
+WORKERS = 8
+# Rating keys looked up per request when checking what a user may see.
+VISIBLE_BATCH = 100
+
+# Listing type of the items whose air dates are indexed per library type.
+AIRDATE_TYPES = {'movie': 1, 'show': 4}
+
+AIRDATE_COLUMNS = [('aired', 'TEXT'), ('month', 'INTEGER'), ('day', 'INTEGER'), ('week', 'INTEGER')]
 
 sess = requests.Session()
 # Ignore verifying the SSL certificate
@@ -112,15 +130,34 @@ if sess.verify is False:
     import urllib3
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-plex = PlexServer(PLEX_URL, PLEX_TOKEN, session=sess)
-account = plex.myPlexAccount()
+plex = None
+account = None
+user_tokens = None
+
+
+def plex_server():
+    """Connect to Plex the first time it is needed, not at import."""
+    global plex, account, user_tokens
+    if plex is None:
+        plex = PlexServer(PLEX_URL, PLEX_TOKEN, session=sess)
+        account = plex.myPlexAccount()
+        user_tokens = UserTokens(account, plex)
+    return plex
+
 
-user_lst = [x.title for x in plex.myPlexAccount().users()]
-section_lst = [x.title for x in plex.library.sections()]
-playlist_lst = [x.title for x in plex.playlists()]
+user_choices = CachedChoices('plex_users', lambda: [x.title for x in plex_server().myPlexAccount().users()
+                                                    if x.title], key=PLEX_URL)
+section_choices = CachedChoices('plex_sections', lambda: [x.title for x in plex_server().library.sections()],
+                                key=PLEX_URL)
+
+playlist_choices = CachedChoices('plex_playlists', lambda: [x.title for x in plex_server().playlists()],
+                                 key=PLEX_URL)
 today = datetime.datetime.now().date()
 weeknum = datetime.date(today.year, today.month, today.day).isocalendar()[1]
 
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+
+
 def actions():
     """
     add - create new playlist for admin or users
@@ -156,56 +193,78 @@ def selectors():
 
 def get_home_stats(time_range, stats_count):
     # Get the homepage watch statistics.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_home_stats',
-               'time_range': time_range,
+    payload = {'time_range': time_range,
                'stats_count': stats_count,
                'stats_type': 0} # stats_type = plays
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']
+        res_data = tautulli.api_call('get_home_stats', payload)
         return res_data
 
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_home_stats' request failed: {0}.".format(e))
 
 
-def sort_by_dates(video, date_type):
-    """Find air dates of content
+class AirDateIndex(SectionSnapshot):
+    def __init__(self, server):
+        """Original air dates of the movies and episodes of a server.
+
+        One SQLite file per server with the month, day and ISO week each item
+        aired, so the history playlists are index lookups instead of a walk
+        through every show.
+
+        Parameters
+        ----------
+        server: Object
+            plexServerObject
+        """
+        SectionSnapshot.__init__(self, cache_path('playlist_manager', '{}.sqlite'.format(server.machineIdentifier)),
+                                 'airdates', AIRDATE_COLUMNS, indexes=[('month', 'day'), ('week',)])
+
+    def aired(self, section_keys, date_type):
+        """Rating keys of the items that aired on this day, week or month in history.
+
+        Parameters
+        ----------
+        section_keys: list
+            Sections to search.
+        date_type: str
+            historyToday, historyWeek or historyMonth
+
+        Returns
+        -------
+        list
+            Rating keys sorted by original air date, oldest first.
+        """
+        if date_type == 'historyToday':
+            where, args = 'month = ? AND day = ?', [today.month, today.day]
+        elif date_type == 'historyWeek':
+            where, args = 'week = ?', [weeknum]
+        else:
+            where, args = 'month = ?', [today.month]
+        query = 'SELECT rating_key FROM airdates WHERE {} AND section_key IN ({}) ORDER BY aired'.format(
+            where, ', '.join('?' * len(section_keys)))
+        return [row[0] for row in self.db.execute(query, args + list(section_keys))]
 
-    Parameters
-    ----------
-    video
-        video object to find air date
 
-    Returns
-    -------
-    list
-        list of rating key and date aired
-    """
+def parse_airdate(elem):
+    """Index row of a movie or episode of a library listing."""
+    row = {'rating_key': int(elem.attrib['ratingKey']),
+           'aired': elem.attrib.get('originallyAvailableAt'),
+           'month': None,
+           'day': None,
+           'week': None,
+           'updated_at': int(elem.attrib.get('updatedAt') or 0)}
+    if row['aired']:
+        date = datetime.datetime.strptime(row['aired'], '%Y-%m-%d').date()
+        row.update(month=date.month, day=date.day, week=date.isocalendar()[1])
+    return row
 
-    try:
-        ad_year = video.originallyAvailableAt.year
-        ad_month = video.originallyAvailableAt.month
-        ad_day = video.originallyAvailableAt.day
-        ad_week = int(datetime.date(ad_year, ad_month, ad_day).isocalendar()[1])
 
-        if date_type == 'historyToday':
-            if ad_month == today.month and ad_day == today.day:
-                return [[video.ratingKey] + [str(video.originallyAvailableAt)]]
-        if date_type == 'historyWeek':
-            if ad_week == weeknum:
-                return [[video.ratingKey] + [str(video.originallyAvailableAt)]]
-        if date_type == 'historyMonth':
-            if ad_month == today.month:
-                return [[video.ratingKey] + [str(video.originallyAvailableAt)]]
-
-    # todo-me return object
-    except Exception as e:
-        # print(e)
-        return
+def update_airdates(section, index):
+    """Bring the air date index of a library up to date."""
+    path = '/library/sections/{}/all?type={}'.format(section.key, AIRDATE_TYPES[section.type])
+    index.update(plex, str(section.key), path, parse_airdate)
 
 
 def get_content(library_name, jbop, search=None):
@@ -255,26 +314,16 @@ def get_content(library_name, jbop, search=None):
         play_lst = child_lst
 
     else:
+        index = AirDateIndex(plex)
+        section_keys = []
         for library in library_name:
-            for child in plex.library.section(library).all():
-                if child.type == 'movie':
-                    if sort_by_dates(child, jbop):
-                        item_date = sort_by_dates(child, jbop)
-                        child_lst += item_date
-                elif child.type == 'show':
-                    for episode in child.episodes():
-                        if sort_by_dates(episode, jbop):
-                            item_date = sort_by_dates(episode, jbop)
-                            child_lst += item_date
-                else:
-                    pass
+            section = plex.library.section(library)
+            if section.type in AIRDATE_TYPES:
+                update_airdates(section, index)
+                section_keys.append(str(section.key))
 
-        # Sort by original air date, oldest first
-        # todo-me move sorting and add more sorting options
-        aired_lst = sorted(child_lst, key=operator.itemgetter(1))
-    
-        # Remove date used for sorting
-        play_lst = [x[0] for x in aired_lst]
+        # Sorted by original air date, oldest first
+        play_lst = index.aired(section_keys, jbop)
 
     return play_lst
 
@@ -392,39 +441,139 @@ def show_playlist(playlist_title, playlist_keys):
     exit()
     
     
-def create_playlist(playlist_title, playlist_keys, server, user):
+def resolve_items(playlist_keys):
+    """Fetch the playlist items once as admin, shows expanded to their episodes.
+
+    Parameters
+    ----------
+    playlist_keys: list
+        Rating keys from build_playlist
+
+    Returns
+    -------
+    list
+        Movie and episode objects
+    """
+    def fetch(key):
+        try:
+            plex_obj = plex.fetchItem(key)
+            if plex_obj.type == 'show':
+                return plex_obj.episodes()
+            return [plex_obj]
+        except Exception as e:
+            print('Rating Key: {}, may have been deleted or moved.'.format(key))
+            # print("Error: {}".format(e))
+            return []
+
+    playlist_list = []
+    for items in fan_out(fetch, playlist_keys, workers=WORKERS):
+        playlist_list += items
+    return playlist_list
+
+
+def visible_keys(server, items):
+    """Rating keys of <items> the user of <server> may see.
+
+    Asks for the items by rating key as the user, a batch at a time. Plex
+    leaves out what the user's shared libraries, content rating and label
+    restrictions hide.
+    """
+    keys = [str(item.ratingKey) for item in items]
+    visible = set()
+    for i in range(0, len(keys), VISIBLE_BATCH):
+        try:
+            container = server.query('/library/metadata/{}'.format(','.join(keys[i:i + VISIBLE_BATCH])))
+        except NotFound:
+            continue
+        visible.update(elem.attrib.get('ratingKey') for elem in container)
+    return visible
+
+
+def create_playlist(playlist_title, playlist_items, server, user):
     """
     Parameters
     ----------
     playlist_title
-    playlist_keys
+    playlist_items
+        Items from resolve_items
     server
     user
     """
-    playlist_list = []
-    for key in playlist_keys:
-        try:
-            plex_obj = server.fetchItem(key)
-            if plex_obj.type == 'show':
-                for episode in plex_obj.episodes():
-                    playlist_list.append(episode)
+    if server is plex:
+        playlist_list = playlist_items
+    else:
+        visible = visible_keys(server, playlist_items)
+        playlist_list = []
+        for item in playlist_items:
+            if str(item.ratingKey) in visible:
+                playlist_list.append(item)
             else:
-                playlist_list.append(plex_obj)
-        except Exception as e:
-            try:
-                obj = plex.fetchItem(key)
-                print("{} may not have permission to this title: {}".format(user, obj.title))
-                # print("Error: {}".format(e))
-                pass
-            except Exception as e:
-                print('Rating Key: {}, may have been deleted or moved.'.format(key))
-                # print("Error: {}".format(e))
+                print("{} may not have permission to this title: {}".format(user, item.title))
 
     if playlist_list:
         server.createPlaylist(playlist_title, playlist_list)
         print("...Added {title} playlist to '{user}'.".format(title=playlist_title, user=user))
 
 
+def connect_users(users):
+    """Connect to the server as each user, concurrently.
+
+    Parameters
+    ----------
+    users: list
+        User titles
+
+    Returns
+    -------
+    list
+        [{'server': plexServerObject, 'user': user title}, ..] of the users
+        that could be connected.
+    """
+    # Look every user up before connecting, so a user missing from the
+    # cached tokens refreshes them once instead of once per thread.
+    for user in users:
+        user_tokens.token(user)
+
+    def connect(user):
+        try:
+            return user, user_tokens.connect(user), None
+        except Exception as e:
+            return user, None, e
+
+    plex_servers = []
+    for user, server, error in fan_out(connect, users, workers=WORKERS):
+        if error:
+            sys.stderr.write("Connecting as {} failed: {}.\n".format(user, error))
+        else:
+            plex_servers.append({'server': server, 'user': user})
+    return plex_servers
+
+
+def for_each_user(func, plex_servers):
+    """Call func(x) for each user's server dict on a pool of WORKERS threads.
+
+    Progress is printed as users finish and the failed users are listed at
+    the end instead of stopping the run.
+    """
+    def run(x):
+        try:
+            func(x)
+        except Exception as e:
+            return x['user'], e
+        return x['user'], None
+
+    failed = []
+    total = len(plex_servers)
+    for done, (user, error) in enumerate(fan_out(run, plex_servers, workers=WORKERS, ordered=False), 1):
+        if error:
+            failed.append(user)
+            sys.stderr.write("[{}/{}] {} failed: {}.\n".format(done, total, user, error))
+        else:
+            print("[{}/{}] {} done.".format(done, total, user))
+    if failed:
+        sys.stderr.write("Failed for {} of {} users: {}\n".format(len(failed), total, ', '.join(failed)))
+
+
 def delete_playlist(playlist_dict):
     """
     Parameters
@@ -465,9 +614,8 @@ def delete_playlist(playlist_dict):
                     playlist.delete()
                     print("...Deleted {playlist.title} for '{user}'."
                           .format(playlist=playlist, user=user))
-
-    except:
-        # print("Playlist not found on '{user}' account".format(user=user))
+    except NotFound:
+        # The playlist was already deleted, other errors reach for_each_user.
         pass
 
 
@@ -482,12 +630,12 @@ if __name__ == "__main__":
     parser.add_argument('--action', required=True, choices=actions(),
                         help='Action selector.'
                              '{}'.format(actions.__doc__))
-    parser.add_argument('--user', nargs='+', choices=user_lst, metavar='',
+    parser.add_argument('--user', nargs='+', choices=user_choices, metavar='',
                         help='The Plex usernames to create/share to or delete from. Allowed names are:\n'
                              'Choices: %(choices)s')
     parser.add_argument('--allUsers', default=False, action='store_true',
                         help='Select all users.')
-    parser.add_argument('--libraries', nargs='+', choices=section_lst, metavar='',
+    parser.add_argument('--libraries', nargs='+', choices=section_choices, metavar='',
                         help='Space separated list of case sensitive names to process. Allowed names are:\n'
                              'Choices: %(choices)s')
     parser.add_argument('--self', default=False, action='store_true',
@@ -499,7 +647,7 @@ if __name__ == "__main__":
     parser.add_argument('--top', type=str, default=TOP,
                         help='The number of top items to list.\n'
                              'Default: %(default)s')
-    parser.add_argument('--playlists', nargs='+', choices=playlist_lst, metavar='',
+    parser.add_argument('--playlists', nargs='+', choices=playlist_choices, metavar='',
                         help='Space separated list of case sensitive names to process. Allowed names are:\n'
                              'Choices: %(choices)s')
     parser.add_argument('--name', type=str,
@@ -513,6 +661,9 @@ if __name__ == "__main__":
                              'filter types (genre, actors, director, studio, etc.')
     
     opts = parser.parse_args()
+    plex_server()
+    # The choices may be a day old, act on what Plex has now.
+    user_lst = [x.title for x in account.users() if x.title]
 
     users = ''
     search = ''
@@ -541,27 +692,24 @@ if __name__ == "__main__":
     
     # Create user server objects
     if users:
-        for user in users:
-            if opts.action == 'share':
-                print("Sharing playlist(s)...")
-                share_playlists(opts.playlists, users)
-            user_acct = account.user(user)
-            plex_servers.append({
-                'server': PlexServer(PLEX_URL, user_acct.get_token(plex.machineIdentifier)),
-                'user': user})
+        if opts.action == 'share':
+            print("Sharing playlist(s)...")
+            share_playlists(opts.playlists, users)
+        plex_servers = connect_users(users)
         if opts.self:
             plex_servers.append({'server': plex,
                                  'user': 'admin'})
     else:
         plex_servers.append({'server': plex,
                             'user': 'admin'})
-            
+
+    def delete_for(x):
+        user_dict = dict(playlist_dict, server=x['server'], user=x['user'])
+        delete_playlist(user_dict)
+
     if opts.action == 'remove':
         print("Deleting the playlist(s)...")
-        for x in plex_servers:
-            playlist_dict['server'] = x['server']
-            playlist_dict['user'] = x['user']
-            delete_playlist(playlist_dict)
+        for_each_user(delete_for, plex_servers)
 
     else:
         keys_list, title = build_playlist(opts.jbop, opts.libraries, opts.days, opts.top, search)
@@ -571,18 +719,13 @@ if __name__ == "__main__":
 
     if opts.action == 'update':
         print("Deleting the playlist(s)...")
-        for x in plex_servers:
-            playlist_dict['server'] = x['server']
-            playlist_dict['user'] = x['user']
-            delete_playlist(playlist_dict)
-        print('Creating playlist(s)...')
-        for x in plex_servers:
-            create_playlist(title.title(), keys_list, x['server'], x['user'])
-            
-    if opts.action == 'add':
+        for_each_user(delete_for, plex_servers)
+
+    if opts.action in ('add', 'update'):
         print('Creating playlist(s)...')
-        for x in plex_servers:
-            create_playlist(title.title(), keys_list, x['server'], x['user'])
+        playlist_items = resolve_items(keys_list)
+        for_each_user(lambda x: create_playlist(title.title(), playlist_items, x['server'], x['user']),
+                      plex_servers)
 
     if opts.action == 'show':
         print("Displaying the user's playlist(s)...")
@@ -0,0 +1,10 @@
+"""
+Shared helpers used by the JBOPS scripts.
+
+Scripts live in their own folders and are launched directly by Tautulli or
+cron, so each one adds the repository root to ``sys.path`` before importing
+from this package:
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    from jbops.tautulli import Tautulli
+"""
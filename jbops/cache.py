@@ -0,0 +1,36 @@
+"""
+Description: Location of the on-disk caches kept by the shared helpers.
+Author: Blacktwin
+Requires:
+
+Everything is stored under ~/.cache/jbops unless JBOPS_CACHE_DIR is set, ex.
+when Tautulli runs the scripts as a user without a home directory. Folders
+are created readable by their owner only, some caches hold Plex tokens.
+"""
+
+import os
+import errno
+
+
+CACHE_DIR = os.getenv('JBOPS_CACHE_DIR',
+                      os.path.join(os.path.expanduser('~'), '.cache', 'jbops'))
+
+
+def cache_path(*names):
+    """Return the path of a cache file, creating its folder if needed.
+
+    Parameters
+    ----------
+    names : str
+        Path components below CACHE_DIR, ex. cache_path('history.sqlite').
+    """
+    path = os.path.join(CACHE_DIR, *names)
+    # makedirs() only applies the mode to the last folder, create the cache
+    # folder itself first.
+    for folder in (CACHE_DIR, os.path.dirname(path)):
+        try:
+            os.makedirs(folder, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    return path
@@ -0,0 +1,140 @@
+"""
+Description: Lazy, disk cached argparse choices.
+Author: Blacktwin
+Requires: nothing outside the standard library
+
+Several scripts fill argparse choices with Plex users, libraries or playlists
+when they are imported, so even --help has to wait for plex.tv. A
+CachedChoices object can be passed as choices instead of a list. The names
+are only loaded when argparse needs them (building --help or checking a
+value), come from a json cache file and are refreshed in the background once
+the cache is older than its TTL. A name missing from the cache triggers one
+synchronous refresh before it is rejected, so a user shared today is not
+refused because of yesterday's cache.
+
+Usage:
+    user_choices = CachedChoices('users', lambda: [x.title for x in account().users()],
+                                 key=PLEX_URL)
+    parser.add_argument('--user', nargs='+', choices=user_choices, metavar='',
+                        help='(choices: %(choices)s)')
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+
+from jbops.cache import cache_path
+
+
+# Seconds before cached choices are refreshed in the background.
+TTL = 24 * 60 * 60
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _write(path, value):
+    # Write to a temporary file first so an interrupted refresh never leaves
+    # a half written cache behind. Its name is unique, a background and a
+    # synchronous refresh of the same process may write at the same time.
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(path) + '.',
+                               dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'time': time.time(), 'value': value}, f)
+    if hasattr(os, 'replace'):
+        os.replace(tmp, path)
+    else:
+        os.rename(tmp, path)
+
+
+class CachedChoices(object):
+    def __init__(self, name, loader, key='', ttl=TTL):
+        """Choices loaded on first use and cached on disk.
+
+        Parameters
+        ----------
+        name : str
+            Name of the cache file.
+        loader : callable
+            Returns the list of choices, only called when the cache is
+            missing, expired or lacks a name. The values must be json
+            serializable.
+        key : str
+            Separates caches of the same name, ex. the Plex URL.
+        ttl : int
+            Seconds before the cache is refreshed in the background.
+        """
+        digest = hashlib.md5((key or '').encode('utf-8')).hexdigest()[:8]
+        self.path = cache_path('choices', '{}-{}.json'.format(name, digest))
+        self.loader = loader
+        self.ttl = ttl
+        self._values = None
+        self._fresh = False
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Call the loader and save its result."""
+        values = list(self.loader())
+        _write(self.path, values)
+        with self._lock:
+            self._values = values
+            self._fresh = True
+        return values
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception:
+            # Keep using the stale names, the next run tries again.
+            pass
+
+    def load(self):
+        """Return the choices, from the cache when there is one."""
+        with self._lock:
+            if self._values is not None:
+                return self._values
+
+        cached = _read(self.path)
+        if cached is None:
+            return self.refresh()
+
+        with self._lock:
+            self._values = cached['value']
+        if time.time() - cached['time'] > self.ttl:
+            thread = threading.Thread(target=self._refresh_quietly)
+            thread.daemon = True
+            thread.start()
+        return self._values
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+    def __contains__(self, value):
+        if value in self.load():
+            return True
+        if not self._fresh:
+            return value in self.refresh()
+        return False
+
+    def __repr__(self):
+        return repr(self.load())
+
+
+def cached_value(name, loader, key='', ttl=TTL):
+    """Return loader() through the same cache as CachedChoices.
+
+    For single values argparse needs before parsing, ex. whether the account
+    has Plex Pass.
+    """
+    return CachedChoices(name, lambda: [loader()], key, ttl).load()[0]
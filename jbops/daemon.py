@@ -0,0 +1,210 @@
+"""
+Description: Run script entry points in a resident process over a Unix socket.
+Author: Blacktwin
+Requires: nothing outside the standard library
+
+Tautulli starts a new Python process for every notification. For the
+killstream scripts that means paying for the interpreter, the plexapi import
+and the Plex/Tautulli handshakes on every Playback Start. serve() keeps the
+scripts imported in one process and runs their main(argv) for each event it
+receives on a Unix socket, forward() is the client side used by the shim that
+Tautulli calls instead of the script.
+
+Protocol: the client sends one json line {"script": name, "argv": [...]}.
+The server answers with json lines {"stdout": text}, {"stderr": text} and
+finally {"exit": code}.
+
+Usage:
+    # daemon
+    serve(SOCKET_PATH, {'kill_stream': kill_stream.main})
+    # shim
+    sys.exit(forward(SOCKET_PATH, 'kill_stream', sys.argv[1:]))
+"""
+
+import os
+import sys
+import errno
+import json
+import socket
+import threading
+import traceback
+
+try:
+    import socketserver
+except ImportError:
+    # Python 2
+    import SocketServer as socketserver
+
+from jbops.cache import CACHE_DIR
+
+
+# In the per-user cache folder rather than /tmp, where another user could
+# create the socket first.
+SOCKET_PATH = os.getenv('JBOPS_SOCKET') or os.path.join(CACHE_DIR, 'jbops.sock')
+
+
+class _ThreadOutput(object):
+    """sys.stdout/sys.stderr replacement that sends each thread's output to
+    its own client and everything else to the original stream."""
+
+    def __init__(self, stream, key):
+        self.stream = stream
+        self.key = key
+        self.local = threading.local()
+
+    def write(self, text):
+        send = getattr(self.local, 'send', None)
+        if send is None:
+            return self.stream.write(text)
+        send({self.key: text})
+
+    def flush(self):
+        if getattr(self.local, 'send', None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            main = self.server.scripts[request['script']]
+            argv = request.get('argv', [])
+        except (ValueError, KeyError) as e:
+            self._send({'stderr': 'Bad request: {}\n'.format(e)})
+            self._send({'exit': 2})
+            return
+
+        sys.stdout.local.send = self._send
+        sys.stderr.local.send = self._send
+        try:
+            code = main(argv) or 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                code = e.code or 0
+            else:
+                # sys.exit('message')
+                self._send({'stderr': '{}\n'.format(e.code)})
+                code = 1
+        except Exception:
+            self._send({'stderr': traceback.format_exc()})
+            code = 1
+        finally:
+            sys.stdout.local.send = None
+            sys.stderr.local.send = None
+        self._send({'exit': code})
+
+    def _send(self, message):
+        try:
+            self.wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+            self.wfile.flush()
+        except (IOError, OSError):
+            # The client went away (Tautulli script timeout), keep running.
+            pass
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _listening(path):
+    """Whether a daemon answers on <path>. Removes a socket left behind by one that died."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error as e:
+        if e.errno == errno.ECONNREFUSED:
+            # Nobody accepts on it anymore.
+            os.remove(path)
+        elif e.errno != errno.ENOENT:
+            raise
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+def serve(path, scripts):
+    """Serve script entry points on a Unix socket until interrupted.
+
+    Parameters
+    ----------
+    path : str
+        Path of the Unix socket.
+    scripts : dict
+        {name: main} where main(argv) runs the script with a list of
+        command line arguments and returns or sys.exit()s the exit code.
+
+    Exits when another daemon is already listening on <path>.
+    """
+    try:
+        # Only the daemon's user may look into a folder created for it.
+        os.makedirs(os.path.dirname(os.path.abspath(path)), 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    if _listening(path):
+        sys.stderr.write('A daemon is already listening on {}.\n'.format(path))
+        sys.exit(1)
+    sys.stdout = _ThreadOutput(sys.stdout, 'stdout')
+    sys.stderr = _ThreadOutput(sys.stderr, 'stderr')
+
+    # Tautulli and the daemon should run as the same user. The umask makes
+    # bind() create the socket 0600, it is never open to others.
+    umask = os.umask(0o177)
+    try:
+        server = _Server(path, _Handler)
+    finally:
+        os.umask(umask)
+    server.scripts = scripts
+    sys.stdout.write('Listening on {} for: {}\n'.format(path, ', '.join(sorted(scripts))))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
+def forward(path, script, argv):
+    """Send a script run to the daemon and relay its output.
+
+    Parameters
+    ----------
+    path : str
+        Path of the daemon's Unix socket.
+    script : str
+        Name of the script registered with serve().
+    argv : list
+        Command line arguments for the script.
+
+    Returns
+    -------
+    int
+        The script's exit code.
+
+    Raises
+    ------
+    socket.error
+        The daemon is not running.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    try:
+        request = {'script': script, 'argv': argv}
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        for line in sock.makefile('rb'):
+            message = json.loads(line.decode('utf-8'))
+            if 'stdout' in message:
+                sys.stdout.write(message['stdout'])
+            elif 'stderr' in message:
+                sys.stderr.write(message['stderr'])
+            elif 'exit' in message:
+                return message['exit']
+    finally:
+        sock.close()
+    sys.stderr.write('Connection to {} closed before the script finished.\n'.format(path))
+    return 1
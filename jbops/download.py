@@ -0,0 +1,233 @@
+"""
+Description: Concurrent, resumable downloads of posters, art and theme songs.
+Author: Blacktwin
+Requires: requests, futures (Python 2 only)
+
+The poster, theme song and Imgur scripts fetched one file after another with
+urllib.urlretrieve, downloading everything again on every run and leaving
+half written files behind when interrupted. Downloader fetches on a small
+pool of threads and streams each file to a temporary file that is renamed
+over the target only once complete. A manifest keeps the ETag, Last-Modified
+and SHA-1 of every file it wrote, so the next run sends conditional requests
+and an interrupted run picks up where it stopped: finished files come back
+as 304 Not Modified, the rest are downloaded. Servers that ignore the
+conditional headers are caught by comparing content hashes, an identical
+file is not rewritten.
+
+Usage:
+    downloader = Downloader('posters', session=sess)
+    for url, path, status in downloader.download((url, path) for url, path in jobs):
+        print(status, path)
+"""
+
+import os
+import sys
+import time
+import errno
+import sqlite3
+import hashlib
+import tempfile
+
+import requests
+
+from jbops.cache import cache_path
+from jbops.fanout import fan_out, WORKERS
+
+
+# Bytes read from the response at a time.
+CHUNK_SIZE = 64 * 1024
+
+# mkstemp() creates files 0600, downloads get the mode open() would give them.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
+# Download results.
+DOWNLOADED = 'downloaded'
+UNCHANGED = 'unchanged'
+EXISTS = 'exists'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    url TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    sha1 TEXT,
+    size INTEGER,
+    checked INTEGER
+);
+"""
+
+
+def file_sha1(path):
+    """SHA-1 hex digest of a file, None if it cannot be read."""
+    digest = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+    except (IOError, OSError):
+        return None
+    return digest.hexdigest()
+
+
+def _replace(src, dst):
+    """Rename <src> over <dst>, also on Windows under Python 2."""
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+        return
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
+
+
+class Downloader(object):
+    def __init__(self, name=None, session=None, workers=WORKERS, timeout=60):
+        """Concurrent downloads with a manifest for conditional requests.
+
+        Parameters
+        ----------
+        name : str
+            Name of the manifest in the jbops cache folder, one per script.
+            None keeps no manifest, ex. for files that are deleted after use.
+        session : requests.Session
+            Session for the downloads, ex. one with verify=False for Plex.
+        workers : int
+            Number of files downloaded at the same time.
+        timeout : int
+            Seconds to wait for a server before a download fails.
+        """
+        self.session = session or requests.Session()
+        self.workers = workers
+        self.timeout = timeout
+        self.db = None
+        if name:
+            self.db = sqlite3.connect(cache_path('downloads', '{}.sqlite'.format(name)), timeout=60)
+            self.db.executescript(SCHEMA)
+
+    def _entry(self, path):
+        """Manifest row of <path> if the file is still the one written by the Downloader."""
+        if self.db is None or not os.path.isfile(path):
+            return None
+        row = self.db.execute('SELECT url, etag, last_modified, sha1, size FROM files WHERE path = ?',
+                              (path,)).fetchone()
+        if row is None or row[4] != os.path.getsize(path):
+            # Unknown, or changed by someone else since.
+            return None
+        return {'url': row[0], 'etag': row[1], 'last_modified': row[2], 'sha1': row[3], 'size': row[4]}
+
+    def _save(self, path, entry):
+        if self.db is None or entry is None:
+            return
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (path, entry['url'], entry['etag'], entry['last_modified'], entry['sha1'],
+                             entry['size'], int(time.time())))
+
+    def _fetch(self, job):
+        """Download one file. Runs in the pool, does not touch the manifest.
+
+        Returns
+        -------
+        tuple
+            (url, path, status, manifest entry or None)
+        """
+        url, path, entry = job
+        headers = {}
+        if entry and entry['url'] == url:
+            # A new url (ex. Plex thumbs carry the time they were updated) is
+            # always downloaded, the hash below still avoids rewriting the file.
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        tmp = None
+        try:
+            r = self.session.get(url, headers=headers, stream=True, timeout=self.timeout)
+            try:
+                if r.status_code == 304:
+                    return url, path, UNCHANGED, entry
+                r.raise_for_status()
+                digest = hashlib.sha1()
+                size = 0
+                # A unique name next to the target, threads and other runs
+                # writing the same file never share a temporary file.
+                fd, tmp = tempfile.mkstemp(suffix='.part', prefix=os.path.basename(path) + '.',
+                                           dir=os.path.dirname(path) or '.')
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in r.iter_content(CHUNK_SIZE):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        f.write(chunk)
+            finally:
+                r.close()
+
+            new_entry = {'url': url,
+                         'etag': r.headers.get('ETag'),
+                         'last_modified': r.headers.get('Last-Modified'),
+                         'sha1': digest.hexdigest(),
+                         'size': size}
+            old_sha1 = entry['sha1'] if entry else file_sha1(path) if os.path.isfile(path) else None
+            if new_entry['sha1'] == old_sha1:
+                os.remove(tmp)
+                return url, path, UNCHANGED, new_entry
+            os.chmod(tmp, FILE_MODE)
+            _replace(tmp, path)
+            return url, path, DOWNLOADED, new_entry
+        except (requests.exceptions.RequestException, IOError, OSError) as e:
+            sys.stderr.write("Download of '{}' failed: {}.\n".format(url, e))
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+            return url, path, FAILED, None
+
+    def download(self, jobs, keep_existing=False):
+        """Download many files at once.
+
+        Parameters
+        ----------
+        jobs : iterable
+            (url, path) pairs. Consumed lazily, the folders must exist.
+        keep_existing : bool
+            Leave files alone that exist but were not written by this
+            Downloader, ex. posters placed by hand. They are reported as
+            EXISTS. Files in the manifest are still checked for changes.
+
+        Yields
+        ------
+        tuple
+            (url, path, status) as downloads finish, status is one of
+            DOWNLOADED, UNCHANGED, EXISTS or FAILED. A path already in
+            <jobs> is not downloaded twice, it is reported as FAILED.
+        """
+        def prepared():
+            seen = set()
+            for url, path in jobs:
+                key = os.path.normcase(os.path.abspath(path))
+                if key in seen:
+                    sys.stderr.write("Download of '{}' skipped: '{}' is already being downloaded.\n"
+                                     .format(url, path))
+                    skipped.append((url, path, FAILED))
+                    continue
+                seen.add(key)
+                entry = self._entry(path)
+                if entry is None and keep_existing and os.path.exists(path):
+                    skipped.append((url, path, EXISTS))
+                    continue
+                yield url, path, entry
+
+        skipped = []
+        for url, path, status, entry in fan_out(self._fetch, prepared(), workers=self.workers, ordered=False):
+            # The manifest is only written here, from the calling thread.
+            self._save(path, entry)
+            while skipped:
+                yield skipped.pop()
+            yield url, path, status
+        for skipped_job in skipped:
+            yield skipped_job
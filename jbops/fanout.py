@@ -0,0 +1,113 @@
+"""
+Description: Bounded thread pool fan-out for per-item API calls.
+Author: Blacktwin
+Requires: futures (Python 2 only)
+
+Most of the time in the library scans is spent waiting on one get_metadata
+call after another. fan_out() runs those calls on a small pool of threads and
+yields the results as they come back, while never holding more than a few
+pending calls in memory, so an iterable of 40k rating keys can be streamed
+through it.
+
+RateLimit spaces out calls made from the pool for services like plex.tv
+that throttle bursts.
+
+Usage:
+    tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY, pool_maxsize=WORKERS)
+    for meta in fan_out(get_metadata, rating_keys, workers=WORKERS):
+        print(meta.title)
+"""
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+# Default number of concurrent calls. Tautulli is happy with a handful of
+# parallel requests, more than that mostly queues up on its side.
+WORKERS = 8
+
+
+def fan_out(func, iterable, workers=WORKERS, ordered=True, window=None):
+    """Call func(item) for every item concurrently and yield the results.
+
+    Parameters
+    ----------
+    func : callable
+        Called with one item. Exceptions raised by func are re-raised to the
+        caller when its result is yielded, so wrap func if one failure should
+        not end the scan.
+    iterable : iterable
+        Items to process, ex. rating keys. Consumed lazily.
+    workers : int
+        Number of threads. Use the same number for the Tautulli pool_maxsize.
+    ordered : bool
+        True yields results in the same order as <iterable>. False yields them
+        as soon as they complete.
+    window : int
+        Maximum number of submitted but not yet yielded calls. Defaults to
+        workers * 4.
+
+    Yields
+    ------
+    The return value of func for each item.
+    """
+    window = window or workers * 4
+    items = iter(iterable)
+    pending = deque() if ordered else set()
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit():
+        for item in items:
+            future = executor.submit(func, item)
+            if ordered:
+                pending.append(future)
+            else:
+                pending.add(future)
+            if len(pending) >= window:
+                return
+
+    try:
+        submit()
+        while pending:
+            if ordered:
+                future = pending.popleft()
+                result = future.result()
+                submit()
+                yield result
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                submit()
+                for future in done:
+                    yield future.result()
+    finally:
+        # The caller stopped early (break, exception). Drop what has not started.
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+class RateLimit(object):
+    def __init__(self, per_second):
+        """Spaces calls from any number of threads at least 1/<per_second> apart.
+
+        Parameters
+        ----------
+        per_second : float
+            Maximum calls per second, 0 or None for no limit.
+        """
+        self.interval = 1.0 / per_second if per_second else 0
+        self.next_call = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next call is allowed."""
+        with self.lock:
+            now = time.time()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,152 @@
+"""
+Description: Persistent cache for Tautulli geo IP lookups.
+Author: Blacktwin
+Requires: requests, futures (Python 2 only)
+
+Every get_geoip_lookup is a round trip through Tautulli to its geo database
+or online service, and the same IP addresses come back on every run of
+ips_to_maps.py and on every playback start in the new IP notifiers.
+GeoCache keeps the lookups in SQLite for <ttl> seconds. resolve() looks up a
+whole list of addresses at once: duplicates are dropped, cached ones are
+answered locally and only the misses are sent to Tautulli, concurrently.
+
+Usage:
+    geo_cache = GeoCache(tautulli)
+    data = geo_cache.lookup('1.2.3.4')
+    for ip, data in geo_cache.resolve(ip_lst).items():
+        print(ip, data['city'] if data else 'unknown')
+"""
+
+import sys
+import json
+import time
+import socket
+import sqlite3
+
+from jbops.cache import cache_path
+from jbops.fanout import fan_out, WORKERS
+from jbops.tautulli import TautulliError
+
+
+# Seconds a lookup is kept. Addresses rarely move between cities.
+TTL = 30 * 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS geoip (
+    key TEXT PRIMARY KEY,
+    data TEXT,
+    expires INTEGER
+);
+"""
+
+
+def ip_prefix(ip_address):
+    """Return the /24 (IPv4) or /64 (IPv6) network of an address.
+
+    Addresses that cannot be parsed are returned unchanged.
+    """
+    if ':' in ip_address:
+        try:
+            packed = bytearray(socket.inet_pton(socket.AF_INET6, ip_address))
+        except (socket.error, ValueError):
+            return ip_address
+        groups = ['{:x}'.format(packed[i] << 8 | packed[i + 1]) for i in range(0, 8, 2)]
+        return '{}::/64'.format(':'.join(groups))
+    octets = ip_address.split('.')
+    if len(octets) != 4:
+        return ip_address
+    return '{}.0/24'.format('.'.join(octets[:3]))
+
+
+class GeoCache(object):
+    def __init__(self, tautulli, path=None, ttl=TTL, prefix=False):
+        """Geo IP lookups cached on disk.
+
+        Parameters
+        ----------
+        tautulli : jbops.tautulli.Tautulli
+            Client used for the lookups.
+        path : str
+            SQLite file. Defaults to geoip.sqlite in the jbops cache folder.
+        ttl : int
+            Seconds before a cached lookup is done again.
+        prefix : bool
+            Share one lookup between all addresses of a /24 (IPv4) or /64
+            (IPv6) network. Far fewer lookups, slightly less exact.
+        """
+        self.tautulli = tautulli
+        self.ttl = ttl
+        self.prefix = prefix
+        self.db = sqlite3.connect(path or cache_path('geoip.sqlite'), timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def key(self, ip_address):
+        return ip_prefix(ip_address) if self.prefix else ip_address
+
+    def _get(self, key):
+        row = self.db.execute('SELECT data FROM geoip WHERE key = ? AND expires > ?',
+                              (key, int(time.time()))).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _put(self, items):
+        expires = int(time.time()) + self.ttl
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO geoip (key, data, expires) VALUES (?, ?, ?)',
+                                [(key, json.dumps(data), expires) for key, data in items])
+
+    def _fetch(self, ip_address):
+        """Ask Tautulli, return (ip_address, data or None). Safe to call from threads."""
+        try:
+            data = self.tautulli.api_call('get_geoip_lookup', {'ip_address': ip_address})
+            if data.get('error'):
+                raise TautulliError(data['error'])
+            return ip_address, data
+        except TautulliError as e:
+            sys.stderr.write("Tautulli API 'get_geoip_lookup' request failed: {0}.\n".format(e))
+            return ip_address, None
+
+    def lookup(self, ip_address):
+        """Return the geo data of one address, None if the lookup failed."""
+        return self.resolve([ip_address], workers=1).get(ip_address)
+
+    def resolve(self, ip_addresses, workers=WORKERS):
+        """Look up many addresses at once.
+
+        Parameters
+        ----------
+        ip_addresses : iterable
+            Addresses, duplicates are fine.
+        workers : int
+            Number of concurrent lookups for the addresses not in the cache.
+
+        Returns
+        -------
+        dict
+            {ip_address: geo data dict or None if the lookup failed}.
+        """
+        keys = {}
+        for ip_address in ip_addresses:
+            keys.setdefault(self.key(ip_address), []).append(ip_address)
+
+        found = {}
+        misses = []
+        for key, ips in keys.items():
+            data = self._get(key)
+            if data is None:
+                # One lookup per key is enough, the first address stands in
+                # for the rest of its network.
+                misses.append(ips[0])
+            else:
+                found[key] = data
+
+        fetched = []
+        for ip_address, data in fan_out(self._fetch, misses, workers=workers, ordered=False):
+            if data is not None:
+                key = self.key(ip_address)
+                found[key] = data
+                fetched.append((key, data))
+        # Failed lookups are not cached, they are tried again next time.
+        self._put(fetched)
+
+        return dict((ip_address, found.get(key)) for key, ips in keys.items() for ip_address in ips)
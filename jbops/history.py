@@ -0,0 +1,299 @@
+"""
+Description: Local SQLite mirror of the Tautulli history with incremental sync.
+Author: Blacktwin
+Requires: requests
+
+Scripts that count plays (limiterr, the weekly reports, the cleanup scripts)
+used to download a user's or the whole history on every run. HistoryStore
+keeps a copy of the Tautulli history in SQLite and on each sync only pulls
+the rows newer than what it already has, so answering "plays today for user
+X" is an indexed query instead of a full history download.
+
+Usage:
+    history = HistoryStore(tautulli)
+    history.sync()
+    plays = history.count(user='Bob', since=start_of_day())
+    for play in history.plays(grandparent_rating_key=1234, watched=True):
+        print(play['full_title'])
+"""
+
+import time
+import sqlite3
+import threading
+import datetime
+
+from jbops.cache import cache_path
+
+
+# Rows are fetched from Tautulli newest first. A sync stops once it reaches
+# sessions started this long before the newest session of the last complete
+# sync stopped, to also pick up long sessions that started before that sync
+# but were written to the history after it.
+SYNC_OVERLAP = 24 * 60 * 60
+PAGE_LENGTH = 1000
+
+COLUMNS = ('id', 'reference_id', 'date', 'started', 'stopped', 'duration',
+           'paused_counter', 'user_id', 'user', 'friendly_name', 'platform',
+           'player', 'ip_address', 'media_type', 'rating_key', 'parent_rating_key',
+           'grandparent_rating_key', 'section_id', 'full_title', 'title',
+           'parent_title', 'grandparent_title', 'year', 'media_index',
+           'parent_media_index', 'transcode_decision', 'percent_complete',
+           'watched_status')
+
+# How the sessions of one play are merged when grouping by reference_id.
+GROUPED = {'id': 'MAX(id)',
+           'date': 'MAX(started)',
+           'started': 'MIN(started)',
+           'stopped': 'MAX(stopped)',
+           'duration': 'SUM(duration)',
+           'paused_counter': 'SUM(paused_counter)',
+           'watched_status': 'MAX(watched_status)'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    reference_id INTEGER,
+    date INTEGER,
+    started INTEGER,
+    stopped INTEGER,
+    duration INTEGER,
+    paused_counter INTEGER,
+    user_id INTEGER,
+    user TEXT,
+    friendly_name TEXT,
+    platform TEXT,
+    player TEXT,
+    ip_address TEXT,
+    media_type TEXT,
+    rating_key INTEGER,
+    parent_rating_key INTEGER,
+    grandparent_rating_key INTEGER,
+    section_id INTEGER,
+    full_title TEXT,
+    title TEXT,
+    parent_title TEXT,
+    grandparent_title TEXT,
+    year INTEGER,
+    media_index INTEGER,
+    parent_media_index INTEGER,
+    transcode_decision TEXT,
+    percent_complete INTEGER,
+    watched_status REAL
+);
+CREATE INDEX IF NOT EXISTS idx_history_user_started ON history (user, started);
+CREATE INDEX IF NOT EXISTS idx_history_user_id_started ON history (user_id, started);
+CREATE INDEX IF NOT EXISTS idx_history_rating_key ON history (rating_key);
+CREATE INDEX IF NOT EXISTS idx_history_grandparent_rating_key ON history (grandparent_rating_key);
+CREATE INDEX IF NOT EXISTS idx_history_started ON history (started);
+CREATE TABLE IF NOT EXISTS sync (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+
+def start_of_day(day=None):
+    """Unix time of local midnight of <day> (a datetime.date, default today)."""
+    day = day or datetime.date.today()
+    return int(time.mktime(day.timetuple()))
+
+
+class HistoryStore(object):
+    def __init__(self, tautulli, path=None):
+        """SQLite mirror of the Tautulli history.
+
+        Parameters
+        ----------
+        tautulli : jbops.tautulli.Tautulli
+            Client used to sync.
+        path : str
+            SQLite file. Defaults to history.sqlite in the jbops cache folder.
+        """
+        self.tautulli = tautulli
+        self.path = path or cache_path('history.sqlite')
+        # Tautulli may start several scripts at once, wait for the writer
+        # instead of failing with 'database is locked'.
+        # One store can be shared by the threads of killstream_daemon.py.
+        self.db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def _row(self, data):
+        """Map a get_history row to the columns of the history table."""
+        row = dict((col, data.get(col)) for col in COLUMNS)
+        # Newer Tautulli versions name the session id row_id.
+        row['id'] = data.get('row_id') or data.get('id')
+        row['reference_id'] = data.get('reference_id') or row['id']
+        return row
+
+    def last_sync(self):
+        """Unix time of the last successful sync, 0 if never synced."""
+        row = self.db.execute("SELECT value FROM sync WHERE key = 'last_sync'").fetchone()
+        return row['value'] if row else 0
+
+    def complete_through(self):
+        """Stop time of the newest session of the last sync that finished, None if none did."""
+        row = self.db.execute("SELECT value FROM sync WHERE key = 'complete_through'").fetchone()
+        return row['value'] if row else None
+
+    def sync(self, max_age=0, full=False, overlap=SYNC_OVERLAP):
+        """Pull the history rows added since the last sync.
+
+        Parameters
+        ----------
+        max_age : int
+            Skip the sync if the last one is younger than this many seconds.
+        full : bool
+            Re-download the whole history.
+        overlap : int
+            Seconds before the last complete sync's newest session to read
+            back to. Sessions longer than this that ended since are missed
+            until a sync with a longer overlap, ex. for scripts run on every
+            playback start.
+
+        Returns
+        -------
+        int
+            Number of rows written.
+        """
+        with self.lock:
+            return self._sync(max_age, full, overlap)
+
+    def _sync(self, max_age, full, overlap):
+        now = int(time.time())
+        if not full and max_age and now - self.last_sync() < max_age:
+            return 0
+
+        # Only trust rows up to the mark of a sync that finished. The newest
+        # rows of an interrupted sync are already stored, stopping at them
+        # would leave the older rows that sync never reached missing.
+        complete = self.complete_through()
+        cutoff = None if full or not complete else complete - overlap
+
+        insert = 'INSERT OR REPLACE INTO history ({}) VALUES ({})'.format(
+            ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS)))
+        batch = []
+        written = 0
+        for data in self.tautulli.iter_pages('get_history', {'grouping': 0}, length=PAGE_LENGTH):
+            if cutoff and int(data['started']) < cutoff:
+                break
+            row = self._row(data)
+            batch.append([row[col] for col in COLUMNS])
+            if len(batch) >= PAGE_LENGTH:
+                written += self._write(insert, batch)
+                batch = []
+        written += self._write(insert, batch)
+
+        newest = self.db.execute('SELECT MAX(stopped) FROM history').fetchone()[0]
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO sync (key, value) VALUES ('last_sync', ?)",
+                            (now,))
+            if newest:
+                self.db.execute("INSERT OR REPLACE INTO sync (key, value) VALUES ('complete_through', ?)",
+                                (newest,))
+        return written
+
+    def _write(self, insert, batch):
+        if batch:
+            with self.db:
+                self.db.executemany(insert, batch)
+        return len(batch)
+
+    def _where(self, user=None, user_id=None, rating_key=None, grandparent_rating_key=None,
+               section_id=None, media_type=None, since=None, until=None):
+        clauses = []
+        args = []
+        for col, value in (('user', user), ('user_id', user_id), ('rating_key', rating_key),
+                           ('grandparent_rating_key', grandparent_rating_key),
+                           ('section_id', section_id), ('media_type', media_type)):
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, set)):
+                clauses.append('{} IN ({})'.format(col, ', '.join('?' * len(value))))
+                args.extend(value)
+            else:
+                clauses.append('{} = ?'.format(col))
+                args.append(value)
+        if since is not None:
+            clauses.append('started >= ?')
+            args.append(since)
+        if until is not None:
+            clauses.append('started < ?')
+            args.append(until)
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), args
+
+    def plays(self, watched=None, grouped=True, **filters):
+        """Query the stored history.
+
+        Parameters
+        ----------
+        watched : bool
+            Only plays that were (True) or were not (False) watched.
+        grouped : bool
+            Merge resumed sessions into one play, like Tautulli's history page.
+        filters :
+            user, user_id, rating_key, grandparent_rating_key, section_id and
+            media_type, each a value or a list of values, since and until
+            (unix time, on started).
+
+        Returns
+        -------
+        list of dict
+            One dict per play, newest first, with the get_history fields.
+        """
+        query, args = self._query(watched, grouped, **filters)
+        query += ' ORDER BY date DESC'
+        with self.lock:
+            return [dict(row) for row in self.db.execute(query, args)]
+
+    def _query(self, watched=None, grouped=True, **filters):
+        """SELECT of plays() without the ORDER BY, and its arguments."""
+        where, args = self._where(**filters)
+        if grouped:
+            select = ', '.join('{} AS {}'.format(GROUPED.get(col, col), col) for col in COLUMNS)
+            query = 'SELECT {} FROM history{} GROUP BY reference_id'.format(select, where)
+            if watched is not None:
+                query += ' HAVING MAX(watched_status) {} 1'.format('=' if watched else '<')
+        else:
+            query = 'SELECT * FROM history{}'.format(where)
+            if watched is not None:
+                query += ' {} watched_status {} 1'.format('AND' if where else 'WHERE',
+                                                          '=' if watched else '<')
+        return query, args
+
+    def count(self, watched=None, grouped=True, **filters):
+        """Number of plays matching the filters of plays()."""
+        query, args = self._query(watched, grouped, **filters)
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM ({})'.format(query), args).fetchone()[0]
+
+    def total_duration(self, watched=None, **filters):
+        """Seconds played matching the filters of plays()."""
+        return sum(play['duration'] or 0 for play in self.plays(watched=watched, **filters))
+
+    def watched_by(self, users, **filters):
+        """Rating keys each user watched, from one query.
+
+        Parameters
+        ----------
+        users : list
+            User names.
+        filters :
+            Same as plays().
+
+        Returns
+        -------
+        dict
+            {user: set of rating keys}
+        """
+        watched = dict((user, set()) for user in users)
+        for play in self.plays(watched=True, user=list(users), **filters):
+            watched[play['user']].add(play['rating_key'])
+        return watched
+
+    def watched_by_all(self, users, **filters):
+        """Rating keys every one of <users> watched, filters as in plays()."""
+        watched = list(self.watched_by(users, **filters).values())
+        return set.intersection(*watched) if watched else set()
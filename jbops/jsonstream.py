@@ -0,0 +1,141 @@
+"""
+Description: Write and read large JSON files piece by piece.
+Author: Blacktwin
+Requires: nothing outside the standard library
+
+The diff, share backup and map scripts used to collect everything in one big
+dict before saving it. write_json() accepts generators wherever a list
+would go and writes each element as soon as it is produced, and
+iter_json_array()/iter_json_object() read such files back one element at a
+time. The files are ordinary indented JSON, older files still load.
+
+Usage:
+    with open('backup.json', 'w') as fp:
+        write_json(fp, (find_shares(user) for user in users))
+    with open('backup.json') as fp:
+        for share in iter_json_array(fp):
+            print(share['title'])
+"""
+
+import json
+import types
+
+
+# Characters read from the file at a time by the readers.
+CHUNK_SIZE = 64 * 1024
+
+
+def _is_stream(obj):
+    """Lists, tuples, generators and other iterators are written as arrays."""
+    return isinstance(obj, (list, tuple)) or hasattr(obj, '__next__') or \
+        isinstance(obj, types.GeneratorType)
+
+
+def write_json(fp, obj, indent=4, level=0):
+    """Write <obj> as indented JSON without building the whole text first.
+
+    Parameters
+    ----------
+    fp : file
+        Opened for writing text.
+    obj :
+        Any json serializable value. Lists may be generators or other
+        iterators, they are consumed while writing. Dict keys are sorted.
+    indent : int
+        Spaces per level.
+    level : int
+        Current depth, used when called for nested values.
+    """
+    pad = '\n' + ' ' * indent * (level + 1)
+    end = '\n' + ' ' * indent * level
+    if isinstance(obj, dict):
+        if not obj:
+            fp.write('{}')
+            return
+        fp.write('{')
+        for i, key in enumerate(sorted(obj)):
+            fp.write((',' if i else '') + pad + json.dumps(key) + ': ')
+            write_json(fp, obj[key], indent, level + 1)
+        fp.write(end + '}')
+    elif _is_stream(obj):
+        fp.write('[')
+        count = 0
+        for value in obj:
+            fp.write((',' if count else '') + pad)
+            write_json(fp, value, indent, level + 1)
+            count += 1
+        fp.write(end + ']' if count else ']')
+    else:
+        fp.write(json.dumps(obj))
+
+
+class _Reader(object):
+    """Buffered reader that decodes one JSON value at a time."""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.buf = ''
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.fp.read(CHUNK_SIZE)
+        self.eof = not chunk
+        self.buf += chunk
+        return not self.eof
+
+    def skip(self, chars=' \t\r\n'):
+        """Drop leading <chars>, return the next character or '' at the end."""
+        while True:
+            self.buf = self.buf.lstrip(chars)
+            if self.buf or not self._fill():
+                return self.buf[:1]
+
+    def expect(self, char):
+        if self.skip() != char:
+            raise ValueError("Expected '{}' in JSON stream".format(char))
+        self.buf = self.buf[1:]
+
+    def value(self):
+        self.skip()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf)
+                # A number at the end of the buffer may continue in the next chunk.
+                if end < len(self.buf) or self.eof or not self._fill():
+                    self.buf = self.buf[end:]
+                    return value
+            except ValueError:
+                if not self._fill():
+                    raise
+
+    def items(self, closing):
+        """Yield until <closing>, consuming the commas between items."""
+        first = True
+        while True:
+            char = self.skip()
+            if char == closing:
+                self.buf = self.buf[1:]
+                return
+            if not first:
+                self.expect(',')
+            first = False
+            yield
+
+
+def iter_json_array(fp):
+    """Yield the elements of a top level JSON array one at a time."""
+    reader = _Reader(fp)
+    reader.expect('[')
+    for _ in reader.items(']'):
+        yield reader.value()
+
+
+def iter_json_object(fp):
+    """Yield the (key, value) pairs of a top level JSON object one at a time."""
+    reader = _Reader(fp)
+    reader.expect('{')
+    for _ in reader.items('}'):
+        key = reader.value()
+        reader.expect(':')
+        yield key, reader.value()
@@ -0,0 +1,152 @@
+"""
+Description: Stream the movies and episodes of Tautulli libraries as flat records.
+Author: Blacktwin
+Requires: requests, futures (Python 2 only)
+
+The unwatched and added reports used to turn every show into episode rating
+keys with get_new_rating_keys, one show at a time, and then call
+get_metadata for every episode just to learn when it was added and how big
+it is. get_library_media_info already has added_at and file_size for each
+item and lists a show's seasons and a season's episodes when given their
+rating key. iter_library() expands all shows of a library concurrently that
+way and yields one MediaRecord per movie, episode or track. Only the file
+path is missing from the listings, with_files() fills it in with get_metadata
+for the records that need it.
+
+Usage:
+    for record in iter_library(tautulli, section_id):
+        print(record.rating_key, record.added_at, record.file_size)
+    for record in with_files(tautulli, records):
+        print(record.file)
+"""
+
+import sys
+from collections import namedtuple
+
+from jbops.fanout import fan_out, WORKERS
+from jbops.tautulli import TautulliError
+
+
+# Rows requested per get_library_media_info page.
+PAGE_LENGTH = 1000
+
+# Media types that are listed again with their rating key to get their children.
+PARENT_TYPES = ('show', 'season', 'artist', 'album')
+
+MediaRecord = namedtuple('MediaRecord', ['rating_key', 'media_type', 'added_at', 'file', 'file_size',
+                                         'title', 'grandparent_title'])
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _record(row, grandparent_title=''):
+    return MediaRecord(rating_key=int(row['rating_key']),
+                       media_type=row['media_type'],
+                       added_at=_int(row.get('added_at')),
+                       file=None,
+                       file_size=_int(row.get('file_size')),
+                       title=row.get('title', ''),
+                       grandparent_title=grandparent_title)
+
+
+def _children(tautulli, section_id, row):
+    """All leaf records below a show or artist row."""
+    records = []
+    parents = [row]
+    while parents:
+        parent = parents.pop()
+        payload = {'section_id': section_id, 'rating_key': parent['rating_key']}
+        for child in tautulli.iter_pages('get_library_media_info', payload, length=PAGE_LENGTH):
+            if child['media_type'] in PARENT_TYPES:
+                parents.append(child)
+            else:
+                records.append(_record(child, row.get('title', '')))
+    return records
+
+
+def iter_library(tautulli, section_id, include=None, workers=WORKERS):
+    """Yield a MediaRecord for every movie, episode or track of a library.
+
+    Parameters
+    ----------
+    tautulli : jbops.tautulli.Tautulli
+        Client used for the listings.
+    section_id : int
+        Library to list.
+    include : callable
+        Called with each top level row (movie, show, artist) of
+        get_library_media_info, only rows it returns True for are yielded or
+        expanded. Defaults to all rows.
+    workers : int
+        Number of shows expanded at the same time.
+
+    Yields
+    ------
+    MediaRecord
+        file is None, see with_files(). Each rating key is yielded once.
+    """
+    seen = set()
+    parents = []
+    for row in tautulli.iter_pages('get_library_media_info', {'section_id': section_id},
+                                   length=PAGE_LENGTH):
+        if include and not include(row):
+            continue
+        if row['media_type'] in PARENT_TYPES:
+            parents.append(row)
+        elif int(row['rating_key']) not in seen:
+            seen.add(int(row['rating_key']))
+            yield _record(row)
+
+    def expand(row):
+        try:
+            return _children(tautulli, section_id, row)
+        except TautulliError as e:
+            sys.stderr.write("Tautulli API 'get_library_media_info' request failed for {}: {}.\n"
+                             .format(row.get('title'), e))
+            return []
+
+    for records in fan_out(expand, parents, workers=workers):
+        for record in records:
+            if record.rating_key not in seen:
+                seen.add(record.rating_key)
+                yield record
+
+
+def with_files(tautulli, records, workers=WORKERS):
+    """Fill in the file path (and a missing file_size) of records with get_metadata.
+
+    Parameters
+    ----------
+    tautulli : jbops.tautulli.Tautulli
+        Client used for the metadata calls.
+    records : iterable
+        MediaRecords, ex. from iter_library().
+    workers : int
+        Number of get_metadata calls at the same time.
+
+    Yields
+    ------
+    MediaRecord
+        In the order of <records>. Records whose metadata could not be read
+        are dropped.
+    """
+    def fetch(record):
+        try:
+            data = tautulli.api_call('get_metadata', {'rating_key': record.rating_key, 'media_info': True})
+            part = data['media_info'][0]['parts'][0]
+        except (TautulliError, KeyError, IndexError, TypeError) as e:
+            sys.stderr.write("Tautulli API 'get_metadata' request failed for {}: {}.\n"
+                             .format(record.rating_key, e))
+            return None
+        return record._replace(file=part.get('file'),
+                               file_size=record.file_size or _int(part.get('file_size')),
+                               grandparent_title=record.grandparent_title or data.get('grandparent_title', ''))
+
+    for record in fan_out(fetch, records, workers=workers):
+        if record is not None:
+            yield record
@@ -0,0 +1,185 @@
+"""
+Description: Cached access tokens and connections for the users a server is shared with.
+Author: Blacktwin
+Requires: plexapi
+
+Acting as a shared user (their playlists, On Deck, watch status) needs the
+user's access token for the server. plexapi's user.get_token() downloads the
+server's whole shared_servers listing from plex.tv for every user it is
+called for. UserTokens reads that listing once, keeps the tokens for <ttl>
+seconds in a file only the owner can read and reuses one PlexServer per user
+on the admin's HTTP session. Users are found by title, username or email
+like account.user(). A token plex.tv no longer accepts, or a user missing
+from the file, causes one refresh of the listing.
+
+Usage:
+    user_tokens = UserTokens(plex.myPlexAccount(), plex)
+    tokens = user_tokens.tokens()
+    user_server = user_tokens.connect('Bob')
+"""
+
+import os
+import json
+import time
+import threading
+
+from plexapi.exceptions import NotFound, Unauthorized
+from plexapi.server import PlexServer
+
+from jbops.cache import cache_path
+
+
+# Seconds the tokens are kept. They only change when a share is removed and
+# added again, a rejected token is refreshed right away.
+TTL = 7 * 24 * 60 * 60
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _write(path, users):
+    # Create the file 0600 before anything is written to it and rename it
+    # into place, so the tokens are never readable by others or half written.
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'time': time.time(), 'users': users}, f)
+    os.rename(tmp, path)
+
+
+def _matches(user, name):
+    """Whether <name> is the title, username or email of <user>, ignoring case."""
+    name = name.lower()
+    return any((user.get(field) or '').lower() == name for field in ('title', 'username', 'email'))
+
+
+class UserTokens(object):
+    def __init__(self, account, server, ttl=TTL, session=None):
+        """Tokens and connections of the users <server> is shared with.
+
+        Parameters
+        ----------
+        account : plexapi.myplex.MyPlexAccount
+            The admin account.
+        server : plexapi.server.PlexServer
+            The admin's connection to the server.
+        ttl : int
+            Seconds before the saved tokens are downloaded again.
+        session : requests.Session
+            Session for the user connections. Defaults to the one <server>
+            uses, so all connections share its connection pool.
+        """
+        self.account = account
+        self.server = server
+        self.session = session or server._session
+        self.ttl = ttl
+        self.path = cache_path('plex_user_tokens', '{}.json'.format(server.machineIdentifier))
+        self.users = None
+        self.refreshed = False
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def _load(self):
+        users = dict((x.id, x) for x in self.account.users())
+        url = 'https://plex.tv/api/servers/{}/shared_servers'.format(self.server.machineIdentifier)
+        tokens = []
+        for shared in self.account.query(url).findall('SharedServer'):
+            user = users.get(int(shared.attrib['userID']))
+            if user:
+                tokens.append({'id': user.id, 'title': user.title, 'username': user.username,
+                               'email': user.email, 'token': shared.attrib['accessToken']})
+        return tokens
+
+    def refresh(self):
+        """Download the tokens again, return them like tokens()."""
+        users = self._load()
+        _write(self.path, users)
+        with self.lock:
+            self.users = users
+            self.refreshed = True
+        return dict((x['title'], x['token']) for x in users)
+
+    def _users(self):
+        with self.lock:
+            if self.users is not None:
+                return self.users
+        saved = _read(self.path)
+        if saved is None or time.time() - saved['time'] > self.ttl:
+            self.refresh()
+        else:
+            with self.lock:
+                self.users = saved['users']
+        return self.users
+
+    def tokens(self):
+        """Return {user title: access token} for every user the server is shared with."""
+        return dict((x['title'], x['token']) for x in self._users())
+
+    def _find(self, user):
+        for entry in self._users():
+            if _matches(entry, user):
+                return entry
+        if not self.refreshed:
+            # Shared with someone new since the tokens were saved.
+            self.refresh()
+            for entry in self._users():
+                if _matches(entry, user):
+                    return entry
+        return None
+
+    def _is_admin(self, user):
+        return _matches({'title': self.account.title, 'username': self.account.username,
+                         'email': self.account.email}, user)
+
+    def token(self, user):
+        """Return the access token of <user>, None if the server is not shared with them.
+
+        <user> is a title, username or email. The admin gets the admin's
+        server token.
+        """
+        if self._is_admin(user):
+            return self.server._token
+        entry = self._find(user)
+        return entry['token'] if entry else None
+
+    def connect(self, user):
+        """Return a PlexServer acting as <user>.
+
+        <user> is a title, username or email, the admin's returns the admin
+        connection. Connections are kept, asking for the same user again
+        does not reconnect.
+
+        Raises
+        ------
+        plexapi.exceptions.NotFound
+            The server is not shared with <user>.
+        """
+        if self._is_admin(user):
+            return self.server
+        entry = self._find(user)
+        if entry is None:
+            raise NotFound('{} is not shared with {}'.format(self.server.friendlyName, user))
+        with self.lock:
+            if entry['id'] in self.connections:
+                return self.connections[entry['id']]
+
+        try:
+            server = PlexServer(self.server._baseurl, entry['token'], session=self.session)
+        except Unauthorized:
+            if self.refreshed:
+                raise
+            # The share was removed and added again, the saved token is gone.
+            self.refresh()
+            entry = self._find(user)
+            if entry is None:
+                raise NotFound('{} is not shared with {}'.format(self.server.friendlyName, user))
+            server = PlexServer(self.server._baseurl, entry['token'], session=self.session)
+
+        with self.lock:
+            self.connections[entry['id']] = server
+        return server
@@ -0,0 +1,220 @@
+"""
+Description: Paged Plex library listings and incremental SQLite snapshots of them.
+Author: Blacktwin
+Requires: plexapi
+
+Several scripts need one or two fields of every item in a library: the
+server comparison, the air date playlists and the artist index. Listing a
+large library with plexapi builds an object per item, every run.
+iter_listing() reads a listing in pages straight from the XML, and
+SectionSnapshot keeps what was read in SQLite with each item's updatedAt, so
+update() only asks Plex for the items updated since the last complete pass.
+Removed items cannot be found that way, when the snapshot would not hold as
+many items as the server the section is listed again.
+
+Usage:
+    snapshot = SectionSnapshot(cache_path('script', 'server.sqlite'), 'items',
+                               [('title', 'TEXT')])
+    path = '/library/sections/{}/all'.format(section.key)
+    snapshot.update(plex, str(section.key), path,
+                    lambda elem: {'title': elem.attrib.get('title')})
+"""
+
+import time
+import sqlite3
+
+
+# Items requested per page when reading a library listing.
+PAGE_SIZE = 1000
+
+# update() results.
+SCANNED = 'scanned'
+UPDATED = 'updated'
+RESCANNED = 'rescanned'
+
+
+def iter_listing(server, path, updated_since=None, page_size=PAGE_SIZE):
+    """Yield the elements of a library listing page by page.
+
+    Parameters
+    ----------
+    server : plexapi.server.PlexServer
+    path : str
+        Listing, ex. '/library/sections/1/all?type=4'.
+    updated_since : int
+        Only list items with this or a newer updatedAt.
+    page_size : int
+        Items per request.
+
+    Yields
+    ------
+    xml.etree.ElementTree.Element
+        One per item, with the attributes Plex listed.
+    """
+    if updated_since is not None:
+        # >>= is Plex for greater than, step back a second to keep equal ones.
+        path += '{}updatedAt>>={}'.format('&' if '?' in path else '?', updated_since - 1)
+    start = 0
+    while True:
+        headers = {'X-Plex-Container-Start': str(start),
+                   'X-Plex-Container-Size': str(page_size)}
+        container = server.query(path, headers=headers)
+        elems = list(container)
+        for elem in elems:
+            yield elem
+        start += len(elems)
+        if not elems or start >= int(container.attrib.get('totalSize', start)):
+            break
+
+
+def listing_size(server, path):
+    """Number of items of a library listing, without reading them."""
+    headers = {'X-Plex-Container-Start': '0',
+               'X-Plex-Container-Size': '0'}
+    container = server.query(path, headers=headers)
+    return int(container.attrib.get('totalSize', 0))
+
+
+class SectionSnapshot(object):
+    def __init__(self, path, table, columns, indexes=()):
+        """Items of library sections saved between runs.
+
+        One row per item keyed by ratingKey, with its section, its updatedAt
+        and the <columns> a script needs. Scripts subclass it to add their
+        queries on self.db.
+
+        Parameters
+        ----------
+        path : str
+            SQLite file.
+        table : str
+            Table of the items.
+        columns : list
+            (name, SQL type) of the columns besides rating_key, section_key
+            and updated_at.
+        indexes : list
+            Tuples of columns to index, ex. [('month', 'day')].
+        """
+        self.table = table
+        self.columns = ['rating_key', 'section_key'] + [name for name, _ in columns] + ['updated_at']
+        schema = ['CREATE TABLE IF NOT EXISTS {} (rating_key INTEGER PRIMARY KEY, section_key TEXT, {}'
+                  'updated_at INTEGER);'.format(table, ''.join('{} {}, '.format(*x) for x in columns))]
+        for cols in [('section_key', 'updated_at')] + list(indexes):
+            schema.append('CREATE INDEX IF NOT EXISTS idx_{0}_{1} ON {0} ({2});'
+                          .format(table, '_'.join(cols), ', '.join(cols)))
+        schema.append('CREATE TABLE IF NOT EXISTS scans (section_key TEXT PRIMARY KEY, scanned_at INTEGER, '
+                      'updated_at INTEGER);')
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript('\n'.join(schema))
+
+    def scanned_at(self, section_key):
+        """Time a section was last brought up to date, None if it never was."""
+        row = self.db.execute('SELECT scanned_at FROM scans WHERE section_key = ?', (section_key,)).fetchone()
+        return row[0] if row else None
+
+    def sections(self):
+        """Keys of the sections in the snapshot."""
+        return [row[0] for row in self.db.execute('SELECT section_key FROM scans')]
+
+    def updated_at(self, section_key):
+        """Newest updatedAt listed by the last complete pass, None if none finished.
+
+        Not the newest row saved: listings are not ordered by updatedAt, an
+        interrupted pass may have saved newer rows than the ones it missed.
+        """
+        row = self.db.execute('SELECT updated_at FROM scans WHERE section_key = ?', (section_key,)).fetchone()
+        return (row[0] or 0) if row else None
+
+    def count(self, section_key):
+        return self.db.execute('SELECT COUNT(*) FROM {} WHERE section_key = ?'.format(self.table),
+                               (section_key,)).fetchone()[0]
+
+    def rating_keys(self, section_key):
+        return set(row[0] for row in self.db.execute(
+            'SELECT rating_key FROM {} WHERE section_key = ?'.format(self.table), (section_key,)))
+
+    def clear(self, section_key):
+        with self.db:
+            self.db.execute('DELETE FROM {} WHERE section_key = ?'.format(self.table), (section_key,))
+            self.db.execute('DELETE FROM scans WHERE section_key = ?', (section_key,))
+
+    def save(self, section_key, rows):
+        """Insert or update rows, dicts with a value per column. Return how many there were."""
+        insert = 'INSERT OR REPLACE INTO {} ({}) VALUES ({})'.format(
+            self.table, ', '.join(self.columns), ', '.join('?' * len(self.columns)))
+        saved = 0
+        batch = []
+        for row in rows:
+            row['section_key'] = section_key
+            batch.append([row[col] for col in self.columns])
+            if len(batch) >= PAGE_SIZE:
+                saved += self._write(insert, batch)
+                batch = []
+        return saved + self._write(insert, batch)
+
+    def _write(self, insert, batch):
+        if batch:
+            with self.db:
+                self.db.executemany(insert, batch)
+        return len(batch)
+
+    def scanned(self, section_key, updated_at):
+        """Mark a section as completely scanned now, up to the items updated at <updated_at>."""
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO scans (section_key, scanned_at, updated_at) VALUES (?, ?, ?)',
+                            (section_key, int(time.time()), updated_at))
+
+    def update(self, server, section_key, path, parse, full=False):
+        """Bring the snapshot of a section up to date.
+
+        Only items updated since the last complete pass are listed. When the
+        snapshot would then hold a different number of items than the
+        server, items were removed, which the updatedAt filter cannot show,
+        and the section is listed again. The mark only moves once a pass
+        finished, an interrupted one is repeated.
+
+        Parameters
+        ----------
+        server : plexapi.server.PlexServer
+        section_key : str
+            Section the rows are saved under.
+        path : str
+            Listing of the section's items, see iter_listing().
+        parse : callable
+            Called with each listed element, returns its row: a dict with
+            rating_key, updated_at and the columns.
+        full : bool
+            List the whole section even if it was scanned before.
+
+        Returns
+        -------
+        tuple
+            (SCANNED, UPDATED or RESCANNED, number of rows saved)
+        """
+        updated_at = None if full else self.updated_at(section_key)
+        if updated_at is not None:
+            known = self.rating_keys(section_key)
+            rows = [parse(x) for x in iter_listing(server, path, updated_at)]
+            added = len(set(row['rating_key'] for row in rows) - known)
+            if len(known) + added == listing_size(server, path):
+                saved = self.save(section_key, rows)
+                newest = max([updated_at] + [row['updated_at'] or 0 for row in rows])
+                self.scanned(section_key, newest)
+                return UPDATED, saved
+            # Something was removed, the updated rows alone cannot tell what.
+            kind = RESCANNED
+        else:
+            kind = SCANNED
+
+        self.clear(section_key)
+        newest = [0]
+
+        def rows():
+            for elem in iter_listing(server, path):
+                row = parse(elem)
+                newest[0] = max(newest[0], row['updated_at'] or 0)
+                yield row
+        saved = self.save(section_key, rows())
+        self.scanned(section_key, newest[0])
+        return kind, saved
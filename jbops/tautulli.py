@@ -0,0 +1,279 @@
+"""
+Description: Pooled Tautulli API client shared by the scripts.
+Author: Blacktwin, Arcanemagus, Samwiseg00, JonnyWong16
+Requires: requests
+
+One Tautulli instance keeps a single requests.Session with a sized connection
+pool, so every call reuses an open keep-alive connection instead of paying for
+a new TCP/TLS handshake. Failed connections and 5xx responses are retried with
+an exponential backoff, every call has a timeout and per-command latency is
+recorded in Tautulli.stats.
+
+Usage:
+    tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+    data = tautulli.api_call('get_history', {'user': 'Bob', 'length': 100})
+    for row in tautulli.iter_pages('get_history', {'user': 'Bob'}):
+        print(row['full_title'])
+"""
+
+import sys
+import copy
+import time
+import threading
+import traceback
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# HTTP statuses worth retrying. Tautulli returns these when it is restarting
+# or when a reverse proxy in front of it times out.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TautulliError(Exception):
+    """Raised when a Tautulli API call fails."""
+
+
+class Tautulli:
+    def __init__(self, url, apikey, verify_ssl=False, debug=None, timeout=30,
+                 retries=3, backoff_factor=0.5, pool_maxsize=10):
+        """Tautulli API client.
+
+        Parameters
+        ----------
+        url : str
+            Tautulli URL, ex. 'http://localhost:8181/'.
+        apikey : str
+            Tautulli API key.
+        verify_ssl : bool
+            Verify the SSL certificate of Tautulli.
+        debug : bool
+            Print successful calls and tracebacks of failed ones.
+        timeout : int
+            Seconds to wait for Tautulli to connect and respond.
+        retries : int
+            Number of retries on connection errors and 5xx responses.
+        backoff_factor : float
+            Sleep backoff_factor * (2 ** (retry - 1)) seconds between retries.
+        pool_maxsize : int
+            Number of keep-alive connections held open to Tautulli. Match this
+            to the number of threads making calls at the same time.
+        """
+        # Scripts read the URL from the plexapi config, it may be missing there.
+        self.url = (url or '').rstrip('/')
+        self.apikey = apikey
+        self.debug = debug
+        self.timeout = timeout
+
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.adapters = HTTPAdapter(max_retries=self._retry(retries, backoff_factor),
+                                    pool_connections=1,
+                                    pool_maxsize=pool_maxsize,
+                                    pool_block=True)
+        self.session.mount('http://', self.adapters)
+        self.session.mount('https://', self.adapters)
+
+        # Ignore verifying the SSL certificate
+        if verify_ssl is False:
+            self.session.verify = False
+            # Disable the warning that the request is insecure, we know that...
+            import urllib3
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    def with_debug(self, debug):
+        """Return a client with its own debug flag.
+
+        It shares this client's connections and stats, so one request of a
+        long running process can print debug messages without turning them
+        on for the others.
+        """
+        client = copy.copy(self)
+        client.debug = debug
+        return client
+
+    @staticmethod
+    def _retry(retries, backoff_factor):
+        """Build the urllib3 retry policy.
+
+        Connection errors are retried for every method. Read errors and bad
+        statuses are only retried for GET, notify and terminate_session are
+        sent as POST and must not be repeated.
+        """
+        kwargs = {'total': retries,
+                  'connect': retries,
+                  'read': retries,
+                  'status': retries,
+                  'backoff_factor': backoff_factor,
+                  'status_forcelist': RETRY_STATUSES,
+                  'raise_on_status': False}
+        try:
+            return Retry(allowed_methods=frozenset(['GET']), **kwargs)
+        except TypeError:
+            # urllib3 < 1.26
+            return Retry(method_whitelist=frozenset(['GET']), **kwargs)
+
+    def _record(self, cmd, elapsed, failed=False):
+        """Add a call to the per-command latency counters."""
+        with self._stats_lock:
+            stat = self.stats.setdefault(cmd, {'calls': 0, 'errors': 0,
+                                               'total': 0.0, 'max': 0.0})
+            stat['calls'] += 1
+            stat['total'] += elapsed
+            stat['max'] = max(stat['max'], elapsed)
+            if failed:
+                stat['errors'] += 1
+
+    def api_call(self, cmd, payload=None, method='GET'):
+        """Call a Tautulli API command.
+
+        Parameters
+        ----------
+        cmd : str
+            The Tautulli API command, ex. 'get_history'.
+        payload : dict
+            Parameters for the command. 'cmd' and 'apikey' are added.
+        method : str
+            'GET' or 'POST'.
+
+        Returns
+        -------
+        dict or list
+            The 'data' element of the Tautulli response.
+
+        Raises
+        ------
+        TautulliError
+            The request failed, the response was not json or the command
+            was not successful.
+        """
+        params = dict(payload or {})
+        params['cmd'] = cmd
+        params['apikey'] = self.apikey
+
+        start = time.time()
+        try:
+            response = self.session.request(method, self.url + '/api/v2',
+                                            params=params, timeout=self.timeout)
+            response_json = response.json()
+        except requests.exceptions.RequestException as e:
+            self._record(cmd, time.time() - start, failed=True)
+            raise TautulliError('Request failed. Invalid Tautulli URL? {}'.format(e))
+        except ValueError:
+            self._record(cmd, time.time() - start, failed=True)
+            raise TautulliError('Failed to parse json response')
+
+        if response_json['response']['result'] != 'success':
+            self._record(cmd, time.time() - start, failed=True)
+            raise TautulliError(response_json['response']['message'])
+
+        self._record(cmd, time.time() - start)
+        if self.debug:
+            print("Successfully called Tautulli API cmd '{}'".format(cmd))
+        return response_json['response']['data']
+
+    def api_url(self, cmd, payload=None):
+        """Build the full URL of a Tautulli API command without calling it.
+
+        Used for commands that return a file instead of json, ex.
+        pms_image_proxy, so the caller can download it directly.
+        """
+        params = dict(payload or {})
+        params['cmd'] = cmd
+        params['apikey'] = self.apikey
+        return requests.Request('GET', self.url + '/api/v2', params=params).prepare().url
+
+    def _call_api(self, cmd, payload, method='GET'):
+        """Call a Tautulli API command, print the error and return None on failure."""
+        try:
+            return self.api_call(cmd, payload, method)
+        except TautulliError as e:
+            print("Tautulli API cmd '{}' failed: {}".format(cmd, e))
+            if self.debug:
+                traceback.print_exc()
+            return
+
+    def iter_pages(self, cmd, payload=None, length=1000):
+        """Yield the rows of a Tautulli datatable command page by page.
+
+        Commands such as get_history, get_library_media_info or
+        get_users_table return {'recordsFiltered': n, 'data': [...]}.
+        Instead of asking for everything with a huge 'length', fetch it in
+        pages of <length> rows.
+
+        Parameters
+        ----------
+        cmd : str
+            The Tautulli API command.
+        payload : dict
+            Parameters for the command. 'start' and 'length' are set here.
+        length : int
+            Rows per request.
+        """
+        params = dict(payload or {})
+        start = 0
+        while True:
+            params['start'] = start
+            params['length'] = length
+            data = self.api_call(cmd, params)
+            rows = data['data']
+            for row in rows:
+                yield row
+            start += len(rows)
+            if not rows or start >= int(data.get('recordsFiltered', 0)):
+                break
+
+    def stats_report(self):
+        """Return the per-command call counters as printable lines."""
+        lines = []
+        with self._stats_lock:
+            for cmd, stat in sorted(self.stats.items(), key=lambda x: x[1]['total'],
+                                    reverse=True):
+                lines.append('{}: {} calls, {} errors, {:.3f}s total, {:.3f}s avg, {:.3f}s max'
+                             .format(cmd, stat['calls'], stat['errors'], stat['total'],
+                                     stat['total'] / stat['calls'], stat['max']))
+        return lines
+
+    def print_stats(self, out=sys.stderr):
+        """Write the per-command call counters to <out>."""
+        for line in self.stats_report():
+            out.write(line + '\n')
+
+    def get_activity(self, session_key=None, session_id=None):
+        """Call Tautulli's get_activity api endpoint"""
+        payload = {}
+
+        if session_key:
+            payload['session_key'] = session_key
+        elif session_id:
+            payload['session_id'] = session_id
+
+        return self._call_api('get_activity', payload)
+
+    def notify(self, notifier_id, subject, body):
+        """Call Tautulli's notify api endpoint"""
+        payload = {'notifier_id': notifier_id,
+                   'subject': subject,
+                   'body': body}
+
+        # POST so a timed out notification is not sent again by the retries.
+        return self._call_api('notify', payload, method='POST')
+
+    def terminate_session(self, session_key=None, session_id=None, message=''):
+        """Call Tautulli's terminate_session api endpoint"""
+        payload = {}
+
+        if session_key:
+            payload['session_key'] = session_key
+        elif session_id:
+            payload['session_id'] = session_id
+
+        if message:
+            payload['message'] = message
+
+        # POST so a timed out terminate is not repeated by the retries.
+        return self._call_api('terminate_session', payload, method='POST')
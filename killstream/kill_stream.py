@@ -49,8 +49,14 @@ import sys
 import argparse
 import json
 import time
+import heapq
+import itertools
+import threading
+import traceback
 from datetime import datetime
-import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
 
 
 TAUTULLI_URL = ''
@@ -79,6 +85,12 @@ RICH_TYPE = ['discord', 'slack']
 
 TAUTULLI_ICON = 'https://github.com/Tautulli/Tautulli/raw/master/data/interfaces/default/images/logo-circle.png'
 
+tautulli = Tautulli(TAUTULLI_URL.rstrip('/'), TAUTULLI_APIKEY, VERIFY_SSL)
+
+# Shared PauseMonitor, set by killstream_daemon.py. When None each paused
+# event is watched by its own process.
+pause_monitor = None
+
 
 def utc_now_iso():
     """Get current time in ISO format"""
@@ -109,39 +121,41 @@ def debug_dump_vars():
           .rjust(len(TAUTULLI_APIKEY), "x"))
 
 
-def get_all_streams(user_id=None):
+def get_all_streams(user_id=None, client=tautulli):
     """Get a list of all current streams.
 
     Parameters
     ----------
     user_id : int
         The ID of the user to grab sessions for.
+    client : obj
+        Tautulli client to use.
     Returns
     -------
     objects
         The of stream objects.
     """
-    sessions = tautulli.get_activity()['sessions']
+    sessions = client.get_activity()['sessions']
 
     if user_id:
-        streams = [Stream(session=s) for s in sessions if s['user_id'] == user_id]
+        streams = [Stream(tautulli=client, session=s) for s in sessions if s['user_id'] == user_id]
     else:
-        streams = [Stream(session=s) for s in sessions]
+        streams = [Stream(tautulli=client, session=s) for s in sessions]
 
     return streams
 
 
-def notify(opts, message, kill_type=None, stream=None):
+def notify(opts, message, kill_type=None, stream=None, client=tautulli):
     """Decides which notifier type to use"""
     if opts.notify and opts.richMessage:
         rich_notify(opts.notify, opts.richMessage, opts.richColor, kill_type,
-                    opts.serverName, opts.plexUrl, opts.posterUrl, message, stream)
+                    opts.serverName, opts.plexUrl, opts.posterUrl, message, stream, client)
     elif opts.notify:
-        basic_notify(opts.notify, opts.sessionId, opts.username, message)
+        basic_notify(opts.notify, opts.sessionId, opts.username, message, stream, client)
 
 
 def rich_notify(notifier_id, rich_type, color=None, kill_type=None, server_name=None,
-                plex_url=None, poster_url=None, message=None, stream=None):
+                plex_url=None, poster_url=None, message=None, stream=None, client=tautulli):
     """Decides which rich notifier type to use. Set default values for empty variables
 
     Parameters
@@ -162,8 +176,10 @@ def rich_notify(notifier_id, rich_type, color=None, kill_type=None, server_name=
         Message sent to the client.
     stream : obj
         Stream object.
+    client : obj
+        Tautulli client to use.
     """
-    notification = Notification(notifier_id, SUBJECT_TEXT, BODY_TEXT, tautulli, stream)
+    notification = Notification(notifier_id, SUBJECT_TEXT, BODY_TEXT, client, stream)
 
     # Set a default server_name if none is provided
     if server_name is None:
@@ -207,9 +223,9 @@ def rich_notify(notifier_id, rich_type, color=None, kill_type=None, server_name=
         notification.send_slack(title, color, poster_url, plex_url, message, footer)
 
 
-def basic_notify(notifier_id, session_id, username=None, message=None):
+def basic_notify(notifier_id, session_id, username=None, message=None, stream=None, client=tautulli):
     """Basic notifier"""
-    notification = Notification(notifier_id, SUBJECT_TEXT, BODY_TEXT, tautulli, stream)
+    notification = Notification(notifier_id, SUBJECT_TEXT, BODY_TEXT, client, stream)
 
     if username:
         body = BODY_TEXT_USER.format(user=username,
@@ -219,88 +235,6 @@ def basic_notify(notifier_id, session_id, username=None, message=None):
     notification.send(SUBJECT_TEXT, body)
 
 
-class Tautulli:
-    def __init__(self, url, apikey, verify_ssl=False, debug=None):
-        self.url = url
-        self.apikey = apikey
-        self.debug = debug
-
-        self.session = requests.Session()
-        self.adapters = requests.adapters.HTTPAdapter(max_retries=3,
-                                                      pool_connections=1,
-                                                      pool_maxsize=1,
-                                                      pool_block=True)
-        self.session.mount('http://', self.adapters)
-        self.session.mount('https://', self.adapters)
-
-        # Ignore verifying the SSL certificate
-        if verify_ssl is False:
-            self.session.verify = False
-            # Disable the warning that the request is insecure, we know that...
-            import urllib3
-            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-    def _call_api(self, cmd, payload, method='GET', debug=None):
-        payload['cmd'] = cmd
-        payload['apikey'] = self.apikey
-
-        try:
-            response = self.session.request(method, self.url + '/api/v2', params=payload)
-        except:
-            print("Tautulli request failed for cmd '{}'. Invalid Tautulli URL?".format(cmd))
-            if self.debug:
-                traceback.print_exc()
-            return
-
-        try:
-            response_json = response.json()
-        except ValueError:
-            print("Failed to parse json response for Tautulli API cmd '{}'".format(cmd))
-            return
-
-        if response_json['response']['result'] == 'success':
-            if self.debug:
-                print("Successfully called Tautulli API cmd '{}'".format(cmd))
-            return response_json['response']['data']
-        else:
-            error_msg = response_json['response']['message']
-            print("Tautulli API cmd '{}' failed: {}".format(cmd, error_msg))
-            return
-
-    def get_activity(self, session_key=None, session_id=None):
-        """Call Tautulli's get_activity api endpoint"""
-        payload = {}
-
-        if session_key:
-            payload['session_key'] = session_key
-        elif session_id:
-            payload['session_id'] = session_id
-
-        return self._call_api('get_activity', payload)
-
-    def notify(self, notifier_id, subject, body):
-        """Call Tautulli's notify api endpoint"""
-        payload = {'notifier_id': notifier_id,
-                   'subject': subject,
-                   'body': body}
-
-        return self._call_api('notify', payload)
-
-    def terminate_session(self, session_key=None, session_id=None, message=''):
-        """Call Tautulli's terminate_session api endpoint"""
-        payload = {}
-
-        if session_key:
-            payload['session_key'] = session_key
-        elif session_id:
-            payload['session_id'] = session_id
-
-        if message:
-            payload['message'] = message
-
-        return self._call_api('terminate_session', payload)
-
-
 class Stream:
     def __init__(self, session_id=None, user_id=None, username=None, tautulli=None, session=None):
         self.session_id = session_id
@@ -349,41 +283,205 @@ class Stream:
         interval : int
             The amount of time to wait between checks of the session state.
         """
-        start = datetime.now()
-        checked_time = 0
+        killed = []
+        monitor = PauseMonitor(self.tautulli)
+        monitor.add(self, message, limit, interval, on_kill=killed.append)
+        monitor.run()
+        return bool(killed)
+
+
+class PausedSession:
+    def __init__(self, stream, message, limit, interval, on_kill=None):
+        self.stream = stream
+        self.message = message
+        self.limit = limit
+        self.interval = interval
+        self.on_kill = on_kill
+        self.start = time.time()
         # Continue checking 2 intervals past the allowed limit in order to
         # account for system variances.
-        check_limit = limit + (interval * 2)
-
-        while checked_time < check_limit:
-            self.get_all_stream_info()
-
-            if self.session_exists is False:
-                sys.stdout.write(
-                    "Session '{}'  from user '{}' is no longer active "
-                    .format(self.session_id, self.username)
-                    + "on the server, stopping monitoring.\n")
-                return False
-
-            now = datetime.now()
-            checked_time = (now - start).total_seconds()
-
-            if self.state == 'paused':
-                if checked_time >= limit:
-                    self.terminate(message)
-                    sys.stdout.write(
-                        "Session '{}' from user '{}' has been killed.\n"
-                        .format(self.session_id, self.username))
-                    return True
-                else:
-                    time.sleep(interval)
-
-            elif self.state == 'playing' or self.state == 'buffering':
-                sys.stdout.write(
-                    "Session '{}' from user '{}' has been resumed, "
-                    .format(self.session_id, self.username)
-                    + "stopping monitoring.\n")
-                return False
+        self.check_limit = limit + (interval * 2)
+
+    def next_check(self, now):
+        """Time of the next check: one interval from now, or the kill deadline.
+
+        Once the deadline has passed, a session that is neither paused nor
+        playing is checked again one interval later, not right away.
+        """
+        deadline = self.start + self.limit
+        if now >= deadline:
+            return now + self.interval
+        return min(now + self.interval, deadline)
+
+
+class PauseMonitor:
+    def __init__(self, tautulli):
+        """Watches every paused session from one thread.
+
+        The sessions are kept in a heap ordered by their next check. Each
+        time checks are due, one get_activity call covers all of them, so
+        many paused streams cost one request per interval instead of one
+        sleeping process and one request each.
+
+        Parameters
+        ----------
+        tautulli : obj
+            Tautulli object.
+        """
+        self.tautulli = tautulli
+        self.sessions = {}
+        self.heap = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+
+    def add(self, stream, message, limit, interval, on_kill=None):
+        """Start watching a paused stream.
+
+        A session that is already watched starts over, it was resumed and
+        paused again.
+
+        Parameters
+        ----------
+        stream : obj
+            Stream object with a session_id.
+        message : str
+            The message to use if the stream is terminated.
+        limit : int
+            The number of seconds the session is allowed to remain paused.
+        interval : int
+            The amount of time between checks of the session state.
+        on_kill : callable
+            Called with the stream after it has been terminated.
+        """
+        paused = PausedSession(stream, message, limit, interval, on_kill)
+        with self.cond:
+            self.sessions[stream.session_id] = paused
+            self._schedule(paused, paused.next_check(paused.start))
+            self.cond.notify()
+
+    def _schedule(self, paused, when):
+        heapq.heappush(self.heap, (when, next(self.counter), paused))
+
+    def _wait_due(self, forever):
+        """Block until checks are due and return the due sessions.
+
+        Returns None when nothing is watched and <forever> is False.
+        """
+        with self.cond:
+            while True:
+                # Drop heap entries of sessions that were added again or finished.
+                while self.heap and self.sessions.get(
+                        self.heap[0][2].stream.session_id) is not self.heap[0][2]:
+                    heapq.heappop(self.heap)
+                if not self.heap:
+                    if not forever:
+                        return None
+                    self.cond.wait()
+                    continue
+                delay = self.heap[0][0] - time.time()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+                due = []
+                now = time.time()
+                while self.heap and self.heap[0][0] <= now:
+                    paused = heapq.heappop(self.heap)[2]
+                    if self.sessions.get(paused.stream.session_id) is paused:
+                        due.append(paused)
+                return due
+
+    def _done(self, paused):
+        with self.cond:
+            if self.sessions.get(paused.stream.session_id) is paused:
+                del self.sessions[paused.stream.session_id]
+
+    def _check(self, due):
+        """Check the due sessions against one get_activity call."""
+        activity = self.tautulli.get_activity()
+        now = time.time()
+        try:
+            sessions = dict((s['session_id'], s) for s in activity['sessions'])
+        except (TypeError, KeyError):
+            # Tautulli did not answer, try again next interval.
+            with self.cond:
+                for paused in due:
+                    self._schedule(paused, now + paused.interval)
+            return
+
+        for paused in due:
+            try:
+                self._check_one(paused, sessions.get(paused.stream.session_id), now)
+            except Exception:
+                # One bad session must not stop the monitoring of the others.
+                sys.stderr.write("Checking paused session '{}' failed, stopping monitoring:\n{}"
+                                 .format(paused.stream.session_id, traceback.format_exc()))
+                self._done(paused)
+
+    def _check_one(self, paused, session, now):
+        """Kill, keep watching or stop watching one paused session."""
+        stream = paused.stream
+        checked_time = now - paused.start
+
+        if session is None:
+            stream.session_exists = False
+            sys.stdout.write(
+                "Session '{}'  from user '{}' is no longer active "
+                .format(stream.session_id, stream.username)
+                + "on the server, stopping monitoring.\n")
+            self._done(paused)
+            return
+
+        stream._set_stream_attributes(session)
+        stream.session_exists = True
+
+        if stream.state == 'paused' and checked_time >= paused.limit:
+            stream.terminate(paused.message)
+            sys.stdout.write(
+                "Session '{}' from user '{}' has been killed.\n"
+                .format(stream.session_id, stream.username))
+            self._done(paused)
+            if paused.on_kill:
+                try:
+                    paused.on_kill(stream)
+                except Exception:
+                    sys.stderr.write("Callback for killed session '{}' failed:\n{}"
+                                     .format(stream.session_id, traceback.format_exc()))
+
+        elif stream.state == 'playing' or stream.state == 'buffering':
+            sys.stdout.write(
+                "Session '{}' from user '{}' has been resumed, "
+                .format(stream.session_id, stream.username)
+                + "stopping monitoring.\n")
+            self._done(paused)
+
+        elif checked_time >= paused.check_limit:
+            self._done(paused)
+
+        else:
+            with self.cond:
+                self._schedule(paused, paused.next_check(now))
+
+    def run(self, forever=False):
+        """Check sessions as they become due.
+
+        Parameters
+        ----------
+        forever : bool
+            Keep waiting for new sessions instead of returning once none are
+            left. Used by killstream_daemon.py.
+        """
+        while True:
+            due = self._wait_due(forever)
+            if due is None:
+                return
+            self._check(due)
+
+    def start(self):
+        """Run the monitor forever in a background thread."""
+        thread = threading.Thread(target=self.run, kwargs={'forever': True})
+        thread.daemon = True
+        thread.start()
+        return thread
 
 
 class Notification:
@@ -539,7 +637,15 @@ class Notification:
         self.send(body=slack_message)
 
 
-if __name__ == "__main__":
+def main(argv=None):
+    """Run the script with the command line arguments in <argv>.
+
+    Parameters
+    ----------
+    argv : list
+        Arguments, defaults to sys.argv[1:]. killstream_daemon.py calls this
+        once per Tautulli event.
+    """
     parser = argparse.ArgumentParser(
         description="Killing Plex streams from Tautulli.")
     parser.add_argument('--jbop', required=True, choices=SELECTOR,
@@ -572,23 +678,21 @@ if __name__ == "__main__":
     parser.add_argument("--debug", action='store_true',
                         help='Enable debug messages.')
 
-    opts = parser.parse_args()
+    opts = parser.parse_args(argv)
 
     if not opts.sessionId and opts.jbop != 'allStreams':
         sys.stderr.write("No sessionId provided! Is this synced content?\n")
         sys.exit(1)
 
     if opts.debug:
-        # Import traceback to get more deatiled information
-        import traceback
         # Dump the ENVs passed from tatutulli
         debug_dump_vars()
 
-    # Create a Tautulli instance
-    tautulli = Tautulli(TAUTULLI_URL.rstrip('/'), TAUTULLI_APIKEY, VERIFY_SSL, opts.debug)
+    # Own debug flag per run, the daemon shares tautulli between runs.
+    client = tautulli.with_debug(opts.debug)
 
     # Create initial Stream object with basic info
-    stream = Stream(opts.sessionId, opts.userId, opts.username, tautulli)
+    stream = Stream(opts.sessionId, opts.userId, opts.username, client)
 
     # Only pull all stream info if using richMessage
     if opts.notify and opts.richMessage:
@@ -602,15 +706,24 @@ if __name__ == "__main__":
 
     if opts.jbop == 'stream':
         stream.terminate(message)
-        notify(opts, message, 'Stream', stream)
+        notify(opts, message, 'Stream', stream, client)
 
     elif opts.jbop == 'allStreams':
-        streams = get_all_streams(opts.userId)
+        streams = get_all_streams(opts.userId, client)
         for stream in streams:
-            tautulli.terminate_session(session_id=stream.session_id, message=message)
-            notify(opts, message, 'All Streams', stream)
+            client.terminate_session(session_id=stream.session_id, message=message)
+            notify(opts, message, 'All Streams', stream, client)
 
     elif opts.jbop == 'paused':
+        if pause_monitor is not None:
+            pause_monitor.add(stream, message, opts.limit, opts.interval,
+                              on_kill=lambda s: notify(opts, message, 'Paused', s, client))
+            sys.stdout.write("Monitoring paused session '{}'.\n".format(stream.session_id))
+            return
         killed_stream = stream.terminate_long_pause(message, opts.limit, opts.interval)
         if killed_stream:
-            notify(opts, message, 'Paused', stream)
+            notify(opts, message, 'Paused', stream, client)
+
+
+if __name__ == "__main__":
+    main()
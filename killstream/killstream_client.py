@@ -0,0 +1,42 @@
+"""
+Description: Forward a Tautulli event to killstream_daemon.py.
+Author: Blacktwin
+Requires: nothing outside the standard library
+
+Usage (as the Tautulli script file):
+    killstream_client.py kill_stream --jbop stream --sessionId {session_id} ...
+    killstream_client.py limiterr --jbop plays --username {username} ...
+
+If the daemon is not running the script is run in this process instead, so
+the notification agent keeps working while the daemon is restarted.
+"""
+
+import os
+import sys
+import socket
+import importlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.daemon import forward, SOCKET_PATH
+
+
+SCRIPTS = ['kill_stream', 'limiterr']
+
+
+def main(argv):
+    if not argv or argv[0] not in SCRIPTS:
+        sys.stderr.write('First argument must be one of: {}\n'.format(', '.join(SCRIPTS)))
+        return 2
+    script, args = argv[0], argv[1:]
+
+    try:
+        return forward(SOCKET_PATH, script, args)
+    except socket.error as e:
+        sys.stderr.write('killstream_daemon not reachable ({}), running {} directly.\n'
+                         .format(e, script))
+
+    return importlib.import_module(script).main(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
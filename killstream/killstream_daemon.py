@@ -0,0 +1,47 @@
+"""
+Description: Keep kill_stream.py and limiterr.py loaded between Tautulli events.
+Author: Blacktwin
+Requires: requests, plexapi
+
+Tautulli starts a new process for every Playback Start/Pause, which pays for
+the Python startup, the plexapi import, the PlexServer connection and the
+library list every time. This daemon imports both scripts once and runs them
+for the events forwarded by killstream_client.py over a Unix socket.
+
+Start the daemon with the same environment variables the scripts read
+(TAUTULLI_URL, TAUTULLI_APIKEY, PLEX_URL, PLEX_TOKEN), as the same user as
+Tautulli:
+
+    TAUTULLI_URL=... TAUTULLI_APIKEY=... PLEX_URL=... PLEX_TOKEN=... \\
+        python killstream_daemon.py
+
+Then point the Tautulli script agent at killstream_client.py instead of the
+script and put the script name first in the arguments:
+
+ Script File: ./killstream_client.py
+ Arguments: kill_stream --jbop stream --username {username} ...
+            limiterr --jbop plays --username {username} ...
+
+Optional: JBOPS_SOCKET=/path/to/socket (default jbops.sock in the jbops cache
+folder, ~/.cache/jbops or JBOPS_CACHE_DIR) for both.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.daemon import serve, SOCKET_PATH
+
+import kill_stream
+import limiterr
+
+
+SCRIPTS = {'kill_stream': kill_stream.main,
+           'limiterr': limiterr.main}
+
+
+if __name__ == "__main__":
+    # One monitor watches every paused session instead of one process each.
+    kill_stream.pause_monitor = kill_stream.PauseMonitor(kill_stream.tautulli)
+    kill_stream.pause_monitor.start()
+    serve(SOCKET_PATH, SCRIPTS)
@@ -45,12 +45,15 @@ Taultulli > Settings > Notification Agents > New Script > Script Arguments:
 
 import requests
 import argparse
-from datetime import datetime
 import sys
 import os
 from plexapi.server import PlexServer, CONFIG
 from time import time as ttime
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+from jbops.history import HistoryStore, start_of_day
+
 TAUTULLI_URL = ''
 TAUTULLI_APIKEY = ''
 PLEX_URL = ''
@@ -75,6 +78,10 @@ BODY_TEXT_USER = "Killed {user}'s stream. Reason: {message}."
 LIMIT_MESSAGE = 'Are you still watching or are you asleep? ' \
                 'If not please wait ~{delay} seconds and try again.'
 
+# Runs on every playback start, so only the history since the last check is
+# read back, with enough overlap for sessions of up to this many seconds.
+SYNC_OVERLAP = 4 * 60 * 60
+
 sess = requests.Session()
 # Ignore verifying the SSL certificate
 sess.verify = False  # '/path/to/certfile'
@@ -87,12 +94,12 @@ if sess.verify is False:
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 plex = PlexServer(PLEX_URL, PLEX_TOKEN, session=sess)
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY, verify_ssl=sess.verify)
+history_db = HistoryStore(tautulli)
 lib_dict = {x.title : x.key for x in plex.library.sections()}
 
 
 SELECTOR = ['watch', 'plays', 'time', 'limit']
-TODAY = datetime.today().strftime('%Y-%m-%d')
-unix_time = int(ttime())
 
 
 def send_notification(subject_text, body_text, notifier_id):
@@ -107,20 +114,13 @@ def send_notification(subject_text, body_text, notifier_id):
     notifier_id : int
         Tautulli Notification Agent ID to send the notification to.
     """
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'notify',
-               'notifier_id': notifier_id,
+    payload = {'notifier_id': notifier_id,
                'subject': subject_text,
                'body': body_text}
 
     try:
-        req = sess.post(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = req.json()
-
-        if response['response']['result'] == 'success':
-            sys.stdout.write("Successfully sent Tautulli notification.\n")
-        else:
-            raise Exception(response['response']['message'])
+        tautulli.api_call('notify', payload, method='POST')
+        sys.stdout.write("Successfully sent Tautulli notification.\n")
     except Exception as e:
         sys.stderr.write(
             "Tautulli API 'notify' request failed: {0}.\n".format(e))
@@ -135,14 +135,8 @@ def get_activity():
     list
         The current active sessions on the Plex server.
     """
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_activity'}
-
     try:
-        req = sess.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = req.json()
-
-        res_data = response['response']['data']['sessions']
+        res_data = tautulli.api_call('get_activity')['sessions']
         return res_data
 
     except Exception as e:
@@ -151,8 +145,16 @@ def get_activity():
         pass
 
 
+def sync_history():
+    """Pull the Tautulli history added since the last run into the local store."""
+    try:
+        history_db.sync(overlap=SYNC_OVERLAP)
+    except Exception as e:
+        sys.stderr.write("Tautulli API 'get_history' request failed: {0}.\n".format(e))
+
+
 def get_history(username, start_date=None, section_id=None):
-    """Get the Tautulli history.
+    """Get the Tautulli history from the local store.
 
     Parameters
     ----------
@@ -161,35 +163,18 @@ def get_history(username, start_date=None, section_id=None):
 
     Optional
     ----------
-    start_date : str "YYYY-MM-DD"
-        The date in history to search.
+    start_date : bool
+        Only search today's history.
     section_id : int
         The libraries numeric identifier
 
     Returns
     -------
-    dict
-        The total number of watches, plays, or total playtime.
+    list
+        The user's plays, newest first.
     """
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_history',
-               'user': username}
-
-    if start_date:
-        payload['start_date'] = TODAY
-
-    if section_id:
-        payload['section_id '] = section_id
-
-    try:
-        req = sess.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = req.json()
-
-        res_data = response['response']['data']
-        return res_data
-
-    except Exception as e:
-        sys.stderr.write("Tautulli API 'get_history' request failed: {0}.".format(e))
+    since = start_of_day() if start_date else None
+    return history_db.plays(user=username, since=since, section_id=section_id)
 
 
 def get_user_session_ids(user_id):
@@ -226,28 +211,20 @@ def terminate_session(session_id, message, notifier=None, username=None):
     username : str
         The username for the terminated session (the default is None).
     """
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'terminate_session',
-               'session_id': session_id,
+    payload = {'session_id': session_id,
                'message': message}
 
     try:
-        req = sess.post(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = req.json()
-
-        print(response)
-        if response['response']['result'] == 'success':
-            sys.stdout.write(
-                "Successfully killed Plex session: {0}.\n".format(session_id))
-            if notifier:
-                if username:
-                    body = BODY_TEXT_USER.format(user=username,
-                                                 message=message)
-                else:
-                    body = BODY_TEXT.format(id=session_id, message=message)
-                send_notification(SUBJECT_TEXT, body, notifier)
-        else:
-            raise Exception(response['response']['message'])
+        tautulli.api_call('terminate_session', payload, method='POST')
+        sys.stdout.write(
+            "Successfully killed Plex session: {0}.\n".format(session_id))
+        if notifier:
+            if username:
+                body = BODY_TEXT_USER.format(user=username,
+                                             message=message)
+            else:
+                body = BODY_TEXT.format(id=session_id, message=message)
+            send_notification(SUBJECT_TEXT, body, notifier)
     except Exception as e:
         sys.stderr.write(
             "Tautulli API 'terminate_session' request failed: {0}.".format(e))
@@ -258,7 +235,15 @@ def arg_decoding(arg):
     return arg.decode(TAUTULLI_ENCODING).encode('UTF-8')
 
 
-if __name__ == "__main__":
+def main(argv=None):
+    """Run the script with the command line arguments in <argv>.
+
+    Parameters
+    ----------
+    argv : list
+        Arguments, defaults to sys.argv[1:]. killstream_daemon.py calls this
+        once per Tautulli event.
+    """
     parser = argparse.ArgumentParser(
         description="Limiting Plex users by plays, watches, or total time from Tautulli.")
     parser.add_argument('--jbop', required=True, choices=SELECTOR,
@@ -284,7 +269,9 @@ if __name__ == "__main__":
     parser.add_argument('--today', default=False, action='store_true',
                         help='Search history only for today. \n'
                              'Default: %(default)s')
-    opts = parser.parse_args()
+    opts = parser.parse_args(argv)
+
+    unix_time = int(ttime())
 
     total_limit = 0
     total_jbop = 0
@@ -311,18 +298,19 @@ if __name__ == "__main__":
     else:
         message = ''
 
-    if opts.section:
-        section_id = lib_dict[opts.section]
-        history = get_history(username=opts.username, section_id=section_id, start_date=opts.today)
+    sync_history()
+
+    section_id = int(lib_dict[opts.section]) if opts.section else None
+    if opts.jbop == 'plays':
+        since = start_of_day() if opts.today else None
+        total_jbop = history_db.count(user=opts.username, since=since, section_id=section_id)
     else:
-        history = get_history(username=opts.username, start_date=opts.today)
+        history = get_history(username=opts.username, section_id=section_id, start_date=opts.today)
 
     if opts.jbop == 'watch':
-        total_jbop = sum([data['watched_status'] for data in history['data']])
+        total_jbop = sum([data['watched_status'] for data in history])
     if opts.jbop == 'time':
-        total_jbop = sum([data['duration'] for data in history['data']])
-    if opts.jbop == 'plays':
-        total_jbop = history['recordsFiltered']
+        total_jbop = sum([data['duration'] for data in history])
 
     if total_jbop:
         if total_jbop > total_limit:
@@ -337,7 +325,7 @@ if __name__ == "__main__":
     if opts.jbop == 'limit' and opts.grandparent_rating_key:
         history = get_history(username=opts.username, start_date=True)
         message = LIMIT_MESSAGE.format(delay=opts.delay)
-        ep_watched = [data['watched_status'] for data in history['data']
+        ep_watched = [data['watched_status'] for data in history
                       if data['grandparent_rating_key'] == opts.grandparent_rating_key
                       and data['watched_status'] == 1]
         if not ep_watched:
@@ -345,7 +333,7 @@ if __name__ == "__main__":
         else:
             ep_watched = sum(ep_watched)
 
-        stopped_time = [data['stopped'] for data in history['data']
+        stopped_time = [data['stopped'] for data in history
                         if data['grandparent_rating_key'] == opts.grandparent_rating_key
                         and data['watched_status'] == 1]
         if not stopped_time:
@@ -363,4 +351,8 @@ if __name__ == "__main__":
             terminate_session(opts.sessionId, message, opts.notify, opts.username)
         else:
             print("{}'s limit is {} but has only watched {} episodes of this show today."
-                .format(opts.username, total_limit, ep_watched))
\ No newline at end of file
+                .format(opts.username, total_limit, ep_watched))
+
+
+if __name__ == "__main__":
+    main()
@@ -35,6 +35,12 @@ import time
 import webbrowser
 import re
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+from jbops.choices import CachedChoices
+from jbops.geoip import GeoCache
+from jbops.jsonstream import write_json
+
 ## EDIT THESE SETTINGS ##
 TAUTULLI_APIKEY = ''  # Your Tautulli API key
 TAUTULLI_URL = 'http://localhost:8181/'  # Your Tautulli URL
@@ -72,6 +78,10 @@ PLATFORM_COLORS = {'Android': '#a4c639',  # Green
 title_string = "Location of Plex users based on ISP data"
 
 
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+geo_cache = GeoCache(tautulli)
+
+
 def clean_up_text(title):
     cleaned = re.sub('\W+', ' ', title)
     return cleaned
@@ -102,22 +112,16 @@ class UserIPs(object):
 
 def get_users_tables(users='', length=''):
     # Get the users list from Tautulli
-
+    payload = {}
     if length:
-        payload = {'apikey': TAUTULLI_APIKEY,
-                   'cmd': 'get_users_table',
-                   'length': length}
-    else:
-        payload = {'apikey': TAUTULLI_APIKEY,
-                   'cmd': 'get_users_table'}
+        payload['length'] = length
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']['data']
+        response = tautulli.api_call('get_users_table', payload)
+        res_data = response['data']
         if not length and not users:
             # Return total user count
-            return response['response']['data']['recordsTotal']
+            return response['recordsTotal']
         else:
             if users == 'all':
                 return [d['user_id'] for d in res_data]
@@ -132,40 +136,26 @@ def get_users_tables(users='', length=''):
 
 def get_users_ips(user_id, length):
     # Get the user IP list from Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_user_ips',
-               'user_id': user_id}
+    payload = {'user_id': user_id}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']['data']
+        res_data = tautulli.api_call('get_user_ips', payload)['data']
         return [UserIPs(data=d) for d in res_data]
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_users_ips' request failed: {0}.".format(e))
 
 
-def get_geoip_info(ip_address=''):
-    # Get the geo IP lookup from Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_geoip_lookup',
-               'ip_address': ip_address}
+def get_geoip_info(ip_lst):
+    # Get the geo IP lookups from the cache, Tautulli is only asked for new IPs.
+    return dict((ip, GeoData(data=data)) for ip, data in geo_cache.resolve(ip_lst).items()
+                if data is not None)
 
-    try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        if response['response']['result'] == 'success':
-            data = response['response']['data']
-            if data.get('error'):
-                raise Exception(data['error'])
-            else:
-                sys.stdout.write("Successfully retrieved geolocation data.")
-                return GeoData(data=data)
-        else:
-            raise Exception(response['response']['message'])
-    except Exception as e:
-        sys.stderr.write("Tautulli API 'get_geoip_lookup' request failed: {0}.".format(e))
-        pass
+
+def wan_ip(ip):
+    # Replace LAN IPs so they can be located.
+    if ip.startswith(LAN_SUBNET) and REPLACEMENT_WAN_IP:
+        return REPLACEMENT_WAN_IP
+    return ip
 
 
 def add_to_dictlist(d, key, val):
@@ -183,27 +173,29 @@ def get_geo_dict(length, users):
                                    'ip': REPLACEMENT_WAN_IP, 'play_count': 0, 'platform': SERVER_PLATFORM,
                                    'location_count': 0}]}
 
+    user_ips = []
     for i in get_users_tables(users):
-        user_ip = get_users_ips(user_id=i, length=length)
-        city_cnt = 0
-        for a in user_ip:
-            try:
-                ip = a.ip_address
-                if ip.startswith(LAN_SUBNET) and REPLACEMENT_WAN_IP:
-                    ip = REPLACEMENT_WAN_IP
-
-                g = get_geoip_info(ip_address=ip)
-
-                add_to_dictlist(geo_dict, a.friendly_name, {'lon': str(g.longitude), 'lat': str(g.latitude),
-                                                            'city': str(g.city), 'region': str(g.region),
-                                                            'ip': ip, 'play_count': a.play_count,
-                                                            'platform': a.platform, 'location_count': city_cnt})
-            except AttributeError:
-                print('User: {} IP: {} caused error in geo_dict.'.format(a.friendly_name, a.ip_address))
-                pass
-            except Exception as e:
-                print('Error here: {}'.format(e))
-                pass
+        user_ips += get_users_ips(user_id=i, length=length) or []
+
+    # Look up every distinct IP once, before building the map.
+    geo_lst = get_geoip_info([wan_ip(a.ip_address) for a in user_ips])
+
+    city_cnt = 0
+    for a in user_ips:
+        try:
+            ip = wan_ip(a.ip_address)
+            g = geo_lst.get(ip)
+
+            add_to_dictlist(geo_dict, a.friendly_name, {'lon': str(g.longitude), 'lat': str(g.latitude),
+                                                        'city': str(g.city), 'region': str(g.region),
+                                                        'ip': ip, 'play_count': a.play_count,
+                                                        'platform': a.platform, 'location_count': city_cnt})
+        except AttributeError:
+            print('User: {} IP: {} caused error in geo_dict.'.format(a.friendly_name, a.ip_address))
+            pass
+        except Exception as e:
+            print('Error here: {}'.format(e))
+            pass
     return geo_dict
 
 
@@ -373,8 +365,9 @@ def draw_map(map_type, geo_dict, filename, headless, leg_choice):
 if __name__ == '__main__':
 
     timestr = time.strftime("%Y%m%d-%H%M%S")
-    user_count = get_users_tables()
-    user_lst = sorted(get_users_tables('friendly_name', user_count))
+    user_lst = CachedChoices('tautulli_friendly_names',
+                             lambda: sorted(get_users_tables('friendly_name', get_users_tables())),
+                             key=TAUTULLI_URL)
     json_check = sorted([f for f in os.listdir('.') if os.path.isfile(f) and f.endswith(".json")],
                         key=os.path.getmtime)
     parser = argparse.ArgumentParser(description="Use PlexPy to draw map of user locations base on IP address.",
@@ -423,7 +416,7 @@ if __name__ == '__main__':
             json_file = '{}.json'.format(''.join(opts.filename))
         geo_json = get_geo_dict(opts.count, users)
         with open(json_file, 'w') as fp:
-            json.dump(geo_json, fp, indent=4, sort_keys=True)
+            write_json(fp, geo_json)
 
     if opts.map == 'Geo':
         geojson = get_geojson_dict(geo_json)
@@ -20,20 +20,27 @@ Uses:
 
 """
 
-import requests
 import sys
 import time
 import os
+import json
+import sqlite3
+import threading
+import requests
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.image import MIMEImage
 import email.utils
 import smtplib
-import urllib
 import cgi
 import uuid
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.cache import cache_path
+from jbops.fanout import fan_out
+from jbops.tautulli import Tautulli
+
 
 
 ## EDIT THESE SETTINGS ##
@@ -60,8 +67,79 @@ poster_w = 100
 art_h = 100
 art_w = 205
 
+WORKERS = 8  # Number of metadata and image requests made at the same time.
+METADATA_TTL = 24 * 60 * 60  # Seconds metadata is kept for the next emails.
+IMAGE_TTL = 30 * 24 * 60 * 60  # Seconds resized images are kept for the next emails.
+RECENT_COUNT = 100  # Recently added items requested per page.
+
 ## /EDIT THESE SETTINGS ##
 
+# The metadata and image stages each make WORKERS requests at the same time.
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY, pool_maxsize=2 * WORKERS)
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    key TEXT PRIMARY KEY,
+    data BLOB,
+    created INTEGER
+);
+CREATE TABLE IF NOT EXISTS images (
+    key TEXT PRIMARY KEY,
+    data BLOB,
+    created INTEGER
+);
+"""
+
+# get_metadata fields used by METAINFO, the only ones cached.
+METADATA_FIELDS = ('added_at', 'parent_rating_key', 'title', 'rating_key', 'media_type',
+                   'grandparent_title', 'art', 'summary')
+
+
+class EmailCache(object):
+    def __init__(self, path=None):
+        """Metadata and resized images of emailed items, kept between runs.
+
+        Daily and weekly emails list many of the same items, the later ones
+        reuse what the earlier ones fetched. Safe to use from the pipeline
+        threads.
+
+        Parameters
+        ----------
+        path : str
+            SQLite file. Defaults to notify_added_custom.sqlite in the jbops
+            cache folder.
+        """
+        self.db = sqlite3.connect(path or cache_path('notify_added_custom.sqlite'), timeout=60,
+                                  check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.executescript(CACHE_SCHEMA)
+        now = int(time.time())
+        with self.db:
+            self.db.execute('DELETE FROM metadata WHERE created < ?', (now - METADATA_TTL,))
+            self.db.execute('DELETE FROM images WHERE created < ?', (now - IMAGE_TTL,))
+
+    def get(self, table, key):
+        with self.lock:
+            row = self.db.execute('SELECT data FROM {} WHERE key = ?'.format(table), (key,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def put(self, table, key, data):
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO {} (key, data, created) VALUES (?, ?, ?)'.format(table),
+                            (key, sqlite3.Binary(data), int(time.time())))
+
+
+cache = None
+
+
+def email_cache():
+    # Open the cache the first time it is needed, not at import.
+    global cache
+    if cache is None:
+        cache = EmailCache()
+    return cache
+
+
 class METAINFO(object):
     def __init__(self, data=None):
         d = data or {}
@@ -77,39 +155,36 @@ class METAINFO(object):
 
 def get_recent(section_id, start, count):
     # Get the metadata for a media item. Count matters!
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'start': str(start),
+    payload = {'start': str(start),
                'count': str(count),
-               'section_id': section_id,
-               'cmd': 'get_recently_added'}
+               'section_id': section_id}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
+        res_data = tautulli.api_call('get_recently_added', payload)['recently_added']
 
-        if response['response']['result'] == 'success':
-            res_data = response['response']['data']['recently_added']
-
-            return res_data
+        return res_data
 
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_recently_added' request failed: {0}.".format(e))
 
 
-def get_metadata(rating_key):
-    # Get the metadata for a media item.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'rating_key': rating_key,
-               'cmd': 'get_metadata',
-               'media_info': True}
+def get_metadata(rating_key, updated_at=''):
+    # Get the metadata for a media item, from the cache when an earlier email
+    # had it and the item was not updated since.
+    cache_key = '{}:{}'.format(rating_key, updated_at)
+    cached = email_cache().get('metadata', cache_key)
+    if cached:
+        return METAINFO(data=json.loads(cached.decode('utf-8')))
+
+    payload = {'rating_key': rating_key}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        if response['response']['result'] == 'success':
-            res_data = response['response']['data']
+        res_data = tautulli.api_call('get_metadata', payload)
+        meta = METAINFO(data=res_data)
+        data = dict((field, res_data[field]) for field in METADATA_FIELDS)
+        email_cache().put('metadata', cache_key, json.dumps(data).encode('utf-8'))
 
-            return METAINFO(data=res_data)
+        return meta
 
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_metadata' request failed: {0}.".format(e))
@@ -117,13 +192,8 @@ def get_metadata(rating_key):
 
 def get_libraries_table():
     # Get the data on the Tautulli libraries table.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_libraries_table'}
-
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']['data']
+        res_data = tautulli.api_call('get_libraries_table')['data']
         return [d['section_id'] for d in res_data if d['section_name'] in LIBRARY_NAMES]
 
     except Exception as e:
@@ -132,30 +202,25 @@ def get_libraries_table():
 
 def update_library_media_info(section_id):
     # Get the data on the Tautulli media info tables.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_library_media_info',
-               'section_id': section_id,
+    payload = {'section_id': section_id,
                'refresh': True}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.status_code
-        if response != 200:
-            print(r.content)
+        tautulli.api_call('get_library_media_info', payload)
 
     except Exception as e:
         sys.stderr.write("Tautulli API 'update_library_media_info' request failed: {0}.".format(e))
 
 
-def get_pms_image_proxy(thumb):
-    # Gets an image from the PMS and saves it to the image cache directory.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'pms_image_proxy',
-               'img': thumb}
+def get_pms_image_proxy(thumb, width, height):
+    # Url of an image from the PMS, resized by the PMS photo transcoder.
+    payload = {'img': thumb,
+               'width': width,
+               'height': height,
+               'img_format': 'jpeg'}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload, stream=True)
-        return r.url
+        return tautulli.api_url('pms_image_proxy', payload)
 
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_users_tables' request failed: {0}.".format(e))
@@ -163,78 +228,132 @@ def get_pms_image_proxy(thumb):
 
 def get_users():
     # Get the user list from Tautulli.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_users'}
-
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']
+        res_data = tautulli.api_call('get_users')
         return [d for d in res_data]
 
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_user' request failed: {0}.".format(e))
 
 
-def get_rating_keys(TODAY, LASTDATE):
-
-    recent_lst = []
-    # Get the rating_key for what was recently added
-    count = 25
-    for section_id in glt:
-        start = 0
-
-        while True:
-            # Assume all items will be returned in descending order of added_at
-            recent_items = get_recent(section_id, start, count)
-
-            if all([recent_items]):
-                start += count
-                for item in recent_items:
-                    if LASTDATE <= int(item['added_at']) <= TODAY:
-                        recent_lst.append(item['rating_key'])
-                continue
-            elif not all([recent_items]):
-                break
-
-            start += count
-    if recent_lst:
-        return recent_lst
-    sys.stderr.write("Recently Added list: {0}.".format(recent_lst))
-    exit()
-
-
-def build_html(rating_key, height, width, pic_type):
+def recent_keys(section_id, since, until):
+    # (rating key, updated at) of one library's items added between since and until.
+    keys = []
+    start = 0
+    while True:
+        recent_items = get_recent(section_id, start, RECENT_COUNT)
+        if not recent_items:
+            break
+        for item in recent_items:
+            if since <= int(item['added_at']) <= until:
+                keys.append((item['rating_key'], item.get('updated_at') or ''))
+        # Items are returned in descending order of added_at, the rest is older.
+        if int(recent_items[-1]['added_at']) < since:
+            break
+        start += RECENT_COUNT
+    return keys
+
+
+def iter_rating_keys(section_ids, since, until):
+    """Yield (rating key, updated at) of the items added between since and until, once each.
+
+    The libraries are paged through concurrently, the keys of a library are
+    yielded as soon as it is done.
+    """
+    seen = set()
+    for keys in fan_out(lambda section_id: recent_keys(section_id, since, until), section_ids,
+                        workers=WORKERS, ordered=False):
+        for key, updated_at in keys:
+            if key not in seen:
+                seen.add(key)
+                yield key, updated_at
+
+
+def build_image(meta, height, width, pic_type):
+    # Image of an item, fetched at the size it is shown by fetch_image().
+    thumb = meta.thumb
+    if pic_type == 'poster':
+        thumb = thumb.replace('/art/', '/poster/')
+    thumb_url = get_pms_image_proxy(thumb, width, height)
+    image_name = "{}.jpg".format(str(meta.rating_key))
+    # The thumb path ends with the time it was updated, a new image gets a new key.
+    return dict(title=meta.rating_key, name=image_name, url=thumb_url, cid=str(uuid.uuid4()),
+                key='{}:{}:{}x{}'.format(meta.rating_key, thumb, width, height))
 
-    meta = get_metadata(str(rating_key))
 
+def build_html(meta, image, height, width):
+    # Email parts of an item. Without image data the <img> tag is left out,
+    # a cid: reference to a missing attachment shows as a broken image.
     added = time.ctime(float(meta.added_at))
-    # Pull image url
-    thumb_url = "{}.jpeg".format(get_pms_image_proxy(meta.thumb))
-    if pic_type == 'poster':
-        thumb_url = thumb_url.replace('%2Fart%', '%2Fposter%')
-    image_name = "{}.jpg".format(str(rating_key))
-    # Saving image in current path
-    urllib.urlretrieve(thumb_url, image_name)
-    image = dict(title=meta.rating_key, path=image_name, cid=str(uuid.uuid4()))
+    img = ''
+    if image['data']:
+        img = '<img src="cid:{cid}" alt="{alt}" width="{width}" height="{height}">' \
+            .format(alt=cgi.escape(meta.rating_key, quote=True), width=width, height=height, **image)
     if meta.grandparent_title == '' or meta.media_type == 'movie':
         # Movies
         notify = u"<dt>{x.title} ({x.rating_key}) was added {when}.</dt>" \
                        u"</dt> <dd> <table> <tr> <th>" \
-                       '<img src="cid:{cid}" alt="{alt}" width="{width}" height="{height}"> </th>' \
+                       u"{img} </th>" \
                        u" <th id=t11> {x.summary} </th> </tr> </table> </dd> <br>" \
-            .format(x=meta, when=added, alt=cgi.escape(meta.rating_key), quote=True, width=width, height=height,**image)
+            .format(x=meta, when=added, img=img)
     else:
         # Shows
         notify = u"<dt>{x.grandparent_title}: {x.title} ({x.rating_key}) was added {when}." \
                        u"</dt> <dd> <table> <tr> <th>" \
-                       '<img src="cid:{cid}" alt="{alt}" width="{width}" height="{height}"> </th>' \
+                       u"{img} </th>" \
                        u" <th id=t11> {x.summary} </th> </tr> </table> </dd> <br>" \
-            .format(x=meta, when=added, alt=cgi.escape(meta.rating_key), quote=True, width=width, height=height, **image)
+            .format(x=meta, when=added, img=img)
 
     image_text = MIMEText(u'[image: {title}]'.format(**image), 'plain', 'utf-8')
 
-    return image_text, image, notify
+    return image_text, image if image['data'] else None, notify
+
+
+def fetch_image(image):
+    # Bytes of a resized image, from the cache when an earlier email had it.
+    data = email_cache().get('images', image['key'])
+    if data:
+        return data
+    try:
+        r = tautulli.session.get(image['url'], timeout=tautulli.timeout)
+        r.raise_for_status()
+        if not r.headers.get('Content-Type', '').startswith('image/'):
+            raise requests.exceptions.RequestException('not an image')
+    except requests.exceptions.RequestException as e:
+        sys.stderr.write("Tautulli API 'pms_image_proxy' request failed: {0}.\n".format(e))
+        return None
+    email_cache().put('images', image['key'], r.content)
+    return r.content
+
+
+def collect(section_ids, since, until, height, width, pic_type):
+    """Build the email parts of everything added between since and until.
+
+    Paging through the recently added items, fetching metadata and fetching
+    images are overlapping stages, each with WORKERS requests at a time. The
+    html is built once the image is known.
+
+    Returns
+    -------
+    list
+        (image_text, image, notify) per item, sorted by rating key like
+        before. Items whose metadata failed are left out, image is None and
+        the html has no <img> for items whose image failed.
+    """
+    def with_meta(key):
+        rating_key, updated_at = key
+        return rating_key, get_metadata(str(rating_key), updated_at)
+
+    def with_image(item):
+        rating_key, meta = item
+        image = build_image(meta, height, width, pic_type)
+        image['data'] = fetch_image(image)
+        return rating_key, meta, image
+
+    keys = iter_rating_keys(section_ids, since, until)
+    metas = (item for item in fan_out(with_meta, keys, workers=WORKERS, ordered=False) if item[1])
+    items = sorted(fan_out(with_image, metas, workers=WORKERS, ordered=False), key=lambda x: x[0])
+    return [build_html(meta, image, height, width) for rating_key, meta, image in items]
 
 
 def send_email(msg_text_lst, notify_lst, image_lst, to, days):
@@ -273,12 +392,9 @@ def send_email(msg_text_lst, notify_lst, image_lst, to, days):
     message_alternative.attach(msg_html)
 
     for img in image_lst:
-        with open(img['path'], 'rb') as file:
-            message_image_lst = [MIMEImage(file.read(), name=os.path.basename(img['path']))]
-
-        for msg in message_image_lst:
-            message.attach(msg)
-            msg.add_header('Content-ID', '<{}>'.format(img['cid']))
+        msg = MIMEImage(img['data'], 'jpeg', name=img['name'])
+        message.attach(msg)
+        msg.add_header('Content-ID', '<{}>'.format(img['cid']))
 
     mailserver = smtplib.SMTP(email_server, email_port)
     mailserver.ehlo()
@@ -337,23 +453,21 @@ if __name__ == '__main__':
                     to = to + [str(get_users['email'])]
     print('Sending email(s) to {}'.format(', '.join(to)))
 
-    # Gather rating_keys on recently added media.
-    rating_keys_lst = get_rating_keys(TODAY, LASTDATE)
+    # Build html elements from what was recently added
+    build_parts = collect(glt, LASTDATE, TODAY, height, width, opts.type)
+    if not build_parts:
+        sys.stderr.write("Recently Added list: [].")
+        exit()
 
-    # Build html elements from rating_key
     image_lst = []
     msg_text_lst = []
     notify_lst = []
 
-    build_parts = [build_html(rating_key, height, width, opts.type) for rating_key in sorted(rating_keys_lst)]
     for parts in build_parts:
         msg_text_lst.append(parts[0])
-        image_lst.append(parts[1])
+        if parts[1]:
+            image_lst.append(parts[1])
         notify_lst.append(parts[2])
 
     # Send email
     send_email(msg_text_lst, notify_lst, image_lst, to, opts.days)
-
-    # Delete images in current path
-    for img in image_lst:
-        os.remove(img['path'])
@@ -14,11 +14,14 @@ Tautulli > Settings > Notification Agents > Scripts > Gear icon:
 Tautulli Settings > Notification Agents > Scripts (Gear) > Script Timeout: 0 to disable or set to > 180
 """
 
-import requests
+import os
 import sys
 import argparse
 from time import sleep
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+
 ## EDIT THESE SETTINGS ##
 TAUTULLI_APIKEY = ''  # Your Tautulli API key
 TAUTULLI_URL = 'http://localhost:8181/'  # Your Tautulli URL
@@ -43,15 +46,13 @@ BODY_TEXT = """\
         """
 
 
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+
+
 def get_activity():
     # Get the current activity on the PMS.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_activity'}
-
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']['sessions']
+        res_data = tautulli.api_call('get_activity')['sessions']
         return [d['user'] for d in res_data]
 
     except Exception as e:
@@ -69,20 +70,13 @@ def send_notification(subject_text, body_text):
         sys.stderr.write("Unable to substitute '{0}' in the notification subject or body".format(e))
         return None
     # Send the notification through Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'notify',
-               'notifier_id': NOTIFIER_ID,
+    payload = {'notifier_id': NOTIFIER_ID,
                'subject': subject,
                'body': body}
 
     try:
-        r = requests.post(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        if response['response']['result'] == 'success':
-            sys.stdout.write("Successfully sent Tautulli notification.")
-        else:
-            raise Exception(response['response']['message'])
+        tautulli.api_call('notify', payload, method='POST')
+        sys.stdout.write("Successfully sent Tautulli notification.")
     except Exception as e:
         sys.stderr.write("Tautulli API 'notify' request failed: {0}.".format(e))
         return None
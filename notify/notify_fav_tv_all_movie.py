@@ -15,13 +15,17 @@ Tautulli > Settings > Notification Agents > Scripts > Gear icon:
         Recently Added: notify_fav_tv_all_movie.py
 """
 
-import requests
+import os
 from email.mime.text import MIMEText
 import email.utils
 import smtplib
 import sys
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+from jbops.history import HistoryStore
+
 ## EDIT THESE SETTINGS ##
 TAUTULLI_APIKEY = 'XXXXXXX'  # Your Tautulli API key
 TAUTULLI_URL = 'http://localhost:8181/'  # Your Tautulli URL
@@ -74,6 +78,10 @@ TV_BODY = """\
 
 user_dict = {}
 
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+history_db = HistoryStore(tautulli)
+
+
 class Users(object):
     def __init__(self, data=None):
         d = data or {}
@@ -95,14 +103,10 @@ class UserHIS(object):
 
 def get_user(user_id):
     # Get the user list from Tautulli.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_user',
-               'user_id': int(user_id)}
+    payload = {'user_id': int(user_id)}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']
+        res_data = tautulli.api_call('get_user', payload)
         return Users(data=res_data)
 
     except Exception as e:
@@ -110,13 +114,8 @@ def get_user(user_id):
 
 def get_users():
     # Get the user list from Tautulli.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_users'}
-
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']
+        res_data = tautulli.api_call('get_users')
         return res_data
 
     except Exception as e:
@@ -124,22 +123,16 @@ def get_users():
 
 
 def get_history(showkey):
-    # Get the user history from Tautulli. Length matters!
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_history',
-               'grandparent_rating_key': int(showkey),
-               'length': 10000}
-
+    # Get the show's watched history from the local history store.
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']['data']
-        return [UserHIS(data=d) for d in res_data if d['watched_status'] == 1
-                and d['media_type'].lower() in ('episode', 'show')]
-
+        history_db.sync()
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_history' request failed: {0}.".format(e))
 
+    res_data = history_db.plays(grandparent_rating_key=int(showkey), watched=True,
+                                media_type=['episode', 'show'])
+    return [UserHIS(data=d) for d in res_data]
+
 
 def add_to_dictlist(d, key, val):
     if key not in d:
@@ -156,7 +149,7 @@ def get_email(show):
 
     for key, value in user_dict.items():
         user_dict[key] = {x: value.count(x) for x in value}
-        # Count how many times user watched show. History length matters!
+        # Count how many times user watched show.
         # {user_id1: {grand_key: 2}, user_id2: {grand_key: 1}
 
     email_lst = []
@@ -15,10 +15,14 @@ Arguments passed from Tautulli
 
 
 """
+import os
 import argparse
-import requests
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+from jbops.geoip import GeoCache
+
 ## EDIT THESE SETTINGS ##
 TAUTULLI_APIKEY = ''  # Your Tautulli API key
 TAUTULLI_URL = 'http://localhost:8181/'  # Your Tautulli URL
@@ -52,6 +56,10 @@ BODY_TEXT = """\
 """
 
 
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+geo_cache = GeoCache(tautulli)
+
+
 class GeoData(object):
     def __init__(self, data=None):
         data = data or {}
@@ -70,77 +78,46 @@ class UserEmail(object):
 
 def get_user_ip_addresses(user_id='', ip_address=''):
     # Get the user IP list from Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_user_ips',
-               'user_id': user_id,
+    payload = {'user_id': user_id,
                'search': ip_address}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        if response['response']['result'] == 'success':
-            data = response['response']['data']
-            if data.get('error'):
-                raise Exception(data['error'])
-            else:
-                sys.stdout.write("Successfully retrieved UserIPs data.")
-                if response['response']['data']['recordsFiltered'] == 0:
-                    sys.stdout.write("IP has no history.")
-                    return data
-                else:
-                    sys.stdout.write("IP has history, killing script.")
-                    exit()
+        data = tautulli.api_call('get_user_ips', payload)
+        if data.get('error'):
+            raise Exception(data['error'])
         else:
-            raise Exception(response['response']['message'])
+            sys.stdout.write("Successfully retrieved UserIPs data.")
+            if data['recordsFiltered'] == 0:
+                sys.stdout.write("IP has no history.")
+                return data
+            else:
+                sys.stdout.write("IP has history, killing script.")
+                exit()
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_user_ip_addresses' request failed: {0}.".format(e))
         return
 
 
 def get_geoip_info(ip_address=''):
-    # Get the geo IP lookup from Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_geoip_lookup',
-               'ip_address': ip_address}
-
-    try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        if response['response']['result'] == 'success':
-            data = response['response']['data']
-            if data.get('error'):
-                raise Exception(data['error'])
-            else:
-                sys.stdout.write("Successfully retrieved geolocation data.")
-                return GeoData(data=data)
-        else:
-            raise Exception(response['response']['message'])
-    except Exception as e:
-        sys.stderr.write("Tautulli API 'get_geoip_lookup' request failed: {0}.".format(e))
+    # Get the geo IP lookup from the cache or Tautulli
+    data = geo_cache.lookup(ip_address)
+    if data is None:
         return GeoData()
+    sys.stdout.write("Successfully retrieved geolocation data.")
+    return GeoData(data=data)
 
 
 def get_user_email(user_id=''):
     # Get the user email from Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_user',
-               'user_id': user_id}
+    payload = {'user_id': user_id}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        if response['response']['result'] == 'success':
-            data = response['response']['data']
-            if data.get('error'):
-                raise Exception(data['error'])
-            else:
-                sys.stdout.write("Successfully retrieved user email data.")
-                return UserEmail(data=data)
+        data = tautulli.api_call('get_user', payload)
+        if data.get('error'):
+            raise Exception(data['error'])
         else:
-            raise Exception(response['response']['message'])
+            sys.stdout.write("Successfully retrieved user email data.")
+            return UserEmail(data=data)
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_user' request failed: {0}.".format(e))
         return UserEmail()
@@ -155,20 +132,13 @@ def send_notification(arguments=None, geodata=None, useremail=None):
         sys.stderr.write("Unable to substitute '{0}' in the notification subject or body".format(e))
         return None
     # Send the notification through Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'notify',
-               'notifier_id': NOTIFIER_ID,
+    payload = {'notifier_id': NOTIFIER_ID,
                'subject': subject,
                'body': body}
 
     try:
-        r = requests.post(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        if response['response']['result'] == 'success':
-            sys.stdout.write("Successfully sent Tautulli notification.")
-        else:
-            raise Exception(response['response']['message'])
+        tautulli.api_call('notify', payload, method='POST')
+        sys.stdout.write("Successfully sent Tautulli notification.")
     except Exception as e:
         sys.stderr.write("Tautulli API 'notify' request failed: {0}.".format(e))
         return None
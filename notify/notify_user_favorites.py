@@ -14,13 +14,16 @@ Tautulli > Settings > Notification Agents > Scripts > Gear icon:
         Recently Added: notify_user_favorite.py
 """
 
-import requests
+import os
 from email.mime.text import MIMEText
 import email.utils
 import smtplib
 import sys
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+
 ## EDIT THESE SETTINGS ##
 TAUTULLI_APIKEY = 'XXXXXXX'  # Your Tautulli API key
 TAUTULLI_URL = 'http://localhost:8181/'  # Your Tautulli URL
@@ -38,6 +41,9 @@ email_password = ''  # Your email password
 
 user_dict = {}
 
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+
+
 class Users(object):
     def __init__(self, data=None):
         d = data or {}
@@ -59,14 +65,10 @@ class UserHIS(object):
 
 def get_user(user_id):
     # Get the user list from Tautulli.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_user',
-               'user_id': int(user_id)}
+    payload = {'user_id': int(user_id)}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']
+        res_data = tautulli.api_call('get_user', payload)
         return Users(data=res_data)
 
     except Exception as e:
@@ -75,15 +77,11 @@ def get_user(user_id):
 
 def get_history(showkey):
     # Get the user history from Tautulli. Length matters!
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_history',
-               'grandparent_rating_key': showkey,
+    payload = {'grandparent_rating_key': showkey,
                'length': 10000}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']['data']
+        res_data = tautulli.api_call('get_history', payload)['data']
         return [UserHIS(data=d) for d in res_data if d['watched_status'] == 1
                 and d['media_type'].lower() in ('episode', 'show')]
 
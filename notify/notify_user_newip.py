@@ -6,13 +6,17 @@ Set api_sql = 1 in the config file.
 Restart Tautulli.
 Place in Playback Start
 """
+import os
 import argparse
-import requests
 import sys
 from email.mime.text import MIMEText
 import email.utils
 import smtplib
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+from jbops.geoip import GeoCache
+
 ## -sn {show_name} -ena {episode_name} -ssn {season_num00} -enu {episode_num00} -srv {server_name} -med {media_type} -pos {poster_url} -tt {title} -sum {summary} -lbn {library_name} -ip {ip_address} -us {user} -uid {user_id} -pf {platform} -pl {player} -da {datestamp} -ti {timestamp}
 
 ## EDIT THESE SETTINGS ##
@@ -55,6 +59,10 @@ email_subject = "New IP has been detected using Plex."
 IGNORE_LST = ['123456', '123456'] # User_id
 
 ##Geo Space##
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+geo_cache = GeoCache(tautulli)
+
+
 class GeoData(object):
     def __init__(self, data=None):
         data = data or {}
@@ -73,75 +81,44 @@ class UserEmail(object):
 ##API Space##
 def get_user_ip_addresses(user_id='', ip_address=''):
     # Get the user IP list from Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_user_ips',
-               'user_id': user_id,
+    payload = {'user_id': user_id,
                'search': ip_address}
                
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        if response['response']['result'] == 'success':
-            data = response['response']['data']
-            if data.get('error'):
-                raise Exception(data['error'])
-            else:
-                sys.stdout.write("Successfully retrieved UserIPs data.")
-                if response['response']['data']['recordsFiltered'] == 0:
-                    sys.stdout.write("IP has no history.")
-                    return True
-                else:
-                    sys.stdout.write("IP has history, killing script.")
-                    exit()
+        data = tautulli.api_call('get_user_ips', payload)
+        if data.get('error'):
+            raise Exception(data['error'])
         else:
-            raise Exception(response['response']['message'])
+            sys.stdout.write("Successfully retrieved UserIPs data.")
+            if data['recordsFiltered'] == 0:
+                sys.stdout.write("IP has no history.")
+                return True
+            else:
+                sys.stdout.write("IP has history, killing script.")
+                exit()
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_user_ip_addresses' request failed: {0}.".format(e))
 
 def get_geoip_info(ip_address=''):
-    # Get the geo IP lookup from Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_geoip_lookup',
-               'ip_address': ip_address}
-
-    try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        if response['response']['result'] == 'success':
-            data = response['response']['data']
-            if data.get('error'):
-                raise Exception(data['error'])
-            else:
-                sys.stdout.write("Successfully retrieved geolocation data.")
-                return GeoData(data=data)
-        else:
-            raise Exception(response['response']['message'])
-    except Exception as e:
-        sys.stderr.write("Tautulli API 'get_geoip_lookup' request failed: {0}.".format(e))
+    # Get the geo IP lookup from the cache or Tautulli
+    data = geo_cache.lookup(ip_address)
+    if data is None:
         return GeoData()
+    sys.stdout.write("Successfully retrieved geolocation data.")
+    return GeoData(data=data)
 
 
 def get_user_email(user_id=''):
     # Get the user email from Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_user',
-               'user_id': user_id}
+    payload = {'user_id': user_id}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        if response['response']['result'] == 'success':
-            data = response['response']['data']
-            if data.get('error'):
-                raise Exception(data['error'])
-            else:
-                sys.stdout.write("Successfully retrieved user email data.")
-                return UserEmail(data=data)
+        data = tautulli.api_call('get_user', payload)
+        if data.get('error'):
+            raise Exception(data['error'])
         else:
-            raise Exception(response['response']['message'])
+            sys.stdout.write("Successfully retrieved user email data.")
+            return UserEmail(data=data)
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_user' request failed: {0}.".format(e))
         return UserEmail()
@@ -170,11 +147,9 @@ def send_notification(arguments=None, geodata=None, useremail=None):
 def clr_sql(ip):
 
     try:
-        payload = {'apikey': TAUTULLI_APIKEY,
-                   'cmd': 'sql',
-                   'query': 'DELETE FROM session_history WHERE ip_address = "' + ip + '";'}
+        payload = {'query': 'DELETE FROM session_history WHERE ip_address = "' + ip + '";'}
 
-        requests.post(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
+        tautulli.api_call('sql', payload, method='POST')
 
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_sql' request failed: {0}.".format(e))
@@ -4,9 +4,12 @@
 #       {user} {title}
 #   Add to Playback Resume
 
-import requests
+import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+
 user = sys.argv[1]
 title = sys.argv[2]
 
@@ -28,6 +31,9 @@ BODY_TEXT = """\
 """ %(user, title)
 
 
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+
+
 class UserHIS(object):
     def __init__(self, data=None):
         data = data or {}
@@ -36,16 +42,13 @@ class UserHIS(object):
 		
 def get_history():
     # Get the user IP list from Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_history',
-               'user': user,
+    payload = {'user': user,
                'search': title}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        if response['response']['data']['recordsFiltered'] > 2:
-            res_data = response['response']['data']['data']
+        response = tautulli.api_call('get_history', payload)
+        if response['recordsFiltered'] > 2:
+            res_data = response['data']
             return UserHIS(data=res_data)
 
     except Exception as e:
@@ -61,20 +64,13 @@ def send_notification():
         sys.stderr.write("Unable to substitute '{0}' in the notification subject or body".format(e))
         return None
     # Send the notification through Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'notify',
-               'notifier_id': NOTIFIER_ID,
+    payload = {'notifier_id': NOTIFIER_ID,
                'subject': subject,
                'body': body}
 
     try:
-        r = requests.post(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        if response['response']['result'] == 'success':
-            sys.stdout.write("Successfully sent Tautulli notification.")
-        else:
-            raise Exception(response['response']['message'])
+        tautulli.api_call('notify', payload, method='POST')
+        sys.stdout.write("Successfully sent Tautulli notification.")
     except Exception as e:
         sys.stderr.write("Tautulli API 'notify' request failed: {0}.".format(e))
         return None
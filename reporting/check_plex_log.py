@@ -4,9 +4,12 @@ This is find files that are corrupt or having playback issues.
 I corrupted a file to test.
 '''
 
-import requests
+import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+
 ## EDIT THESE SETTINGS ##
 TAUTULLI_APIKEY = 'XXXXXXXX'  # Your Tautulli API key
 TAUTULLI_URL = 'http://localhost:8181/'  # Your Tautulli URL
@@ -14,6 +17,9 @@ TAUTULLI_URL = 'http://localhost:8181/'  # Your Tautulli URL
 lib_met = []
 err_title = []
 
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+
+
 class PlexLOG(object):
     def __init__(self, data=None):
         self.error_msg = []
@@ -30,13 +36,8 @@ class UserHIS(object):
 
 def get_plex_log():
     # Get the user IP list from Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_plex_log'}
-
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']['data']
+        res_data = tautulli.api_call('get_plex_log')['data']
 
         return PlexLOG(data=res_data)
 
@@ -45,15 +46,10 @@ def get_plex_log():
 
 def get_history(key):
     # Get the user IP list from Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_history',
-               'rating_key': key}
+    payload = {'rating_key': key}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        res_data = response['response']['data']['data']
+        res_data = tautulli.api_call('get_history', payload)['data']
         return UserHIS(data=res_data)
 
     except Exception as e:
@@ -1,5 +1,9 @@
+import os
+import sys
 import psutil
-import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
 
 # Drive letter to check if exists.
 drive = 'F:'
@@ -12,17 +16,13 @@ NOTIFIER_LST = [10, 11] # The Tautulli notifier notifier id found here: https://
 NOTIFY_SUBJECT = 'Tautulli' # The notification subject
 NOTIFY_BODY = 'The Plex disk {0} was not found'.format(drive) # The notification body
 
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+
 disk_check = [True for i in disk if drive in i.mountpoint]
 
 if not disk_check:
     # Send the notification through Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-            'cmd': 'notify',
-            'subject': NOTIFY_SUBJECT,
-            'body': NOTIFY_BODY}
-
     for notifier in NOTIFIER_LST:
-        payload['notifier_id'] = notifier
-        requests.post(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
+        tautulli.notify(notifier, NOTIFY_SUBJECT, NOTIFY_BODY)
 else:
     pass
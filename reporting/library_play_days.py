@@ -22,10 +22,13 @@ Usage:
 
 """
 
-import requests
+import os
 import sys
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+
 ## EDIT THESE SETTINGS ##
 
 TAUTULLI_APIKEY = 'xxxxx'  # Your Tautulli API key
@@ -35,17 +38,13 @@ OUTPUT = 'Library: {section}\nDays: {days}\nPlays: {plays}'
 
 ## CODE BELOW ##
 
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+
+
 def get_library_names():
     # Get a list of new rating keys for the PMS of all of the item's parent/children.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_library_names'}
-
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        # print(json.dumps(response, indent=4, sort_keys=True))
-
-        res_data = response['response']['data']
+        res_data = tautulli.api_call('get_library_names')
         return [d for d in res_data]
 
     except Exception as e:
@@ -54,16 +53,10 @@ def get_library_names():
 
 def get_library_watch_time_stats(section_id):
     # Get a list of new rating keys for the PMS of all of the item's parent/children.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_library_watch_time_stats',
-               'section_id': section_id}
+    payload = {'section_id': section_id}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        # print(json.dumps(response, indent=4, sort_keys=True))
-
-        res_data = response['response']['data']
+        res_data = tautulli.api_call('get_library_watch_time_stats', payload)
         return [d for d in res_data]
 
     except Exception as e:
@@ -15,11 +15,14 @@ Usage:
 
 """
 
-import requests
+import os
 import sys
 import argparse
 import json
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+
 
 
 ## EDIT THESE SETTINGS ##
@@ -31,18 +34,15 @@ OUTPUT = '{section} - Plays: {plays}'
 
 ## CODE BELOW ##
 
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+
+
 def get_libraries_table(sections=None):
     # Get a list of new rating keys for the PMS of all of the item's parent/children.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_libraries_table',
-               'order_column': 'plays'}
+    payload = {'order_column': 'plays'}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        # print(json.dumps(response, indent=4, sort_keys=True))
-
-        res_data = response['response']['data']['data']
+        res_data = tautulli.api_call('get_libraries_table', payload)['data']
         if sections:
             return [d for d in res_data if d['section_name'] in sections]
         else:
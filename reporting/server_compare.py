@@ -7,6 +7,8 @@ Description: Comparing content between two or more Plex servers.
                       items found in server 1, server 2, etc
                       items unique to server 1
                       items missing from server 1
+              Each server's inventory is saved between runs, later runs only
+              fetch the items added or updated since (use --full to rescan).
 Author: Blacktwin
 Requires: requests, plexapi
 
@@ -19,9 +21,16 @@ Requires: requests, plexapi
 import argparse
 import requests
 import json
+import os
 import sys
 from plexapi.server import PlexServer, CONFIG
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.fanout import fan_out
+from jbops.cache import cache_path
+from jbops.jsonstream import write_json
+from jbops.snapshot import SectionSnapshot, SCANNED, UPDATED
+
 TAUTULLI_URL = ''
 TAUTULLI_APIKEY = ''
 TAUTULLI_URL = CONFIG.data['auth'].get('tautulli_baseurl', TAUTULLI_URL)
@@ -35,6 +44,12 @@ PLEX_TOKEN = CONFIG.data['auth'].get('server_token', PLEX_TOKEN)
 # Sections to ignore from comparision.
 IGNORE_LST = ['Library name']
 
+# Old agent names of the GUID sources the new Plex agents use.
+GUID_SOURCES = {'themoviedb': 'tmdb', 'thetvdb': 'tvdb'}
+
+SNAPSHOT_COLUMNS = [('type', 'TEXT'), ('title', 'TEXT'), ('year', 'TEXT'), ('rating', 'REAL'),
+                    ('genres', 'TEXT'), ('guid', 'TEXT'), ('guids', 'TEXT'), ('thumb', 'TEXT')]
+
 sess = requests.Session()
 # Ignore verifying the SSL certificate
 sess.verify = False  # '/path/to/certfile'
@@ -57,7 +72,62 @@ shared_lst = []
 server_lst = []
 
 
-def find_things(server, media_type):
+class ServerSnapshot(SectionSnapshot):
+    def __init__(self, server):
+        """Inventory of one server's libraries saved between runs.
+
+        One SQLite file per server, so the next run only asks Plex for what
+        changed.
+
+        Parameters
+        ----------
+        server: Object
+            plexServerObject
+        """
+        SectionSnapshot.__init__(self, cache_path('server_compare', '{}.sqlite'.format(server.machineIdentifier)),
+                                 'items', SNAPSHOT_COLUMNS)
+
+    def items(self, section_key):
+        """Yield the saved rows of a section."""
+        for row in self.db.execute('SELECT * FROM items WHERE section_key = ?', (section_key,)):
+            row = dict(row)
+            row['genres'] = json.loads(row['genres'])
+            row['guids'] = json.loads(row['guids'])
+            yield row
+
+
+def parse_item(elem):
+    """Snapshot row of an item of a library listing.
+
+    The listing already has the fields the comparison needs, so no item is
+    fetched on its own.
+    """
+    return {'rating_key': int(elem.attrib['ratingKey']),
+            'type': elem.attrib.get('type'),
+            'title': elem.attrib.get('title'),
+            'year': elem.attrib.get('year'),
+            'rating': float(elem.attrib.get('rating') or 0.0),
+            'genres': json.dumps([x.attrib.get('tag') for x in elem.findall('Genre')]),
+            'guid': elem.attrib.get('guid'),
+            'guids': json.dumps([x.attrib.get('id') for x in elem.findall('Guid')]),
+            'thumb': elem.attrib.get('thumb', ''),
+            'updated_at': int(elem.attrib.get('updatedAt') or 0)}
+
+
+def update_section(server, section, snapshot, full=False):
+    """Bring the snapshot of a library up to date."""
+    path = '/library/sections/{}/all?includeGuids=1'.format(section.key)
+    result, saved = snapshot.update(server, str(section.key), path, parse_item, full)
+    if result == SCANNED:
+        print('{}: scanned {} items in {}.'.format(server.friendlyName, saved, section.title))
+    elif result == UPDATED:
+        print('{}: {} new or updated items in {}.'.format(server.friendlyName, saved, section.title))
+    else:
+        print('{}: items were removed from {}, rescanned {} items.'.format(server.friendlyName,
+                                                                         section.title, saved))
+
+
+def find_things(server, media_type, full=False):
     """Get all items based on media type
 
     Parameters
@@ -66,30 +136,50 @@ def find_things(server, media_type):
         plexServerObject
     media_type: list
         ['movie', 'show', ..]
+    full: bool
+        Rescan the libraries instead of updating the saved snapshot.
 
     Returns
     -------
     dictionary
-        {media_type:[plexObject, ..]}
+        {media_type:[item record, ..]}
 
     """
 
     dict_tt = {name: [] for name in media_type}
     print('Finding items from {}.'.format(server.friendlyName))
+    snapshot = ServerSnapshot(server)
     for section in server.library.sections():
         if section.title not in IGNORE_LST and section.type in media_type:
-            for item in server.library.section(section.title).all():
-                dict_tt[section.type].append(server.fetchItem(item.ratingKey))
-
+            update_section(server, section, snapshot, full)
+            for row in snapshot.items(str(section.key)):
+                row['thumb'] = '{}{}?X-Plex-Token={}'.format(server._baseurl, row['thumb'],
+                                                             server._token)
+                row['server'] = server.friendlyName
+                dict_tt[section.type].append(row)
+
+    print('Found {} items on {}.'.format(sum(len(x) for x in dict_tt.values()),
+                                        server.friendlyName))
     return dict_tt
 
 
+def normalize_guid(guid):
+    """Reduce a GUID to source://id so old and new agents compare equal.
+
+    com.plexapp.agents.imdb://tt4302938?lang=en -> imdb://tt4302938
+    """
+    source, _, source_id = guid.partition('://')
+    source = source.split('.')[-1]
+    source = GUID_SOURCES.get(source, source)
+    return '{}://{}'.format(source, source_id.split('?')[0])
+
+
 def get_meta(meta):
-    """Get metadata from Plex item.
+    """Get metadata from an item record.
     Parameters
     ----------
-    meta: Object
-        plexObject
+    meta: dictionary
+        Item record from ServerSnapshot.items
     Returns
     -------
     dictionary
@@ -101,30 +191,100 @@ def get_meta(meta):
         "title": "Title"
         }
     """
-    thumb_url = '{}{}?X-Plex-Token={}'.format(
-        meta._server._baseurl, meta.thumb, meta._server._token)
-    
-    meta_dict = {'title': meta.title,
-                 'rating': meta.rating if
-                                meta.rating != None else 0.0,
-                 'genres': [x.tag for x in meta.genres],
-                 'server': [meta._server.friendlyName],
-                 'thumb': [thumb_url]
+    meta_dict = {'title': meta['title'],
+                 'rating': meta['rating'],
+                 'genres': meta['genres'],
+                 'server': [meta['server']],
+                 'thumb': [meta['thumb']]
                 }
-    if meta.guid:
+    if meta['guid'] and '://' in meta['guid']:
         # guid will return (com.plexapp.agents.imdb://tt4302938?lang=en)
         # Agents will differ between servers.
-        agent = meta.guid
-        source_name = agent.split('://')[0].split('.')[-1]
-        source_id = agent.split('://')[1].split('?')[0]
+        source_name, source_id = normalize_guid(meta['guid']).split('://', 1)
         meta_dict[source_name] = source_id
 
-    if meta.type == 'movie':
+    if meta['type'] == 'movie':
         # For movies with same titles
-        meta_dict['title'] = u'{} ({})'.format(meta.title, meta.year)
+        meta_dict['title'] = u'{} ({})'.format(meta['title'], meta['year'])
     return meta_dict
 
 
+def merge_keys(item, mtype):
+    """Keys that identify the same item on different servers.
+
+    Parameters
+    ----------
+    item: dictionary
+        Item record from ServerSnapshot.items
+    mtype: str
+        'movie', 'show', ..
+
+    Returns
+    -------
+    list
+        The item's normalized GUIDs, when it has any, and its lowercased
+        title (with the year for movies).
+    """
+    keys = []
+    for guid in [item['guid']] + item['guids']:
+        if guid and '://' in guid and not guid.startswith('local://'):
+            keys.append(normalize_guid(guid))
+    if mtype == 'movie':
+        title = u'{} ({})'.format(item['title'], item['year'])
+    else:
+        title = item['title']
+    keys.append(title.strip().lower())
+    return keys
+
+
+class MergeIndex(object):
+    def __init__(self):
+        """Items of one media type from all servers, merged in one pass.
+
+        Every item is looked up by its merge keys in a dict, so adding n items
+        from any number of servers is O(n).
+        """
+        self.records = []
+        self.index = {}
+
+    def add(self, item, mtype):
+        """Add an item, merging it with an item already seen on another server."""
+        keys = merge_keys(item, mtype)
+        meta = None
+        for key in keys:
+            meta = self.index.get(key)
+            if meta is not None:
+                break
+
+        if meta is None:
+            meta = get_meta(item)
+            self.records.append(meta)
+        elif item['server'] not in meta['server']:
+            # Append the duplicate server's name
+            meta['server'].append(item['server'])
+            meta['thumb'].append(item['thumb'])
+
+        for key in keys:
+            self.index.setdefault(key, meta)
+
+    def combined(self):
+        """Yield every merged item."""
+        for meta in self.records:
+            yield meta
+
+    def missing(self, main_server):
+        """Yield the items the main server does not have."""
+        for meta in self.records:
+            if main_server not in meta['server']:
+                yield meta
+
+    def unique(self, main_server):
+        """Yield the items only the main server has."""
+        for meta in self.records:
+            if meta['server'] == [main_server]:
+                yield meta
+
+
 def org_diff(lst_dicts, media_type, main_server):
     """Organizing the items from each server
 
@@ -133,7 +293,7 @@ def org_diff(lst_dicts, media_type, main_server):
     media_type: list
         ['movie', 'show',..]
     lst_dicts: list
-        [{media_type:[plexObject, ..]}, {media_type: [..]}]
+        [{media_type:[item record, ..]}, {media_type: [..]}]
     main_server: str
         'Plex Server Name'
 
@@ -155,63 +315,41 @@ def org_diff(lst_dicts, media_type, main_server):
                     missing: {..}
                     unique: {..}
                     }
+        The missing and unique lists are generators, pass the result to
+        write_json() to save it.
     """
     diff_dict = {}
-    seen = {}
-    dupes = []
-    missing = []
-    unique = []
     # todo-me pull posters from connected servers
 
     for mtype in media_type:
-        meta_lst = []
+        merged = MergeIndex()
         print('...combining {}s'.format(mtype))
         for server_lst in lst_dicts:
             for item in server_lst[mtype]:
-                if mtype == 'movie':
-                    title = u'{} ({})'.format(item.title, item.year)
-                else:
-                    title = item.title
-
-                # Look for duplicate titles
-                if title not in seen:
-                    seen[title] = 1
-                    meta_lst.append(get_meta(item))
-                else:
-                    # Duplicate found
-                    if seen[title] >= 1:
-                        dupes.append([title, item._server.friendlyName])
-                        # Go back through list to find original
-                        for meta in meta_lst:
-                            if meta['title'] == title:
-                                # Append the duplicate server's name
-                                meta['server'].append(item._server.friendlyName)
-                                thumb_url = '{}{}?X-Plex-Token={}'.format(
-                                    item._server._baseurl, item.thumb, item._server._token)
-                                meta['thumb'].append(thumb_url)
-                    seen[title] += 1
+                merged.add(item, mtype)
+
         # Sort item list by Plex rating
         # Duplicates will use originals rating
-        meta_lst = sorted(meta_lst, key=lambda d: d['rating'], reverse=True)
+        meta_lst = sorted(merged.combined(), key=lambda d: d['rating'], reverse=True)
         diff_dict[mtype] = {'combined': {'count': len(meta_lst),
-                                              'list': meta_lst}}
+                                         'list': meta_lst}}
 
+        # Only the counts are computed here. The lists are generators over
+        # meta_lst that write_json() consumes while saving, so the filtered
+        # copies of meta_lst are never built.
         print('...finding {}s missing from {}'.format(
             mtype, main_server))
-        for item in meta_lst:
-            # Main Server name is alone in items server list
-            if main_server not in item['server']:
-                missing.append(item)
-            # Main Server name is absent in items server list
-            elif main_server in item['server'] and len(item['server']) == 1:
-                unique.append(item)
-        diff_dict[mtype].update({'missing': {'count': len(missing),
-                                        'list': missing}})
+        missing = sum(1 for _ in merged.missing(main_server))
+        diff_dict[mtype].update({'missing': {'count': missing,
+                                             'list': (meta for meta in meta_lst
+                                                      if main_server not in meta['server'])}})
 
         print('...finding {}s unique to {}'.format(
             mtype, main_server))
-        diff_dict[mtype].update({'unique': {'count': len(unique),
-                                         'list': unique}})
+        unique = sum(1 for _ in merged.unique(main_server))
+        diff_dict[mtype].update({'unique': {'count': unique,
+                                            'list': (meta for meta in meta_lst
+                                                     if meta['server'] == [main_server])}})
 
     return diff_dict
 
@@ -230,10 +368,12 @@ if __name__ == "__main__":
                         help='Choose media type(s) to compare.'
                              '\nDefault: (%(default)s)'
                              '\nChoices: (%(choices)s)')
+    parser.add_argument('--full', action='store_true',
+                        help='Rescan all libraries instead of only fetching the items\n'
+                             'added or updated since the last run.')
     # todo-me add media_type [x], library_ignore[], media filters (genre, etc.) []
 
     opts = parser.parse_args()
-    combined_lst = []
 
     if len(opts.server) < 2:
         sys.stderr.write("Need more than one server to compare.\n")
@@ -260,12 +400,12 @@ if __name__ == "__main__":
         sys.stderr.write("Need more than one server to compare.\n")
         sys.exit(1)
 
-    combined_lst.append(find_things(main_server, opts.media_type))
-
     servers = [server.friendlyName for server in server_lst]
 
-    for connection in server_lst:
-        combined_lst.append(find_things(connection, opts.media_type))
+    # Scan every server at the same time, the main server stays first.
+    scan_lst = [main_server] + server_lst
+    combined_lst = list(fan_out(lambda server: find_things(server, opts.media_type, opts.full),
+                                scan_lst, workers=len(scan_lst)))
 
     print('Combining findings from {} and {}'.format(
         main_server.friendlyName, ' and '.join(servers)))
@@ -275,4 +415,4 @@ if __name__ == "__main__":
     filename = 'diff_{}_{}_servers.json'.format(opts.server[0],'_'.join(servers))
 
     with open(filename, 'w') as fp:
-        json.dump(main_dict, fp, indent=4, sort_keys=True)
+        write_json(fp, main_dict)
@@ -3,10 +3,14 @@ Use Tautulli to count how many plays per user occurred this week.
 Notify via Tautulli Notification
 """
 
-import requests
+import os
 import sys
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+from jbops.history import HistoryStore
+
 TODAY = int(time.time())
 LASTWEEK = int(TODAY - 7 * 24 * 60 * 60)
 
@@ -17,6 +21,10 @@ SUBJECT_TEXT = "Tautulli Weekly Plays Per User"
 NOTIFIER_ID = 10  # The email notification notifier ID for Tautulli
 
 
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+history_db = HistoryStore(tautulli)
+
+
 class UserHIS(object):
     def __init__(self, data=None):
         d = data or {}
@@ -30,22 +38,15 @@ class UserHIS(object):
         self.date = d['date']
 
 def get_history():
-    # Get the Tautulli history. Count matters!!!
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_history',
-               'length': 100000}
-               
+    # Get last week's watched history from the local history store.
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        res_data = response['response']['data']['data']
-        return [UserHIS(data=d) for d in res_data if d['watched_status'] == 1 and
-                LASTWEEK < d['date'] < TODAY]
-    
+        history_db.sync()
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_history' request failed: {0}.".format(e))
 
+    res_data = history_db.plays(since=LASTWEEK, until=TODAY, watched=True)
+    return [UserHIS(data=d) for d in res_data if LASTWEEK < d['date'] < TODAY]
+
 def send_notification(BODY_TEXT):
     # Format notification text
     try:
@@ -55,20 +56,13 @@ def send_notification(BODY_TEXT):
         sys.stderr.write("Unable to substitute '{0}' in the notification subject or body".format(e))
         return None
     # Send the notification through Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'notify',
-               'notifier_id': NOTIFIER_ID,
+    payload = {'notifier_id': NOTIFIER_ID,
                'subject': subject,
                'body': body}
 
     try:
-        r = requests.post(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        if response['response']['result'] == 'success':
-            sys.stdout.write("Successfully sent Tautulli notification.")
-        else:
-            raise Exception(response['response']['message'])
+        tautulli.api_call('notify', payload, method='POST')
+        sys.stdout.write("Successfully sent Tautulli notification.")
     except Exception as e:
         sys.stderr.write("Tautulli API 'notify' request failed: {0}.".format(e))
         return None
@@ -9,7 +9,7 @@ Tautulli Settings > Extra Settings >  Check - Calculate Total File Sizes [experi
 
 """
 
-import requests
+import os
 import sys
 import time
 import datetime
@@ -17,6 +17,10 @@ import json
 from operator import itemgetter
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+from jbops.history import HistoryStore, start_of_day
+
 
 # EDIT THESE SETTINGS #
 TAUTULLI_APIKEY = 'xxxxx'  # Your Tautulli API key
@@ -72,37 +76,20 @@ BODY_TEXT = """\
 
 # /EDIT THESE SETTINGS #
 
-def get_history(section_id, check_date):
-    # Get the Tautulli history.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_history',
-               'section_id': section_id,
-               'start_date': check_date}
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+history_db = HistoryStore(tautulli)
 
-    try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        # print(json.dumps(response['response']['data'], indent=4, sort_keys=True))
-        res_data = response['response']['data']
-        if res_data['filter_duration'] != '0':
-            return res_data['data']
-        else:
-            pass
 
-    except Exception as e:
-        sys.stderr.write("Tautulli API 'get_history' request failed: {0}.".format(e))
+def get_history(start_date, end_date):
+    # Get the history between two dates (inclusive) from the local history store.
+    return history_db.plays(since=start_of_day(start_date),
+                            until=start_of_day(end_date + datetime.timedelta(days=1)))
 
 
 def get_libraries():
     # Get a list of all libraries on your server.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_libraries'}
-
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        # print(json.dumps(response['response']['data'], indent=4, sort_keys=True))
-        res_data = response['response']['data']
+        res_data = tautulli.api_call('get_libraries')
         return res_data
 
     except Exception as e:
@@ -111,15 +98,10 @@ def get_libraries():
 
 def get_library_media_info(section_id):
     # Get a list of all libraries on your server.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_library_media_info',
-               'section_id': section_id}
+    payload = {'section_id': section_id}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        # print(json.dumps(response['response']['data'], indent=4, sort_keys=True))
-        res_data = response['response']['data']
+        res_data = tautulli.api_call('get_library_media_info', payload)
         return res_data['total_file_size']
 
     except Exception as e:
@@ -135,20 +117,13 @@ def send_notification(body_text):
         sys.stderr.write("Unable to substitute '{0}' in the notification subject or body".format(e))
         return None
     # Send the notification through Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'notify',
-               'notifier_id': NOTIFIER_ID,
+    payload = {'notifier_id': NOTIFIER_ID,
                'subject': subject,
                'body': body}
 
     try:
-        r = requests.post(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        if response['response']['result'] == 'success':
-            sys.stdout.write("Successfully sent Tautulli notification.")
-        else:
-            raise Exception(response['response']['message'])
+        tautulli.api_call('notify', payload, method='POST')
+        sys.stdout.write("Successfully sent Tautulli notification.")
     except Exception as e:
         sys.stderr.write("Tautulli API 'notify' request failed: {0}.".format(e))
         return None
@@ -190,8 +165,7 @@ def get_server_stats(date_ranges):
     sections_stats_lst = []
     user_stats_lst = []
     user_stats_dict = {}
-    user_names_lst = []
-    user_durations_lst =[]
+    day_users_dict = {}
 
     print('Checking library stats.')
     for sections in get_libraries():
@@ -217,22 +191,24 @@ def get_server_stats(date_ranges):
             sections_stats_lst += ['<li>{}: {}</li>'.format(sections['section_name'], section_count)]
 
     print('Checking users stats.')
-    # print(sections_id_lst)
+    try:
+        history_db.sync()
+    except Exception as e:
+        sys.stderr.write("Tautulli API 'get_history' request failed: {0}.".format(e))
+
+    # One query for the whole date range, totals are added up in a single pass.
+    sections_ids = set(int(section_id) for section_id in sections_id_lst)
+    for data in get_history(date_ranges[0], date_ranges[-1]):
+        if data['section_id'] not in sections_ids:
+            continue
+        add_to_dictval(user_stats_dict, data['friendly_name'], data['duration'] or 0)
+        check_date = datetime.date.fromtimestamp(data['started'])
+        day_users_dict.setdefault(check_date, set()).add(data['friendly_name'])
+
     for check_date in date_ranges:
-        for section_id in sections_id_lst:
-            # print(check_date, section_id)
-            history = get_history(section_id, check_date)
-            if history:
-                # print(json.dumps(history, indent=4, sort_keys=True))
-                for data in history:
-                    # print(data)
-                    user_names_lst += [data['friendly_name']]
-                    user_durations_lst += [data['duration']]
-                # print(user_durations_lst, user_names_lst)
-                for user_name, user_totals in zip(user_names_lst, user_durations_lst):
-                    add_to_dictval(user_stats_dict, user_name, user_totals)
-
-        print('{} watched something on {}'.format(' & '.join(set(user_names_lst)), check_date))
+        if check_date in day_users_dict:
+            print('{} watched something on {}'.format(' & '.join(sorted(day_users_dict[check_date])),
+                                                      check_date.strftime("%Y-%m-%d")))
     # print(json.dumps(user_stats_dict, indent=4, sort_keys=True))
     for user, duration in sorted(user_stats_dict.items(), key=itemgetter(1), reverse=True):
         if user not in USER_IGNORE:
@@ -257,7 +233,7 @@ def main():
     parser = argparse.ArgumentParser(description="Use Tautulli to pull library and user statistics for date range.",
                                      formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('-d', '--days', default=7, metavar='', type=int,
-                        help='Enter in number of days to go back. \n(default: %(default)s)')
+                        help='Enter in number of days to go back, ex. 365 for a yearly report. \n(default: %(default)s)')
 
     opts = parser.parse_args()
 
@@ -270,9 +246,7 @@ def main():
     start_date = datetime.date(date_split(START_DATE)[0], date_split(START_DATE)[1], date_split(START_DATE)[2])
     end_date = datetime.date(date_split(END_DATE)[0], date_split(END_DATE)[1], date_split(END_DATE)[2])
 
-    dates_range_lst = []
-    for single_date in daterange(start_date, end_date):
-        dates_range_lst += [single_date.strftime("%Y-%m-%d")]
+    dates_range_lst = list(daterange(start_date, end_date))
 
     print('Checking user stats from {:02d} days ago.'.format(opts.days))
 
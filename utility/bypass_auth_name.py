@@ -15,10 +15,14 @@ optional arguments:
 List of IP addresses is cleared before adding new IPs
 '''
 
+import os
 import requests
 import argparse
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+
 
 ## EDIT THESE SETTINGS ##
 PLEX_TOKEN = 'xxxx'
@@ -27,18 +31,16 @@ TAUTULLI_APIKEY = 'xxxx'  # Your Tautulli API key
 TAUTULLI_URL = 'http://localhost:8181/'  # Your Tautulli URL
 
 
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+
+
 def get_history(user_id):
     # Get the user history from Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_history',
-               'user_id': user_id,
+    payload = {'user_id': user_id,
                'length': 1}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        res_data = response['response']['data']['data']
+        res_data = tautulli.api_call('get_history', payload)['data']
         return [d['ip_address'] for d in res_data]
 
     except Exception as e:
@@ -47,13 +49,8 @@ def get_history(user_id):
 
 def get_user_names(username):
     # Get the user names from Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_user_names'}
-
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']
+        res_data = tautulli.api_call('get_user_names')
         if username:
             return [d['user_id'] for d in res_data if d['friendly_name'] in username]
         else:
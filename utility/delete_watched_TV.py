@@ -5,16 +5,25 @@ If all users in list have watched an episode of listed show, then delete episode
 Add deletion via Plex.
 """
 
-import requests
 import sys
 import os
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+from jbops.fanout import fan_out
+from jbops.history import HistoryStore
+
 
 ## EDIT THESE SETTINGS ##
 TAUTULLI_APIKEY = 'xxxxx'  # Your Tautulli API key
 TAUTULLI_URL = 'http://localhost:8181/'  # Your Tautulli URL
 SHOW_LST = [123456, 123456, 123456, 123456]  # Show rating keys.
 USER_LST = ['Sam', 'Jakie', 'Blacktwin']  # Name of users
+WORKERS = 8  # Number of get_metadata calls to run at the same time.
+
+
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY, pool_maxsize=WORKERS)
+history_db = HistoryStore(tautulli)
 
 
 class METAINFO(object):
@@ -30,16 +39,11 @@ class METAINFO(object):
 
 def get_metadata(rating_key):
     # Get the metadata for a media item.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'rating_key': rating_key,
-               'cmd': 'get_metadata',
+    payload = {'rating_key': rating_key,
                'media_info': True}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        res_data = response['response']['data']
+        res_data = tautulli.api_call('get_metadata', payload)
         return METAINFO(data=res_data)
 
     except Exception as e:
@@ -47,69 +51,24 @@ def get_metadata(rating_key):
         pass
 
 
-def get_history(user, show, start, length):
-    # Get the Tautulli history.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_history',
-               'user': user,
-               'grandparent_rating_key': show,
-               'start': start,
-               'length': length}
+def get_watched_by_all():
+    # Rating keys of the episodes of the listed shows every listed user watched.
+    return history_db.watched_by_all(USER_LST, grandparent_rating_key=SHOW_LST)
 
-    try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
 
-        res_data = response['response']['data']['data']
-        return [d['rating_key'] for d in res_data if d['watched_status'] == 1]
+try:
+    history_db.sync()
+except Exception as e:
+    # Never delete files based on a local history that may be out of date.
+    sys.stderr.write("Tautulli API 'get_history' request failed: {0}.\n".format(e))
+    sys.exit(1)
 
-    except Exception as e:
-        sys.stderr.write("Tautulli API 'get_history' request failed: {0}.".format(e))
-
-
-meta_dict = {}
-meta_lst = []
-delete_lst = []
-
-count = 25
-for user in USER_LST:
-    for show in SHOW_LST:
-        start = 0
-        while True:
-            # Getting all watched history for listed users and shows
-            history = get_history(user, show, start, count)
-            try:
-                if all([history]):
-                    start += count
-                    for rating_key in history:
-                        # Getting metadata of what was watched
-                        meta = get_metadata(rating_key)
-                        if not any(d['title'] == meta.title for d in meta_lst):
-                            meta_dict = {
-                                'title': meta.title,
-                                'file': meta.file,
-                                'type': meta.media_type,
-                                'grandparent_title': meta.grandparent_title,
-                                'watched_by': [user]
-                            }
-                            meta_lst.append(meta_dict)
-                        else:
-                            for d in meta_lst:
-                                if d['title'] == meta.title:
-                                    d['watched_by'].append(user)
-                    continue
-                elif not all([history]):
-                    break
-
-                start += count
-            except Exception as e:
-                print(e)
-                pass
-
-
-for meta_dict in meta_lst:
-    print("{} {} has been watched by {}".format(meta_dict['grandparent_title'].encode('UTF-8'),
-                                                meta_dict['title'].encode('UTF-8'),
-                                                 " & ".join(USER_LST)))
-    print("Removing {}".format(meta_dict['file']))
-    os.remove(meta_dict['file'])
+# Getting metadata only of what everyone watched
+for meta in fan_out(get_metadata, sorted(get_watched_by_all()), workers=WORKERS):
+    if not meta:
+        continue
+    print("{} {} has been watched by {}".format(meta.grandparent_title.encode('UTF-8'),
+                                                meta.title.encode('UTF-8'),
+                                                " & ".join(USER_LST)))
+    print("Removing {}".format(meta.file))
+    os.remove(meta.file)
@@ -4,11 +4,14 @@ Find what was added TFRAME ago and not watched using Tautulli.
 
 """
 
-import requests
 import sys
 import time
 import os
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+from jbops.library import iter_library, with_files
+
 TFRAME = 1.577e+7 # ~ 6 months in seconds
 TODAY = time.time()
 
@@ -17,102 +20,21 @@ TODAY = time.time()
 TAUTULLI_APIKEY = 'XXXXXX'  # Your Tautulli API key
 TAUTULLI_URL = 'http://localhost:8181/'  # Your Tautulli URL
 LIBRARY_NAMES = ['My TV Shows', 'My Movies'] # Name of libraries you want to check.
+WORKERS = 8 # Number of Tautulli calls to run at the same time.
 
 
-class LIBINFO(object):
-    def __init__(self, data=None):
-        d = data or {}
-        self.added_at = d['added_at']
-        self.parent_rating_key = d['parent_rating_key']
-        self.play_count = d['play_count']
-        self.title = d['title']
-        self.rating_key = d['rating_key']
-        self.media_type = d['media_type']
-
-
-class METAINFO(object):
-    def __init__(self, data=None):
-        d = data or {}
-        self.added_at = d['added_at']
-        self.parent_rating_key = d['parent_rating_key']
-        self.title = d['title']
-        self.rating_key = d['rating_key']
-        self.media_type = d['media_type']
-        self.grandparent_title = d['grandparent_title']
-        media_info = d['media_info'][0]
-        parts = media_info['parts'][0]
-        self.file_size = parts['file_size']
-        self.file = parts['file']
-
-
-def get_new_rating_keys(rating_key, media_type):
-    # Get a list of new rating keys for the PMS of all of the item's parent/children.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_new_rating_keys',
-               'rating_key': rating_key,
-               'media_type': media_type}
-
-    try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        res_data = response['response']['data']
-        show = res_data['0']
-        episode_lst = [episode['rating_key'] for _, season in show['children'].items() for _, episode in
-                       season['children'].items()]
-
-        return episode_lst
-
-    except Exception as e:
-        sys.stderr.write("Tautulli API 'get_new_rating_keys' request failed: {0}.".format(e))
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY, pool_maxsize=WORKERS)
 
 
-def get_metadata(rating_key):
-    # Get the metadata for a media item.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'rating_key': rating_key,
-               'cmd': 'get_metadata',
-               'media_info': True}
-
-    try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        res_data = response['response']['data']
-        return METAINFO(data=res_data)
-
-    except Exception as e:
-        # sys.stderr.write("Tautulli API 'get_metadata' request failed: {0}.".format(e))
-        pass
-
+def unwatched(row):
+    # Never played and added more than TFRAME ago.
+    return row['play_count'] is None and (TODAY - int(row['added_at'])) > TFRAME
 
-def get_library_media_info(section_id):
-    # Get the data on the Tautulli media info tables.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'section_id': section_id,
-               'cmd': 'get_library_media_info',
-               'length': 10000}
-
-    try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        res_data = response['response']['data']['data']
-        return [LIBINFO(data=d) for d in res_data if d['play_count'] is None and (TODAY - int(d['added_at'])) > TFRAME]
-
-    except Exception as e:
-        sys.stderr.write("Tautulli API 'get_library_media_info' request failed: {0}.".format(e))
 
 def get_libraries_table():
     # Get the data on the Tautulli libraries table.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_libraries_table'}
-
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        res_data = response['response']['data']['data']
+        res_data = tautulli.api_call('get_libraries_table')['data']
         return [d['section_id'] for d in res_data if d['section_name'] in LIBRARY_NAMES]
 
     except Exception as e:
@@ -127,45 +49,32 @@ def delete_files(tmp_lst):
     else:
         print('Ok. doing nothing.')
 
-show_lst = []
+records = []
 path_lst = []
 
 glt = [lib for lib in get_libraries_table()]
 
 for i in glt:
     try:
-        gglm = get_library_media_info(i)
-        for x in gglm:
-            try:
-                if x.media_type in ['show', 'episode']:
-                    # Need to find TV shows rating_key for episode.
-                    show_lst += get_new_rating_keys(x.rating_key, x.media_type)
-                else:
-                    # Find movie rating_key.
-                    show_lst += [int(x.rating_key)]
-            except Exception as e:
-                print("Rating_key failed: {e}").format(e=e)
-
+        # Movies and the episodes of unwatched shows, shows are expanded concurrently.
+        records += iter_library(tautulli, i, include=unwatched, workers=WORKERS)
     except Exception as e:
-        print("Library media info failed: {e}").format(e=e)
+        print("Library media info failed: {e}".format(e=e))
 
 # Remove reverse sort if you want the oldest keys first.
-for i in sorted(show_lst, reverse=True):
-    try:
-        x = get_metadata(str(i))
-        added = time.ctime(float(x.added_at))
-        if x.grandparent_title == '' or x.media_type == 'movie':
-            # Movies
-            print(u"{x.title} ({x.rating_key}) was added {when} and has not been"
-                  u"watched. \n File location: {x.file}".format(x=x, when=added))
-        else:
-            # Shows
-            print(u"{x.grandparent_title}: {x.title} ({x.rating_key}) was added {when} and has"
-                  u"not been watched. \n File location: {x.file}".format(x=x, when=added))
-        path_lst += [x.file]
-
-    except Exception as e:
-        print("Metadata failed. Likely end of range: {e}").format(e=e)
+records.sort(key=lambda x: x.rating_key, reverse=True)
+# Only the file locations need get_metadata.
+for x in with_files(tautulli, records, workers=WORKERS):
+    added = time.ctime(float(x.added_at))
+    if x.grandparent_title == '' or x.media_type == 'movie':
+        # Movies
+        print(u"{x.title} ({x.rating_key}) was added {when} and has not been"
+              u"watched. \n File location: {x.file}".format(x=x, when=added))
+    else:
+        # Shows
+        print(u"{x.grandparent_title}: {x.title} ({x.rating_key}) was added {when} and has"
+              u"not been watched. \n File location: {x.file}".format(x=x, when=added))
+    path_lst += [x.file]
 
 
 delete_files(path_lst)
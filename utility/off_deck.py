@@ -43,11 +43,16 @@ original.
 
 """
 
+import os
+import sys
 import requests
 import argparse
 import datetime
 from plexapi.server import PlexServer, CONFIG
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.plexusers import UserTokens
+
 PLEX_URL = ''
 PLEX_TOKEN = ''
 
@@ -173,8 +178,7 @@ if __name__ == '__main__':
     to_remove = ''
 
     if opts.user:
-        user_acct = account.user(opts.user)
-        plex_server = PlexServer(PLEX_URL, user_acct.get_token(plex.machineIdentifier))
+        plex_server = UserTokens(account, plex).connect(opts.user)
     else:
         plex_server = plex
 
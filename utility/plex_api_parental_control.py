@@ -36,11 +36,16 @@ Usage:
 '''
 
 
+import os
+import sys
 import argparse
 import requests
 from time import sleep
 from plexapi.server import PlexServer, CONFIG
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.choices import CachedChoices
+
 MESSAGE = "GET TO BED!"
 
 PLEX_URL = ''
@@ -60,10 +65,21 @@ if sess.verify is False:
 
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-plex = PlexServer(PLEX_URL, PLEX_TOKEN, session=sess)
+plex = None
+
+
+def plex_server():
+    # Connect to Plex the first time it is needed, not at import.
+    global plex
+    if plex is None:
+        plex = PlexServer(PLEX_URL, PLEX_TOKEN, session=sess)
+    return plex
+
 
-user_lst = [x.title for x in plex.myPlexAccount().users()]
-sections_lst = [x.title for x in plex.library.sections()]
+user_choices = CachedChoices('plex_users', lambda: [x.title for x in plex_server().myPlexAccount().users()
+                                                    if x.title], key=PLEX_URL)
+section_choices = CachedChoices('plex_sections', lambda: [x.title for x in plex_server().library.sections()],
+                                key=PLEX_URL)
 
 
 def share(user, libraries):
@@ -93,14 +109,17 @@ if __name__ == "__main__":
     parser.add_argument('-s', '--share', nargs='?', type=str, required=True,
                         choices=['share', 'share_all', 'unshare'], metavar='',
                         help='To share or to unshare.: \n (choices: %(choices)s)')
-    parser.add_argument('-u', '--user', nargs='?', type=str, required=True, choices=user_lst, metavar='',
+    parser.add_argument('-u', '--user', nargs='?', type=str, required=True, choices=user_choices, metavar='',
                         help='Space separated list of case sensitive names to process. Allowed names are: \n'
                              '(choices: %(choices)s)')
-    parser.add_argument('-l', '--libraries', nargs='+', default='', choices=sections_lst, metavar='',
+    parser.add_argument('-l', '--libraries', nargs='+', default='', choices=section_choices, metavar='',
                         help='Space separated list of case sensitive names to process. Allowed names are: \n'
                              '(choices: %(choices)s \n(default: All Libraries)')
 
     opts = parser.parse_args()
+    plex_server()
+    # The choices may be a day old, act on what Plex has now.
+    sections_lst = [x.title for x in plex.library.sections()]
 
     if opts.share == 'share':
         share(opts.user, opts.libraries)
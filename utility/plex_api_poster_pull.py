@@ -2,20 +2,29 @@
 """
 Description: Pull Movie and TV Show poster images from Plex.  Save to Movie and TV Show directories in scripts working directory.
 Author: Blacktwin
-Requires: plexapi
+Requires: plexapi, requests, futures (Python 2 only)
 
  Example:
     python plex_api_poster_pull.py
 
+Posters are downloaded WORKERS at a time. Posters already saved are only
+downloaded again when they changed in Plex, an interrupted run skips what it
+already finished. Images that exist but were not saved by this script are
+left alone.
+
 """
 
 from plexapi.server import PlexServer, CONFIG
 import requests
 import re
 import os
-import urllib
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.download import Downloader, DOWNLOADED, UNCHANGED, EXISTS, FAILED
 
 library_name = ['Movies','TV Shows'] # You library names
+WORKERS = 8  # Number of posters downloaded at the same time.
 
 PLEX_URL = ''
 PLEX_TOKEN = ''
@@ -46,23 +55,28 @@ if not os.path.isdir(show_path):
     os.mkdir(show_path)
 
 
-# Get all movies or shows from LIBRARY_NAME
-for library in library_name:
-    for child in plex.library.section(library).all():
-        # Clean names of special characters
-        name = re.sub('\W+',' ', child.title)
-        # Add (year) to name
-        name = '{} ({})'.format(name, child.year)
-        # Pull URL for poster
-        thumb_url = '{}{}?X-Plex-Token={}'.format(PLEX_URL, child.thumb, PLEX_TOKEN)
-        # Select path based on media_type
-        if child.type == 'movie':
-            image_path = u'{}/{}.jpg'.format(movie_path, name)
-        elif child.type == 'show':
-            image_path = u'{}/{}.jpg'.format(show_path, name)
-        # Check if file already exists
-        if os.path.isfile(image_path):
-            print("ERROR, %s already exist" % image_path)
-        else:
-            # Save to directory
-            urllib.urlretrieve(thumb_url, image_path)
+def poster_jobs():
+    # (url, path) of the poster of every movie or show in library_name.
+    folders = {'movie': movie_path, 'show': show_path}
+    for library in library_name:
+        for child in plex.library.section(library).all():
+            if not child.thumb or child.type not in folders:
+                continue
+            # Clean names of special characters
+            name = re.sub(r'\W+', ' ', child.title)
+            # Add (year) to name
+            name = '{} ({})'.format(name, child.year)
+            # Pull URL for poster
+            thumb_url = '{}{}?X-Plex-Token={}'.format(PLEX_URL, child.thumb, PLEX_TOKEN)
+            yield thumb_url, u'{}/{}.jpg'.format(folders[child.type], name)
+
+
+counts = {DOWNLOADED: 0, UNCHANGED: 0, EXISTS: 0, FAILED: 0}
+downloader = Downloader('plex_posters', session=sess, workers=WORKERS)
+for url, image_path, status in downloader.download(poster_jobs(), keep_existing=True):
+    if status == EXISTS:
+        print("ERROR, %s already exist" % image_path)
+    counts[status] += 1
+
+print('{} downloaded, {} unchanged, {} already existed, {} failed.'.format(
+    counts[DOWNLOADED], counts[UNCHANGED], counts[EXISTS], counts[FAILED]))
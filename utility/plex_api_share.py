@@ -21,6 +21,8 @@ optional arguments:
   --restore             Restore share settings from json file
                         Filename of json file to use.
                         (choices: %(json files found in cwd)s)
+  --workers             Number of users restored at the same time (default: 4)
+  --rate                Most share updates started per second during a restore (default: 2)
 
   # Plex Pass member only settings:
   --kill                Kill user's current stream(s). Include message to override default message
@@ -99,8 +101,15 @@ import time
 import argparse
 import requests
 import os
+import sys
 import json
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.cache import cache_path
+from jbops.choices import CachedChoices, cached_value
+from jbops.jsonstream import write_json, iter_json_array
+from jbops.fanout import fan_out, RateLimit
+
 PLEX_URL = ''
 PLEX_TOKEN = ''
 
@@ -112,6 +121,11 @@ if not PLEX_TOKEN:
 
 DEFAULT_MESSAGE = "Stream is being killed by admin."
 
+# Concurrent share updates during --restore and the most started per second.
+# plex.tv answers bursts with 429s.
+SHARE_WORKERS = 4
+SHARE_RATE = 2
+
 sess = requests.Session()
 # Ignore verifying the SSL certificate
 sess.verify = False  # '/path/to/certfile'
@@ -124,22 +138,78 @@ if sess.verify is False:
 
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-plex = PlexServer(PLEX_URL, PLEX_TOKEN, session=sess)
+plex = None
+account = None
+
+
+def plex_server():
+    # Connect to Plex the first time it is needed, not at import.
+    global plex
+    if plex is None:
+        plex = PlexServer(PLEX_URL, PLEX_TOKEN, session=sess)
+    return plex
 
-user_lst = [x.title for x in plex.myPlexAccount().users() if x.title]
-sections_lst = [x.title for x in plex.library.sections()]
-movies_keys = [x.key for x in plex.library.sections() if x.type == 'movie']
-show_keys = [x.key for x in plex.library.sections() if x.type == 'show']
 
-json_check = sorted([f for f in os.listdir('.') if os.path.isfile(f) and
-                     f.endswith(".json") and f.startswith(plex.friendlyName)],
-                    key=os.path.getmtime)
+def plex_account():
+    # Every myPlexAccount() is a plex.tv round trip, fetch it once.
+    global account
+    if account is None:
+        account = plex_server().myPlexAccount()
+    return account
 
-my_server_names = []
-# Find all owners server names. For owners with multiple servers.
-for res in plex.myPlexAccount().resources():
-    if res.provides == 'server' and res.owned == True:
-        my_server_names.append(res.name)
+
+def ratings_catalog():
+    """Content ratings of every movie and show library, cached on disk per section.
+
+    A section is only asked for its ratings again after Plex updated it
+    (its updatedAt changed), so a refresh costs one sections listing plus one
+    request per library that changed since the last one.
+
+    Returns
+    -------
+    dict
+        {section key: {'type': str, 'updatedAt': str, 'ratings': [..]}}
+    """
+    path = cache_path('ratings', '{}.json'.format(plex_server().machineIdentifier))
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (IOError, OSError, ValueError):
+        cached = {}
+
+    catalog = {}
+    for section in plex.library.sections():
+        if section.type not in ('movie', 'show'):
+            continue
+        key = str(section.key)
+        updated = str(section.updatedAt)
+        entry = cached.get(key)
+        if not entry or entry['updatedAt'] != updated:
+            entry = {'type': section.type, 'updatedAt': updated, 'ratings': get_ratings_lst(section.key)}
+        catalog[key] = entry
+
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(catalog, f)
+    os.rename(tmp, path)
+    return catalog
+
+
+def get_ratings(section_type):
+    # All content ratings used in the libraries of <section_type>.
+    ratings = set()
+    for entry in ratings_catalog().values():
+        if entry['type'] == section_type:
+            ratings.update(entry['ratings'])
+    return sorted(ratings)
+
+
+user_choices = CachedChoices('plex_users', lambda: [x.title for x in plex_account().users()
+                                                    if x.title], key=PLEX_URL)
+section_choices = CachedChoices('plex_sections', lambda: [x.title for x in plex_server().library.sections()],
+                                key=PLEX_URL)
+movie_rating_choices = CachedChoices('plex_movie_ratings', lambda: get_ratings('movie'), key=PLEX_URL)
+show_rating_choices = CachedChoices('plex_show_ratings', lambda: get_ratings('show'), key=PLEX_URL)
 
 
 def get_ratings_lst(section_id):
@@ -166,11 +236,8 @@ def filter_clean(filter_type):
     return clean
 
 
-def find_shares(user):
-    account = plex.myPlexAccount()
-    user_acct = account.user(user)
-
-    user_backup = {
+def user_backup(user_acct, sections):
+    return {
         'title': user_acct.title,
         'username': user_acct.username,
         'email': user_acct.email,
@@ -182,17 +249,97 @@ def find_shares(user):
         'filterTelevision': filter_clean(user_acct.filterTelevision),
         'filterMusic': filter_clean(user_acct.filterMusic),
         'serverName': plex.friendlyName,
-        'sections': ""}
+        'sections': sections}
+
+
+def find_shares(user):
+    user_acct = plex_account().user(user)
 
+    sections = ""
     for server in user_acct.servers:
         if server.name == plex.friendlyName:
             sections = []
             for section in server.sections():
                 if section.shared == True:
                     sections.append(section.title)
-            user_backup['sections'] = sections
 
-    return user_backup
+    return user_backup(user_acct, sections)
+
+
+def shared_sections():
+    """Shared library titles of every user from one plex.tv request.
+
+    Returns
+    -------
+    dict
+        {userID: [section title, ..]} for the users this server is shared with.
+    """
+    url = 'https://plex.tv/api/servers/{}/shared_servers'.format(plex.machineIdentifier)
+    shares = {}
+    for server in plex_account().query(url).findall('SharedServer'):
+        shares[int(server.attrib['userID'])] = [section.attrib['title'] for section in server.findall('Section')
+                                                if section.attrib.get('shared') == '1']
+    return shares
+
+
+def find_all_shares(users):
+    """Same as find_shares for many users, with one users and one shares listing.
+
+    Parameters
+    ----------
+    users : list
+        User titles.
+
+    Yields
+    ------
+    dict
+        The share settings of each user that is still a friend.
+    """
+    user_accts = dict((x.title, x) for x in plex_account().users())
+    shares = shared_sections()
+    for user in users:
+        user_acct = user_accts.get(user)
+        if user_acct is None:
+            sys.stderr.write("{} is not a friend of this account, skipping.\n".format(user))
+            continue
+        yield user_backup(user_acct, shares.get(user_acct.id, ""))
+
+
+def restore_shares(backups, workers=SHARE_WORKERS, rate=SHARE_RATE):
+    """Apply share backups with a pool of workers.
+
+    Parameters
+    ----------
+    backups : iterable
+        Share settings as written by --backup.
+    workers : int
+        Number of concurrent updates.
+    rate : float
+        Most updates started per second.
+
+    Yields
+    ------
+    tuple
+        (backup, error) for each user as its update finishes, error is None
+        when the update succeeded.
+    """
+    user_accts = dict((x.title, x) for x in plex_account().users())
+    limit = RateLimit(rate)
+
+    def restore(backup):
+        user_acct = user_accts.get(backup['title'])
+        if user_acct is None:
+            return backup, 'not a friend of this account'
+        limit.wait()
+        try:
+            update_share(user_acct, backup['sections'], backup['allowSync'], backup['camera'],
+                         backup['channels'], backup['filterMovies'], backup['filterTelevision'],
+                         backup['filterMusic'])
+        except Exception as e:
+            return backup, e
+        return backup, None
+
+    return fan_out(restore, backups, workers=workers, ordered=False)
 
 
 def kill_session(user, message):
@@ -208,10 +355,18 @@ def kill_session(user, message):
             session.stop(reason=reason)
 
 
+def update_share(user, sections, allowSync, camera, channels, filterMovies, filterTelevision, filterMusic):
+    plex_account().updateFriend(user=user, server=plex, sections=sections, allowSync=allowSync,
+                                allowCameraUpload=camera, allowChannels=channels, filterMovies=filterMovies,
+                                filterTelevision=filterTelevision, filterMusic=filterMusic)
+
+
 def share(user, sections, allowSync, camera, channels, filterMovies, filterTelevision, filterMusic):
-    plex.myPlexAccount().updateFriend(user=user, server=plex, sections=sections, allowSync=allowSync,
-                                      allowCameraUpload=camera, allowChannels=channels, filterMovies=filterMovies,
-                                      filterTelevision=filterTelevision, filterMusic=filterMusic)
+    update_share(user, sections, allowSync, camera, channels, filterMovies, filterTelevision, filterMusic)
+    print_share(user, sections, allowSync, camera, channels, filterMovies, filterTelevision, filterMusic)
+
+
+def print_share(user, sections, allowSync, camera, channels, filterMovies, filterTelevision, filterMusic):
     if sections:
         print('{user}\'s updated shared libraries: \n{sections}'.format(sections=sections, user=user))
     if allowSync == True:
@@ -241,7 +396,7 @@ def share(user, sections, allowSync, camera, channels, filterMovies, filterTelev
 
 
 def unshare(user, sections):
-    plex.myPlexAccount().updateFriend(user=user, server=plex, removeSections=True, sections=sections)
+    plex_account().updateFriend(user=user, server=plex, removeSections=True, sections=sections)
     print('Unshared all libraries from {user}.'.format(user=user))
 
 
@@ -249,6 +404,11 @@ if __name__ == "__main__":
 
     timestr = time.strftime("%Y%m%d-%H%M%S")
 
+    server_name = cached_value('plex_server_name', lambda: plex_server().friendlyName, key=PLEX_URL)
+    json_check = sorted([f for f in os.listdir('.') if os.path.isfile(f) and
+                         f.endswith(".json") and f.startswith(server_name)],
+                        key=os.path.getmtime)
+
     parser = argparse.ArgumentParser(description="Share or unshare libraries.",
                                      formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('--share', default=False, action='store_true',
@@ -261,12 +421,18 @@ if __name__ == "__main__":
                         help='Share additional libraries or enable settings to user..')
     parser.add_argument('--remove', default=False, action='store_true',
                         help='Remove shared libraries or disable settings from user.')
-    parser.add_argument('--user', nargs='+', choices=user_lst, metavar='',
+    parser.add_argument('--user', nargs='+', choices=user_choices, metavar='',
                         help='Space separated list of case sensitive names to process. Allowed names are: \n'
                              '(choices: %(choices)s)')
+    parser.add_argument('--workers', type=int, default=SHARE_WORKERS, metavar='',
+                        help='Number of users restored at the same time.\n'
+                             'Default: %(default)s')
+    parser.add_argument('--rate', type=float, default=SHARE_RATE, metavar='',
+                        help='Most share updates started per second during a restore.\n'
+                             'Default: %(default)s')
     parser.add_argument('--allUsers', default=False, action='store_true',
                         help='Select all users.')
-    parser.add_argument('--libraries', nargs='+', default=False, choices=sections_lst, metavar='',
+    parser.add_argument('--libraries', nargs='+', default=False, choices=section_choices, metavar='',
                         help='Space separated list of case sensitive names to process. Allowed names are: \n'
                              '(choices: %(choices)s')
     parser.add_argument('--allLibraries', default=False, action='store_true',
@@ -279,13 +445,7 @@ if __name__ == "__main__":
                              '(choices: %(choices)s)')
 
     # For Plex Pass members
-    if plex.myPlexSubscription == True:
-        movie_ratings = []
-        show_ratings = []
-        for movie in movies_keys:
-            movie_ratings += get_ratings_lst(movie)
-        for show in show_keys:
-            show_ratings += get_ratings_lst(show)
+    if cached_value('plex_pass', lambda: plex_server().myPlexSubscription, key=PLEX_URL) == True:
         parser.add_argument('--kill', default=None, nargs='?',
                             help='Kill user\'s current stream(s). Include message to override default message.')
         parser.add_argument('--sync', default=None, action='store_true',
@@ -294,13 +454,13 @@ if __name__ == "__main__":
                             help='Use to allow user to upload photos.')
         parser.add_argument('--channels', default=None, action='store_true',
                             help='Use to allow user to utilize installed channels.')
-        parser.add_argument('--movieRatings', nargs='+', choices=list(set(movie_ratings)), metavar='',
+        parser.add_argument('--movieRatings', nargs='+', choices=movie_rating_choices, metavar='',
                             help='Use to add rating restrictions to movie library types.\n'
                                  'Space separated list of case sensitive names to process. Allowed names are: \n'
                                  '(choices: %(choices)s')
         parser.add_argument('--movieLabels', nargs='+', metavar='',
                             help='Use to add label restrictions for movie library types.')
-        parser.add_argument('--tvRatings', nargs='+', choices=list(set(show_ratings)), metavar='',
+        parser.add_argument('--tvRatings', nargs='+', choices=show_rating_choices, metavar='',
                             help='Use to add rating restrictions for show library types.\n'
                                  'Space separated list of case sensitive names to process. Allowed names are: \n'
                                  '(choices: %(choices)s')
@@ -310,6 +470,10 @@ if __name__ == "__main__":
                             help='Use to add label restrictions for music library types.')
 
     opts = parser.parse_args()
+    plex_server()
+    # The choices may be a day old, act on what Plex has now.
+    user_lst = [x.title for x in plex_account().users() if x.title]
+    sections_lst = [x.title for x in plex.library.sections()]
     users = ''
     libraries = ''
 
@@ -371,8 +535,11 @@ if __name__ == "__main__":
             libraries = sections_lst
 
     # Share, Unshare, Kill, Add, or Remove
+    users_shares = dict((x['title'], x) for x in find_all_shares(users)) if users else {}
     for user in users:
-        user_shares = find_shares(user)
+        user_shares = users_shares.get(user)
+        if user_shares is None:
+            continue
         user_shares_lst = user_shares['sections']
         if libraries:
             if opts.share:
@@ -427,31 +594,28 @@ if __name__ == "__main__":
 
     if opts.backup:
         print('Backing up share information...')
-        users_shares = []
         # If user arg is defined then abide, else backup all
         if not users:
             users = user_lst
-        for user in users:
-            # print('...Found {}'.format(user))
-            users_shares.append(find_shares(user))
         json_file = '{}_Plex_share_backup_{}.json'.format(plex.friendlyName, timestr)
+        # Each user's shares are written as soon as they are found.
         with open(json_file, 'w') as fp:
-            json.dump(users_shares, fp, indent=4, sort_keys=True)
+            write_json(fp, find_all_shares(users))
 
     if opts.restore:
         print('Using existing .json to restore Plex shares.')
         with open(''.join(opts.restore)) as json_data:
-            shares_file = json.load(json_data)
-        for user in shares_file:
             # If user arg is defined then abide, else restore all
-            if users:
-                if user['title'] in users:
-                    print('Restoring user {}\'s shares and settings...'.format(user['title']))
-                    share(user['title'], user['sections'], user['allowSync'], user['camera'],
-                          user['channels'], user['filterMovies'], user['filterTelevision'],
-                          user['filterMusic'])
-            else:
-                print('Restoring user {}\'s shares and settings...'.format(user['title']))
-                share(user['title'], user['sections'], user['allowSync'], user['camera'],
-                      user['channels'], user['filterMovies'], user['filterTelevision'],
-                      user['filterMusic'])
\ No newline at end of file
+            backups = (user for user in iter_json_array(json_data) if not users or user['title'] in users)
+            restored = failed = 0
+            for user, error in restore_shares(backups, opts.workers, opts.rate):
+                if error:
+                    failed += 1
+                    sys.stderr.write("Restoring user {}'s shares failed: {}.\n".format(user['title'], error))
+                    continue
+                restored += 1
+                print('Restored user {}\'s shares and settings...'.format(user['title']))
+                print_share(user['title'], user['sections'], user['allowSync'], user['camera'],
+                            user['channels'], user['filterMovies'], user['filterTelevision'],
+                            user['filterMusic'])
+        print('Restored {} users, {} failed.'.format(restored, failed))
@@ -4,12 +4,16 @@ Pull poster images from Imgur and places them inside Shows root folder.
     /path/to/show/Show.jpg
     
 Skips download if showname.jpg exists or if show does not exist.
+Posters this script saved itself are downloaded again only when they changed.
 
 '''
 
 import requests
-import urllib
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.download import Downloader, DOWNLOADED, UNCHANGED, EXISTS
 
 
 ## Edit ##
@@ -20,6 +24,7 @@ ALBUM_ID = '7JeSw' # http://imgur.com/a/7JeSw  <--- 7JeSw is the ablum_id
 
 # Local info
 SHOW_PATH = 'D:\\Shows\\'
+WORKERS = 4  # Number of posters downloaded at the same time.
 
 ## /Edit ##
 
@@ -38,14 +43,22 @@ def get_imgur():
     return[IMGURINFO(data=d) for d in imgur_dump['data']]
 
 
-for x in get_imgur():
-    # Check if Show directory exists
-    if os.path.exists(os.path.join(SHOW_PATH, x.description)):
-        # Check if Show poster (show.jpg) exists
-        if os.path.exists((os.path.join(SHOW_PATH, x.description, x.description))):
-            print("Poster for {} was already downloaded or filename already exists, skipping.".format(x.description))
+def poster_jobs():
+    # (url, path) of the posters whose show directory exists.
+    for x in get_imgur():
+        # Check if Show directory exists
+        if os.path.exists(os.path.join(SHOW_PATH, x.description)):
+            yield x.link, '{}.jpg'.format(os.path.join(SHOW_PATH, x.description, x.description))
         else:
-            print("Downloading poster for {}.".format(x.description))
-            urllib.urlretrieve(x.link, '{}.jpg'.format((os.path.join(SHOW_PATH, x.description, x.description))))
-    else:
-        print("{} - {} did not match your library.".format(x.description, x.link))
+            print("{} - {} did not match your library.".format(x.description, x.link))
+
+
+downloader = Downloader('imgur_posters', workers=WORKERS)
+for link, poster_path, status in downloader.download(poster_jobs(), keep_existing=True):
+    name = os.path.basename(os.path.dirname(poster_path))
+    if status == EXISTS:
+        print("Poster for {} was already downloaded or filename already exists, skipping.".format(name))
+    elif status == UNCHANGED:
+        print("Poster for {} is unchanged.".format(name))
+    elif status == DOWNLOADED:
+        print("Downloaded poster for {}.".format(name))
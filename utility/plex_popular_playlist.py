@@ -7,20 +7,42 @@ optional arguments:
   --name []            Name your playlist
   --libraries  [ ...]  Space separated list of case sensitive names to process. Allowed names are:
                        (choices: ALL MUSIC LIBRARIES)*
-  --artists  [ ...]    Space separated list of case sensitive names to process. Allowed names are:
-                       (choices: ALL ARTIST NAMES)
+  --artists  [ ...]    Space separated list of case sensitive names to process.
+                       A unique beginning of the name is enough.
   --tracks []          Specify the track length you would like the playlist.
   --random []          Randomly select N artists.
 
 * LIBRARY_EXCLUDE are excluded from libraries choice.
 
+The artists of the music libraries are kept in an index in the jbops cache
+folder. It is brought up to date once a day with the artists updated since,
+or right away when --artists names an artist it does not know yet.
+
 '''
 
 
+import os
+import sys
 import requests
 from plexapi.server import PlexServer, CONFIG
 import argparse
 import random
+import difflib
+import hashlib
+import time
+from collections import OrderedDict, namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.cache import cache_path
+from jbops.choices import CachedChoices
+from jbops.fanout import fan_out
+from jbops.snapshot import SectionSnapshot
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    # Python 2
+    from urllib import urlencode
 
 # Edit
 PLEX_URL = ''
@@ -30,9 +52,16 @@ PLEX_TOKEN = CONFIG.data['auth'].get('server_token', PLEX_TOKEN)
 
 LIBRARY_EXCLUDE = ['Audio Books', 'Podcasts', 'Soundtracks']
 DEFAULT_NAME = 'Popular Music Playlist'
+WORKERS = 8  # Number of artists whose popular tracks are fetched at the same time.
+ARTIST_TTL = 24 * 60 * 60  # Seconds before the artist index is checked for changes.
 
 # /Edit
 
+ARTIST_COLUMNS = [('title', 'TEXT'), ('title_sort', 'TEXT')]
+
+# An artist of the index, with the attributes build_tracks() uses.
+Artist = namedtuple('Artist', ['ratingKey', 'title', 'titleSort', 'section'])
+
 sess = requests.Session()
 # Ignore verifying the SSL certificate
 sess.verify = False  # '/path/to/certfile'
@@ -45,13 +74,134 @@ if sess.verify is False:
 
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-plex = PlexServer(PLEX_URL, PLEX_TOKEN, session=sess)
-
-music_sections = [x.title for x in plex.library.sections() if x.type == 'artist' and x.title not in LIBRARY_EXCLUDE]
-
-artist_lst = []
-for section in music_sections:
-    artist_lst += [x.title.encode('utf-8') for x in plex.library.section(section).all() if section not in LIBRARY_EXCLUDE]
+plex = None
+
+
+def plex_server():
+    # Connect to Plex the first time it is needed, not at import.
+    global plex
+    if plex is None:
+        plex = PlexServer(PLEX_URL, PLEX_TOKEN, session=sess)
+    return plex
+
+
+def get_music_sections():
+    return [x.title for x in plex_server().library.sections()
+            if x.type == 'artist' and x.title not in LIBRARY_EXCLUDE]
+
+
+music_sections = CachedChoices('plex_music_sections', get_music_sections, key=PLEX_URL)
+
+
+def parse_artist(elem):
+    """Index row of an artist of a music section listing."""
+    title = elem.attrib.get('title', '')
+    return {'rating_key': int(elem.attrib['ratingKey']),
+            'title': title,
+            'title_sort': elem.attrib.get('titleSort') or title,
+            'updated_at': int(elem.attrib.get('updatedAt') or 0)}
+
+
+class ArtistIndex(SectionSnapshot):
+    def __init__(self, ttl=ARTIST_TTL):
+        """Artists of the music sections, saved between runs.
+
+        Checking --artists, looking artists up and picking random ones are
+        queries on this index. The sections are saved under their title,
+        the name --libraries uses. The file is named after the Plex URL so it
+        can be read without connecting.
+
+        Parameters
+        ----------
+        ttl : int
+            Seconds before the sections are checked for changes.
+        """
+        digest = hashlib.md5((PLEX_URL or '').encode('utf-8')).hexdigest()[:8]
+        SectionSnapshot.__init__(self, cache_path('plex_popular_playlist', '{}.sqlite'.format(digest)),
+                                 'artists', ARTIST_COLUMNS, indexes=[('title',)])
+        self.ttl = ttl
+        self.refreshed = False
+
+    def stale(self):
+        """True if a music section was never indexed or not checked for <ttl> seconds."""
+        now = time.time()
+        return any(now - (self.scanned_at(section) or 0) > self.ttl for section in music_sections)
+
+    def refresh(self):
+        """Bring the index up to date with the music sections on the server."""
+        titles = []
+        for section in plex_server().library.sections():
+            if section.type != 'artist' or section.title in LIBRARY_EXCLUDE:
+                continue
+            titles.append(section.title)
+            self.update(plex, section.title, '/library/sections/{}/all?type=8'.format(section.key), parse_artist)
+        # Sections that were removed or excluded since.
+        for section in self.sections():
+            if section not in titles:
+                self.clear(section)
+        self.refreshed = True
+
+    def refresh_if_stale(self):
+        if not self.refreshed and self.stale():
+            self.refresh()
+
+    def _select(self, where='', args=(), sections=None, order='title_sort COLLATE NOCASE', limit=None):
+        clauses = [where] if where else []
+        args = list(args)
+        if sections:
+            clauses.append('section_key IN ({})'.format(', '.join('?' * len(sections))))
+            args.extend(sections)
+        query = 'SELECT rating_key, title, title_sort, section_key FROM artists'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY ' + order
+        if limit:
+            query += ' LIMIT {:d}'.format(limit)
+        return [Artist(*row) for row in self.db.execute(query, args)]
+
+    def artists(self, sections=None):
+        """All artists, of <sections> if given, by sort title."""
+        return self._select(sections=sections)
+
+    def lookup(self, title, sections=None):
+        """Artists named exactly <title>, one per section they are in."""
+        return self._select('title = ?', [title], sections)
+
+    def prefix(self, text, sections=None):
+        """Artists whose title or sort title starts with <text>, ignoring case."""
+        pattern = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        return self._select("(title LIKE ? ESCAPE '\\' OR title_sort LIKE ? ESCAPE '\\')",
+                            [pattern, pattern], sections)
+
+    def fuzzy(self, text, count=5):
+        """Up to <count> artist titles that look like <text>, best first."""
+        titles = dict((title.lower(), title) for title, in self.db.execute('SELECT DISTINCT title FROM artists'))
+        return [titles[x] for x in difflib.get_close_matches(text.lower(), list(titles), n=count)]
+
+    def sample(self, count, sections=None):
+        """<count> random artists, of <sections> if given."""
+        return self._select(sections=sections, order='RANDOM()', limit=count)
+
+
+artist_index = ArtistIndex()
+
+
+def artist_name(text):
+    """argparse type of --artists: an artist title or a beginning only one title has."""
+    artist_index.refresh_if_stale()
+    if not artist_index.lookup(text) and not artist_index.refreshed:
+        # Maybe added since the index was refreshed.
+        artist_index.refresh()
+    if artist_index.lookup(text):
+        return text
+    titles = sorted(set(x.title for x in artist_index.prefix(text)))
+    if len(titles) == 1:
+        return titles[0]
+    suggestions = titles or artist_index.fuzzy(text)
+    message = 'unknown artist: {}'.format(text)
+    if suggestions:
+        message += ' (did you mean: {})'.format(', '.join(suggestions[:5]))
+    raise argparse.ArgumentTypeError(message)
 
 
 def fetch(path):
@@ -62,24 +212,41 @@ def fetch(path):
                'includePopularLeaves': '1'
                }
 
-    r = requests.get(url + path, headers=header, params=params, verify=False)
+    r = sess.get(url + path, headers=header, params=params)
     return r.json()['MediaContainer']['Metadata'][0]['PopularLeaves']['Metadata']
 
 
 def build_tracks(music_lst):
-    ratingKey_lst = []
-    track_lst = []
+    """Rating keys of the popular tracks of the artists, without duplicates.
 
-    for artist in music_lst:
+    The artists' popular tracks are fetched concurrently, the keys keep the
+    order of <music_lst>.
+    """
+    def popular(artist):
         try:
-            ratingKey_lst += fetch('/library/metadata/{}'.format(artist.ratingKey))
-            for tracks in ratingKey_lst:
-                track_lst.append(plex.fetchItem(int(tracks['ratingKey'])))
+            return [int(track['ratingKey']) for track in fetch('/library/metadata/{}'.format(artist.ratingKey))]
         except KeyError as e:
             print('Artist: {} does not have any popular tracks listed.'.format(artist.title))
             print('Error: {}'.format(e))
+            return []
+
+    seen = set()
+    ratingKey_lst = []
+    for keys in fan_out(popular, music_lst, workers=WORKERS):
+        for key in keys:
+            if key not in seen:
+                seen.add(key)
+                ratingKey_lst.append(key)
+    return ratingKey_lst
+
 
-    return track_lst
+def create_playlist(title, ratingKey_lst):
+    # Same request plexapi's createPlaylist() makes, from the rating keys
+    # instead of fetched track objects.
+    uri = 'server://{}/com.plexapp.plugins.library/library/metadata/{}'.format(
+        plex.machineIdentifier, ','.join(str(key) for key in ratingKey_lst))
+    params = {'uri': uri, 'type': 'audio', 'title': title, 'smart': 0}
+    plex.query('/playlists?{}'.format(urlencode(params)), method=plex._session.post)
 
 
 if __name__ == "__main__":
@@ -91,9 +258,9 @@ if __name__ == "__main__":
     parser.add_argument('--libraries', nargs='+', default=False, choices=music_sections, metavar='',
                         help='Space separated list of case sensitive names to process. Allowed names are: \n'
                              '(choices: %(choices)s)')
-    parser.add_argument('--artists', nargs='+', default=False, choices=artist_lst, metavar='',
-                        help='Space separated list of case sensitive names to process. Allowed names are: \n'
-                             '(choices: %(choices)s)')
+    parser.add_argument('--artists', nargs='+', default=False, type=artist_name, metavar='',
+                        help='Space separated list of case sensitive names to process.\n'
+                             'A unique beginning of the name is enough.')
 
     parser.add_argument('--tracks', nargs='?', default=False, type=int, metavar='',
                         help='Specify the track length you would like the playlist.')
@@ -101,36 +268,32 @@ if __name__ == "__main__":
                         help='Randomly select N artists.')
 
     opts = parser.parse_args()
+    plex_server()
     playlist = []
 
     if opts.libraries and not opts.artists and not opts.random:
-        for section in opts.libraries:
-            playlist += build_tracks(plex.library.section(section).all())
-
-    elif opts.libraries and opts.artists and not opts.random:
-        for artist in opts.artists:
-            for section in opts.libraries:
-                artist_objects = [x for x in plex.library.section(section).all() if x.title == artist]
-                playlist += build_tracks(artist_objects)
-
-    elif not opts.libraries and opts.artists and not opts.random:
-        for artist in opts.artists:
-            for section in music_sections:
-                artist_objects = [x for x in plex.library.section(section).all() if x.title == artist]
-                playlist += build_tracks(artist_objects)
-
-    elif not opts.libraries and not opts.artists and opts.random:
-        rand_artists = random.sample((artist_lst), opts.random)
-        for artist in rand_artists:
-            for section in music_sections:
-                artist_objects = [x for x in plex.library.section(section).all() if x.title == artist]
-                playlist += build_tracks(artist_objects)
+        artist_index.refresh_if_stale()
+        playlist += build_tracks(artist_index.artists(opts.libraries))
+
+    elif opts.random:
+        artist_index.refresh_if_stale()
+        playlist += build_tracks(artist_index.sample(opts.random, opts.libraries))
+
+    elif opts.artists:
+        artist_objects = [x for artist in opts.artists for x in artist_index.lookup(artist, opts.libraries)]
+        playlist += build_tracks(artist_objects)
+
+    # A track found through several libraries is added once.
+    playlist = list(OrderedDict.fromkeys(playlist))
 
     if opts.tracks and opts.random:
-        playlist = random.sample((playlist), opts.tracks)
+        playlist = random.sample((playlist), min(opts.tracks, len(playlist)))
         
     elif opts.tracks and not opts.random:
         playlist = playlist[:opts.tracks]
 
     # Create Playlist
-    plex.createPlaylist(opts.name, playlist)
+    if playlist:
+        create_playlist(opts.name, playlist)
+    else:
+        print('No popular tracks found.')
@@ -3,6 +3,10 @@
 Download theme songs from Plex TV Shows. Theme songs are mp3 and named by shows as displayed by Plex.
 Songs are saved in a 'Theme Songs' directory located in script's path.
 
+The TVDB ids come from one listing of the library, the songs are downloaded
+WORKERS at a time. Songs already saved are only downloaded again when they
+changed, an interrupted run skips what it already finished.
+
 '''
 
 
@@ -10,9 +14,12 @@ from plexapi.server import PlexServer, CONFIG
 # pip install plexapi
 import os
 import re
-import urllib
+import sys
 import requests
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.download import Downloader, FAILED
+
 ## Edit ##
 PLEX_URL = ''
 PLEX_TOKEN = ''
@@ -20,6 +27,7 @@ PLEX_URL = CONFIG.data['auth'].get('server_baseurl', PLEX_URL)
 PLEX_TOKEN = CONFIG.data['auth'].get('server_token', PLEX_TOKEN)
 
 TV_LIBRARY = 'TV Shows' # Name of your TV Show library
+WORKERS = 8  # Number of theme songs downloaded at the same time.
 ## /Edit ##
 
 sess = requests.Session()
@@ -44,13 +52,32 @@ out_path = os.path.join(os.path.dirname(__file__), 'Theme Songs')
 if not os.path.isdir(out_path):
     os.mkdir(out_path)
 
-# Get episodes from TV Shows
-for show in plex.library.section(TV_LIBRARY).all():
-    # Remove special characters from name
-    filename = '{}.mp3'.format(re.sub('\W+',' ', show.title))
-    # Set output path
-    theme_path = os.path.join(out_path, filename)
-    # Get tvdb_if from first episode, no need to go through all episodes
-    tvdb_id = show.episodes()[0].guid.split('/')[2]
-    # Download theme song to output path
-    urllib.urlretrieve(themes_url.format(tvdb_id), theme_path)
+
+def tvdb_id(elem):
+    # TVDB id of a show from its guid (legacy agent) or its Guid tags (Plex agent).
+    guids = [elem.attrib.get('guid', '')] + [x.attrib.get('id', '') for x in elem.findall('Guid')]
+    for guid in guids:
+        match = re.match(r'(?:com\.plexapp\.agents\.thetvdb|tvdb)://(\d+)', guid)
+        if match:
+            return match.group(1)
+    return None
+
+
+def theme_jobs():
+    # (url, path) of the theme song of every show in TV_LIBRARY.
+    section = plex.library.section(TV_LIBRARY)
+    for elem in plex.query('/library/sections/{}/all?includeGuids=1'.format(section.key)):
+        title = elem.attrib.get('title', '')
+        show_id = tvdb_id(elem)
+        if not show_id:
+            print('{} has no TVDB id, skipping.'.format(title))
+            continue
+        # Remove special characters from name
+        filename = '{}.mp3'.format(re.sub(r'\W+', ' ', title))
+        yield themes_url.format(show_id), os.path.join(out_path, filename)
+
+
+downloader = Downloader('plex_theme_songs', session=sess, workers=WORKERS)
+for url, theme_path, status in downloader.download(theme_jobs()):
+    if status != FAILED:
+        print('{}: {}'.format(os.path.basename(theme_path), status))
@@ -5,9 +5,13 @@ Author: DirtyCajunRice
 Requires: requests, plexapi
 """
 
-import requests
+import os
+import sys
 from plexapi.myplex import MyPlexAccount
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+
 TAUTULLI_BASE_URL = ''
 TAUTULLI_API_KEY = ''
 
@@ -19,10 +23,9 @@ BACKUP_DB = True
 
 # Do not edit past this line #
 account = MyPlexAccount(PLEX_USERNAME, PLEX_PASSWORD)
+tautulli = Tautulli('http://{}'.format(TAUTULLI_BASE_URL), TAUTULLI_API_KEY)
 
-payload = {'apikey': TAUTULLI_API_KEY, 'cmd': 'get_user_names'}
-tautulli_users = requests.get('http://{}/api/v2'
-                              .format(TAUTULLI_BASE_URL), params=payload).json()['response']['data']
+tautulli_users = tautulli.api_call('get_user_names')
 
 plex_friend_ids = [friend.id for friend in account.users()]
 tautulli_user_ids = [user['user_id'] for user in tautulli_users]
@@ -30,12 +33,8 @@ tautulli_user_ids = [user['user_id'] for user in tautulli_users]
 removed_user_ids = [user_id for user_id in tautulli_user_ids if user_id not in plex_friend_ids]
 
 if BACKUP_DB:
-    payload['cmd'] = 'backup_db'
-    backup = requests.get('http://{}/api/v2'.format(TAUTULLI_BASE_URL), params=payload)
+    backup = tautulli.api_call('backup_db')
 
 if removed_user_ids:
-    payload['cmd'] = 'delete_user'
-
     for user_id in removed_user_ids:
-        payload['user_id'] = user_id
-        remove_user = requests.get('http://{}/api/v2'.format(TAUTULLI_BASE_URL), params=payload)
+        remove_user = tautulli.api_call('delete_user', {'user_id': user_id})
@@ -7,11 +7,16 @@ Just run.
 Comment out `remove_friend(username)` and `unshare(username)` to test.
 """
 
+import os
+import sys
 import requests
 import datetime
 import time
 from plexapi.server import PlexServer, CONFIG
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+
 
 ## EDIT THESE SETTINGS ##
 PLEX_URL = ''
@@ -57,18 +62,16 @@ users_dict.update(admin)
 today = time.mktime(datetime.datetime.today().timetuple())
 
 
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+
+
 def get_users_table():
     # Get the Tautulli history.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_users_table',
-               'order_column': 'last_seen',
+    payload = {'order_column': 'last_seen',
                'order_dir': 'asc'}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        res_data = response['response']['data']['data']
+        res_data = tautulli.api_call('get_users_table', payload)['data']
         return [data for data in res_data if data['last_seen']]
 
     except Exception as e:
@@ -5,22 +5,25 @@ If all users have watched movie than delete.
 Deletion is prompted
 """
 
-import requests
 import sys
 import os
 import shutil
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+from jbops.fanout import fan_out
+from jbops.history import HistoryStore
+
 
 ## EDIT THESE SETTINGS ##
 TAUTULLI_APIKEY = 'xxxxxxxx'  # Your Tautulli API key
 TAUTULLI_URL = 'http://localhost:8181/'  # Your Tautulli URL
 LIBRARY_NAMES = ['My Movies'] # Whatever your movie libraries are called.
 USER_LST = ['Joe', 'Alex'] # Name of users
+WORKERS = 8 # Number of get_metadata calls to run at the same time.
 
-class UserHIS(object):
-    def __init__(self, data=None):
-        d = data or {}
-        self.rating_key = d['rating_key']
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY, pool_maxsize=WORKERS)
+history_db = HistoryStore(tautulli)
 
 
 class METAINFO(object):
@@ -34,16 +37,11 @@ class METAINFO(object):
 
 def get_metadata(rating_key):
     # Get the metadata for a media item.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'rating_key': rating_key,
-               'cmd': 'get_metadata',
+    payload = {'rating_key': rating_key,
                'media_info': True}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        res_data = response['response']['data']
+        res_data = tautulli.api_call('get_metadata', payload)
         if res_data['library_name'] in LIBRARY_NAMES:
             return METAINFO(data=res_data)
 
@@ -52,24 +50,9 @@ def get_metadata(rating_key):
         pass
 
 
-def get_history(user, start, length):
-    # Get the Tautulli history.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_history',
-               'user': user,
-               'media_type': 'movie',
-               'start': start,
-               'length': length}
-
-    try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        res_data = response['response']['data']['data']
-        return [UserHIS(data=d) for d in res_data if d['watched_status'] == 1]
-
-    except Exception as e:
-        sys.stderr.write("Tautulli API 'get_history' request failed: {0}.".format(e))
+def get_watched_by_all():
+    # Rating keys of the movies every listed user watched, from the local history store.
+    return history_db.watched_by_all(USER_LST, media_type='movie')
 
 
 def delete_files(tmp_lst):
@@ -81,46 +64,20 @@ def delete_files(tmp_lst):
     else:
         print('Ok. doing nothing.')
 
-movie_dict = {}
-movie_lst = []
 delete_lst = []
 
-count = 25
-for user in USER_LST:
-    start = 0
-    while True:
-        # Getting all watched history for listed users
-        history = get_history(user, start, count)
-        try:
-            if all([history]):
-                start += count
-                for h in history:
-                    # Getting metadata of what was watched
-                    movies = get_metadata(h.rating_key)
-                    if not any(d['title'] == movies.title for d in movie_lst):
-                        movie_dict = {
-                            'title': movies.title,
-                            'file': movies.file,
-                            'watched_by': [user]
-                        }
-                        movie_lst.append(movie_dict)
-                    else:
-                        for d in movie_lst:
-                            if d['title'] == movies.title:
-                                d['watched_by'].append(user)
-                continue
-            elif not all([history]):
-                break
-
-            start += count
-        except Exception as e:
-            print(e)
-            pass
-
-for movie_dict in movie_lst:
-    for key, value in movie_dict.items():
-        if value == USER_LST:
-            print(u"{} has been watched by {}".format(movie_dict['title']," & ".join(USER_LST)))
-            delete_lst.append(movie_dict['file'])
+try:
+    history_db.sync()
+except Exception as e:
+    # Never delete files based on a local history that may be out of date.
+    sys.stderr.write("Tautulli API 'get_history' request failed: {0}.\n".format(e))
+    sys.exit(1)
+
+# Getting metadata only of what everyone watched
+for movies in fan_out(get_metadata, sorted(get_watched_by_all()), workers=WORKERS):
+    if not movies:
+        continue
+    print(u"{} has been watched by {}".format(movies.title, " & ".join(USER_LST)))
+    delete_lst.append(movies.file)
 
 delete_files(delete_lst)
@@ -51,6 +51,7 @@ Concurrent stream count is the trigger. Trigger can be anything you want.
 """
 
 
+import os
 import requests
 import sys
 from xml.dom import minidom
@@ -58,6 +59,9 @@ from email.mime.text import MIMEText
 import email.utils
 import smtplib
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.tautulli import Tautulli
+
 
 ## EDIT THESE SETTINGS ###
 
@@ -109,6 +113,9 @@ email_password = '' # Your email password
 
 ## DO NOT EDIT BELOW ##
 
+tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+
+
 class Activity(object):
     def __init__(self, data=None):
         d = data or {}
@@ -132,15 +139,12 @@ class Users(object):
 
 def get_user(user_id):
     # Get the user list from Tautulli.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_user',
-               'user_id': int(user_id)}
+    payload = {'user_id': int(user_id)}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        email = response['response']['data']['email']
-        friend_name = response['response']['data']['friendly_name']
+        res_data = tautulli.api_call('get_user', payload)
+        email = res_data['email']
+        friend_name = res_data['friendly_name']
         return [email, friend_name]
 
     except Exception as e:
@@ -149,16 +153,12 @@ def get_user(user_id):
 
 def get_history(user_id, bankey):
     # Get the user history from Tautulli. Length matters!
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_history',
-               'rating_key': bankey,
+    payload = {'rating_key': bankey,
                'user_id': user_id,
                'length': 10000}
 
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        rec_filtered = response['response']['data']['recordsFiltered']
+        rec_filtered = tautulli.api_call('get_history', payload)['recordsFiltered']
         # grow this out how you will
         if rec_filtered < VIOLATION_LIMIT:
             return rec_filtered
@@ -244,13 +244,8 @@ def unshare(user_id):
 
 def get_activity():
     # Get the user IP list from Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_activity'}
-
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']['sessions']
+        res_data = tautulli.api_call('get_activity')['sessions']
         return [Activity(data=d) for d in res_data]
 
     except Exception as e:
@@ -45,16 +45,26 @@ Taultulli > Settings > Notification Agents > New Script > Script Arguments:
     plex_api_share.py --userFrom USER1 --userTo USER2 USER3 --allLibraries
        - Synced watch status of {title from library} to {USER2 or USER3}'s account.
 
+    sync_watch_status.py --userFrom USER1 --userTo USER2 --allLibraries --dryrun
+       - {count} of {watched} watched items in {library} would be synced to {USER2}'s account.
+
     Excluding;
     --libraries becomes excluded if --allLibraries is set
     sync_watch_status.py --userFrom USER1 --userTo USER2 --allLibraries --libraries Movies
        - Shared [all libraries but Movies] with USER.
 
 """
+import os
+import sys
 import requests
 import argparse
 from plexapi.server import PlexServer, CONFIG
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from jbops.choices import CachedChoices
+from jbops.plexusers import UserTokens
+from jbops.fanout import fan_out
+
 # Using CONFIG file
 PLEX_URL = ''
 PLEX_TOKEN = ''
@@ -65,6 +75,12 @@ if not PLEX_URL:
 if not PLEX_TOKEN:
     PLEX_TOKEN = CONFIG.data['auth'].get('server_token', '')
 
+# Items requested per page when reading a library listing.
+PAGE_SIZE = 1000
+# Listing type of the items that have a watch status, per library type.
+WATCHED_TYPES = {'movie': 1, 'show': 4}
+# Items marked watched at the same time.
+WORKERS = 8
 
 sess = requests.Session()
 # Ignore verifying the SSL certificate
@@ -78,38 +94,114 @@ if sess.verify is False:
 
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-plex = PlexServer(PLEX_URL, PLEX_TOKEN, session=sess)
+plex = None
+user_tokens = None
+
+
+def plex_server():
+    # Connect to Plex the first time it is needed, not at import.
+    global plex
+    if plex is None:
+        plex = PlexServer(PLEX_URL, PLEX_TOKEN, session=sess)
+    return plex
+
+
+def get_users():
+    account = plex_server().myPlexAccount()
+    user_lst = [x.title for x in account.users()]
+    # Adding admin account name to list
+    user_lst.append(account.title)
+    return user_lst
+
+
+section_choices = CachedChoices('plex_sections', lambda: [x.title for x in plex_server().library.sections()],
+                                key=PLEX_URL)
+user_choices = CachedChoices('plex_users_and_admin', get_users, key=PLEX_URL)
 
-sections_lst = [x.title for x in plex.library.sections()]
-user_lst = [x.title for x in plex.myPlexAccount().users()]
-# Adding admin account name to list
-user_lst.append(plex.myPlexAccount().title)
 
 def get_account(user):
-    if user == plex.myPlexAccount().title:
-        server = plex
-    else:
-        # Access Plex User's Account
-        userAccount = plex.myPlexAccount().user(user)
-        token = userAccount.get_token(plex.machineIdentifier)
-        server = PlexServer(PLEX_URL, token)
-    return server
-
-
-def mark_watached(sectionFrom, accountTo, userTo):
-    # Check sections for watched items
-    for item in sectionFrom.search(unwatched=False):
-        title = item.title.encode('utf-8')
-        # Check movie media type
-        if item.type == 'movie':
-            accountTo.fetchItem(item.key).markWatched()
-            print('Synced watch status of {} to {}\'s account.'.format(title, userTo))
-        # Check show media type
-        elif item.type == 'show':
-            for episode in sectionFrom.searchEpisodes(unwatched=False, title=title):
-                ep_title = episode.title.encode('utf-8')
-                accountTo.fetchItem(episode.key).markWatched()
-                print('Synced watch status of {} - {} to {}\'s account.'.format(title, ep_title, userTo))
+    # Access Plex User's Account, the admin's own name returns the admin server.
+    global user_tokens
+    if user_tokens is None:
+        user_tokens = UserTokens(plex.myPlexAccount(), plex)
+    return user_tokens.connect(user)
+
+
+def watched_items(server, section):
+    """Watched movies or episodes of a library, for the user <server> is connected as.
+
+    Parameters
+    ----------
+    server: Object
+        plexServerObject of the user
+    section: Object
+        plexLibrarySection
+
+    Returns
+    -------
+    dict
+        {ratingKey: title}
+    """
+    if section.type not in WATCHED_TYPES:
+        raise ValueError('Unknown watch status for {} libraries'.format(section.type))
+    # >>= is Plex for greater than.
+    path = '/library/sections/{}/all?type={}&viewCount>>=0'.format(section.key, WATCHED_TYPES[section.type])
+    watched = {}
+    start = 0
+    while True:
+        headers = {'X-Plex-Container-Start': str(start),
+                   'X-Plex-Container-Size': str(PAGE_SIZE)}
+        container = server.query(path, headers=headers)
+        elems = list(container)
+        for elem in elems:
+            title = elem.attrib.get('title')
+            if elem.attrib.get('grandparentTitle'):
+                title = u'{} - {}'.format(elem.attrib['grandparentTitle'], title)
+            watched[elem.attrib['ratingKey']] = title
+        start += len(elems)
+        if not elems or start >= int(container.attrib.get('totalSize', start)):
+            break
+    return watched
+
+
+def mark_watached(watchedFrom, section, accountTo, userTo, dryrun=False):
+    """Mark what the other user watched in <section> as watched for <userTo>.
+
+    Only the items <userTo> has not watched yet are marked.
+
+    Parameters
+    ----------
+    watchedFrom: dict
+        watched_items of the user to sync from
+    section: Object
+        plexLibrarySection
+    accountTo: Object
+        plexServerObject of <userTo>
+    userTo: str
+    dryrun: bool
+        Only count the items that would be marked.
+
+    Returns
+    -------
+    int
+        Number of items marked, or that would be marked.
+    """
+    watchedTo = watched_items(accountTo, section)
+    missing = [(key, title) for key, title in watchedFrom.items() if key not in watchedTo]
+    if dryrun:
+        print('{} of {} watched items in {} would be synced to {}\'s account.'.format(
+            len(missing), len(watchedFrom), section.title, userTo))
+        return len(missing)
+
+    def scrobble(item):
+        key, title = item
+        # The same call plexapi's markWatched() makes, without fetching the item first.
+        accountTo.query('/:/scrobble?key={}&identifier=com.plexapp.plugins.library'.format(key))
+        return title
+
+    for title in fan_out(scrobble, missing, workers=WORKERS, ordered=False):
+        print(u'Synced watch status of {} to {}\'s account.'.format(title, userTo))
+    return len(missing)
 
 
 if __name__ == '__main__':
@@ -117,22 +209,27 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Sync watch status from one user to others.",
                                      formatter_class=argparse.RawTextHelpFormatter)
     requiredNamed = parser.add_argument_group('required named arguments')
-    parser.add_argument('--libraries', nargs='*', choices=sections_lst, metavar='library',
+    parser.add_argument('--libraries', nargs='*', choices=section_choices, metavar='library',
                         help='Space separated list of case sensitive names to process. Allowed names are: \n'
                              '(choices: %(choices)s)')
     parser.add_argument('--allLibraries', action='store_true',
                         help='Select all libraries.')
     parser.add_argument('--ratingKey', nargs=1,
                         help='Rating key of item whose watch status is to be synced.')
-    requiredNamed.add_argument('--userFrom', choices=user_lst, metavar='username', required=True,
+    parser.add_argument('--dryrun', action='store_true',
+                        help='Only count the items that would be marked watched.')
+    requiredNamed.add_argument('--userFrom', choices=user_choices, metavar='username', required=True,
                         help='Space separated list of case sensitive names to process. Allowed names are: \n'
                              '(choices: %(choices)s)')
-    requiredNamed.add_argument('--userTo', nargs='*', choices=user_lst, metavar='usernames', required=True,
+    requiredNamed.add_argument('--userTo', nargs='*', choices=user_choices, metavar='usernames', required=True,
                         help='Space separated list of case sensitive names to process. Allowed names are: \n'
                              '(choices: %(choices)s)')
 
     opts = parser.parse_args()
     # print(opts)
+    plex_server()
+    # The choices may be a day old, act on what Plex has now.
+    sections_lst = [x.title for x in plex.library.sections()]
 
     # Create Sync-From user account
     plexFrom = get_account(opts.userFrom)
@@ -149,6 +246,9 @@ if __name__ == '__main__':
             sections_lst.remove(library)
             libraries = sections_lst
 
+    # Watched items of the Sync-From user, listed once per library
+    watchedFrom = {}
+
     # Go through list of users
     for user in opts.userTo:
         # Create Sync-To user account
@@ -160,7 +260,9 @@ if __name__ == '__main__':
                     print('Checking library: {}'.format(library))
                     # Check library for watched items
                     section = plexFrom.library.section(library)
-                    mark_watached(section, plexTo, user)
+                    if library not in watchedFrom:
+                        watchedFrom[library] = watched_items(plexFrom, section)
+                    mark_watached(watchedFrom[library], section, plexTo, user, opts.dryrun)
                 except Exception as e:
                     if str(e).startswith('Unknown'):
                         print('Library ({}) does not have a watch status.'.format(library))
@@ -175,7 +277,10 @@ if __name__ == '__main__':
         elif opts.ratingKey:
             item = plexTo.fetchItem(opts.ratingKey)
             title = item.title.encode('utf-8')
-            print('Syncing watch status of {} to {}\'s account.'.format(title, user))
-            item.markWatched()
+            if opts.dryrun:
+                print('Would sync watch status of {} to {}\'s account.'.format(title, user))
+            else:
+                print('Syncing watch status of {} to {}\'s account.'.format(title, user))
+                item.markWatched()
         else:
             print('No libraries or rating key provided.')